@@ -1,6 +1,6 @@
-from flask import Flask, render_template, request, jsonify, send_file, send_from_directory
+from flask import Flask, render_template, request, jsonify, send_file, send_from_directory, Response, redirect
 from flask_cors import CORS
-from urllib.parse import unquote
+from urllib.parse import unquote, quote
 import yt_dlp
 import os
 import logging
@@ -14,9 +14,33 @@ from sendgrid import SendGridAPIClient
 from sendgrid.helpers.mail import Mail
 import re
 import time
-import tempfile
+import copy
+import contextvars
+import subprocess
+import socket
+import sys
 from os.path import join, dirname
 from dotenv import load_dotenv
+from jobs import JobManager, QueueFullError, JobCancelled
+from scheduler import LaneScheduler, classify, SHORT
+from progress import ProgressRegistry, FINAL_STATES
+from download_cache import DownloadCache
+from fileops import move_into_place
+from metadata import InfoCache, summarize_info, normalize_url
+from catalog import FileCatalog
+from fileserve import serve_file, content_disposition
+from streaming import MediaStream, StreamError, STREAM_FORMATS
+from throughput import HostLimiter, BandwidthBudget, CombinedProgress
+from storage import StorageManager, estimate_size
+from journal import JobJournal
+from health import HealthMonitor
+from batch import BatchManager, stream_zip
+from transcode import TranscodeEngine, AUDIO_FORMATS, TARGETS
+from store import open_store, JOBS, PROGRESS, CANCEL, FILES
+from metrics import MetricsRegistry, span
+from platforms import PlatformRouter
+from feedback_store import FeedbackStore
+from logconfig import setup_logging, start_listener, parse_level, JobLogBuffer, YtDlpLogger
 
 # 尝试加载环境变量，如果.env文件存在
 try:
@@ -29,333 +53,1238 @@ app = Flask(__name__)
 # 启用CORS，允许所有来源的请求
 CORS(app)
 
-# 日志设置
-logging.basicConfig(level=logging.INFO)
+# 日志设置：请求和下载线程只把记录放进队列，由后台线程输出 JSON（LOG_FORMAT=text 为单行文本）；
+# LOG_FILE 不为空时同时写入按大小轮转的文件。下载任务的日志另外按任务保留最近 JOB_LOG_LINES 行，由 /jobs/<id> 返回
+LOG_LEVEL = os.environ.get('LOG_LEVEL', 'INFO').upper()
+LOG_FORMAT = os.environ.get('LOG_FORMAT', 'json').lower()
+LOG_FILE = os.environ.get('LOG_FILE') or None
+LOG_FILE_MAX_BYTES = int(os.environ.get('LOG_FILE_MAX_BYTES', 50 * 1024 * 1024))
+LOG_FILE_BACKUPS = int(os.environ.get('LOG_FILE_BACKUPS', 5))
+LOG_QUEUE_SIZE = int(os.environ.get('LOG_QUEUE_SIZE', 10000))
+JOB_LOG_LINES = int(os.environ.get('JOB_LOG_LINES', 200))
+# yt-dlp 输出的级别（DEBUG 相当于原来的 verbose），以及下载进度行的抽样间隔（秒）
+YTDLP_LOG_LEVEL_NAME = os.environ.get('YTDLP_LOG_LEVEL', 'INFO')
+YTDLP_LOG_LEVEL = parse_level(YTDLP_LOG_LEVEL_NAME, default=None)
+YTDLP_PROGRESS_INTERVAL = float(os.environ.get('YTDLP_PROGRESS_INTERVAL', 10))
+job_logs = JobLogBuffer(max_lines=JOB_LOG_LINES)
+log_handler = setup_logging(
+    level=LOG_LEVEL,
+    fmt=LOG_FORMAT,
+    log_file=LOG_FILE,
+    max_bytes=LOG_FILE_MAX_BYTES,
+    backup_count=LOG_FILE_BACKUPS,
+    queue_size=LOG_QUEUE_SIZE,
+    job_buffer=job_logs,
+    # 输出线程和其他后台线程一起在 start_background_tasks 中启动
+    start=False,
+)
 logger = logging.getLogger(__name__)
+ytdlp_logger = logging.getLogger('yt_dlp')
+if parse_level(LOG_LEVEL, default=None) is None:
+    logger.warning(f"无效的 LOG_LEVEL: {LOG_LEVEL}，使用 INFO")
+if YTDLP_LOG_LEVEL is None:
+    logger.warning(f"无效的 YTDLP_LOG_LEVEL: {YTDLP_LOG_LEVEL_NAME}，使用 INFO")
+    YTDLP_LOG_LEVEL = logging.INFO
 
 # 配置路径
 DOWNLOAD_FOLDER = os.environ.get('DOWNLOAD_FOLDER', '/tmp/downloads')
 FFMPEG_PATH = os.environ.get('FFMPEG_PATH', '/usr/bin')
 
-# 下载进度全局变量
-download_progress = {
-    "status": "idle",  # idle, downloading, finished, error
-    "percent": "0.0%",
-    "message": "",
-    "speed": "",
-    "eta": ""
-}
-progress_lock = threading.Lock()
+# 后台下载线程数和队列长度
+DOWNLOAD_WORKERS = int(os.environ.get('DOWNLOAD_WORKERS', 2))
+DOWNLOAD_QUEUE_SIZE = int(os.environ.get('DOWNLOAD_QUEUE_SIZE', 100))
+
+# 调度：时长不超过 SHORT_JOB_SECONDS（没有时长时按估算大小 SHORT_JOB_BYTES）的任务进入短任务车道优先执行，
+# 长任务和直播最多同时占用 LONG_JOB_WORKERS 个下载线程（0 表示线程数减一）；每个客户端最多 MAX_JOBS_PER_CLIENT 个
+# 排队或运行中的任务，预计等待超过 MAX_QUEUE_WAIT 秒时直接返回 429（均为 0 表示不限）
+SHORT_JOB_SECONDS = int(os.environ.get('SHORT_JOB_SECONDS', 600))
+SHORT_JOB_BYTES = int(os.environ.get('SHORT_JOB_BYTES', 200 * 1024 * 1024))
+LONG_JOB_WORKERS = int(os.environ.get('LONG_JOB_WORKERS', 0))
+MAX_JOBS_PER_CLIENT = int(os.environ.get('MAX_JOBS_PER_CLIENT', 5))
+MAX_QUEUE_WAIT = int(os.environ.get('MAX_QUEUE_WAIT', 0))
+# 在反向代理后面时按 X-Forwarded-For 识别客户端
+TRUST_PROXY_HEADERS = os.environ.get('TRUST_PROXY_HEADERS', '0') != '0'
+
+# 多进程 / 多节点共享的任务、进度和文件位置：memory（仅本进程）、sqlite（同一台机器的多个 worker）、redis（多台机器）
+STATE_BACKEND = os.environ.get('STATE_BACKEND', 'memory').lower()
+STATE_SQLITE_PATH = os.environ.get('STATE_SQLITE_PATH', os.path.join(DOWNLOAD_FOLDER, '.state.sqlite3'))
+STATE_REDIS_URL = os.environ.get('STATE_REDIS_URL', 'redis://127.0.0.1:6379/0')
+# 本节点标识和其他节点可访问的地址，文件不在本节点时重定向到持有文件的节点
+NODE_ID = os.environ.get('NODE_ID') or socket.gethostname()
+NODE_URL = os.environ.get('NODE_URL', '').rstrip('/')
+shared_store = open_store(STATE_BACKEND, sqlite_path=STATE_SQLITE_PATH, redis_url=STATE_REDIS_URL)
+# 未结束的任务在共享存储中的保留时间
+ACTIVE_STATE_TTL = 24 * 3600
+
+def share_state(action, *args, **kwargs):
+    """访问共享存储，失败只记录日志，不影响下载"""
+    try:
+        return action(*args, **kwargs)
+    except Exception as e:
+        logger.warning(f"共享状态同步失败: {str(e)}")
+        return None
+
+def publish_job(job):
+    ttl = PROGRESS_TTL if job.done else ACTIVE_STATE_TTL
+    share_state(shared_store.set, JOBS, job.id, {**job.to_dict(), 'node': NODE_ID}, ttl=ttl)
+
+def publish_files(entries):
+    records = {e['name']: {'node': NODE_ID, 'url': NODE_URL, 'size': e['size'], 'mtime': e['mtime']}
+               for e in entries}
+    share_state(shared_store.hset_many, FILES, records)
+
+def unpublish_files(names):
+    # 同名文件可能已由其他节点登记，只删除自己的记录
+    for name in names:
+        record = share_state(shared_store.hget, FILES, name)
+        if record and record.get('node') == NODE_ID:
+            share_state(shared_store.hdel, FILES, name)
+
+def remote_file_url(name):
+    """文件登记在其他节点上时返回该节点上的地址"""
+    record = share_state(shared_store.hget, FILES, name)
+    if record and record.get('node') != NODE_ID and record.get('url'):
+        return f"{record['url']}/download_file/{quote(name)}"
+    return None
+
+def remote_cancel_requested(job):
+    """其他 worker 收到的取消请求通过共享存储转交给执行任务的 worker"""
+    if share_state(shared_store.get, CANCEL, job.id):
+        share_state(shared_store.delete, CANCEL, job.id)
+        return True
+    return False
+
+# 按任务保存的下载进度
+PROGRESS_TTL = int(os.environ.get('PROGRESS_TTL', 600))
+PROGRESS_MAX_ENTRIES = int(os.environ.get('PROGRESS_MAX_ENTRIES', 1000))
+PROGRESS_MIN_INTERVAL = float(os.environ.get('PROGRESS_MIN_INTERVAL', 0.25))
+# 每个 SSE 连接每秒最多推送的进度条数
+PROGRESS_STREAM_MAX_RATE = float(os.environ.get('PROGRESS_STREAM_MAX_RATE', 2))
+# 任务在其他 worker / 节点上时，SSE 轮询共享存储的间隔（秒）
+REMOTE_PROGRESS_POLL_INTERVAL = float(os.environ.get('REMOTE_PROGRESS_POLL_INTERVAL', 1))
+download_progress = ProgressRegistry(
+    max_entries=PROGRESS_MAX_ENTRIES,
+    ttl=PROGRESS_TTL,
+    min_interval=PROGRESS_MIN_INTERVAL,
+    on_change=lambda job_id, data: share_state(
+        shared_store.set, PROGRESS, job_id, data,
+        ttl=PROGRESS_TTL if data['status'] in FINAL_STATES else ACTIVE_STATE_TTL,
+    ),
+)
 
 # 确保下载目录存在
 if not os.path.exists(DOWNLOAD_FOLDER):
     os.makedirs(DOWNLOAD_FOLDER, exist_ok=True)
     logger.info(f"已创建下载目录: {DOWNLOAD_FOLDER}")
 
+# 下载目录索引，首页分页展示
+FILES_PER_PAGE = int(os.environ.get('FILES_PER_PAGE', 50))
+file_catalog = FileCatalog(DOWNLOAD_FOLDER, on_add=publish_files, on_remove=unpublish_files)
+
+# 文件发送方式：留空由 Python 发送，nginx 使用 X-Accel-Redirect，sendfile 使用 X-Sendfile
+FILE_OFFLOAD = os.environ.get('FILE_OFFLOAD', '').lower() or None
+ACCEL_REDIRECT_PREFIX = os.environ.get('ACCEL_REDIRECT_PREFIX', '/protected-downloads/')
+
+# 下载缓存：相同视频和格式直接返回已有文件（容量由下面的存储管理统一控制）
+# 索引存放在 SQLite 中，多个 worker 共用；旧版的 JSON 索引启动时自动导入
+CACHE_INDEX_PATH = os.environ.get('CACHE_INDEX_PATH', os.path.join(DOWNLOAD_FOLDER, '.cache_index.sqlite3'))
+download_cache = DownloadCache(DOWNLOAD_FOLDER, CACHE_INDEX_PATH,
+                               legacy_path=os.path.join(DOWNLOAD_FOLDER, '.cache_index.json'))
+
+# 下载吞吐配置：分片并发数、是否并行下载音视频流、每个域名的连接上限、全局带宽（字节/秒，0 不限）
+DOWNLOAD_FRAGMENTS = int(os.environ.get('DOWNLOAD_FRAGMENTS', 4))
+PARALLEL_STREAMS = os.environ.get('PARALLEL_STREAMS', '1') != '0'
+MAX_CONNECTIONS_PER_HOST = int(os.environ.get('MAX_CONNECTIONS_PER_HOST', 16))
+GLOBAL_BANDWIDTH_LIMIT = int(os.environ.get('GLOBAL_BANDWIDTH_LIMIT', 0))
+HTTP_CHUNK_SIZE = int(os.environ.get('HTTP_CHUNK_SIZE', 10 * 1024 * 1024))
+host_limiter = HostLimiter(MAX_CONNECTIONS_PER_HOST)
+bandwidth_budget = BandwidthBudget(GLOBAL_BANDWIDTH_LIMIT)
+
+# 平台识别与 URL 规范化：是否跟随短链接跳转，以及按平台覆盖下载参数（JSON，如 {"bilibili": {"fragments": 1}}）
+EXPAND_SHORT_LINKS = os.environ.get('EXPAND_SHORT_LINKS', '1') != '0'
+PLATFORM_PROFILES = json.loads(os.environ.get('PLATFORM_PROFILES') or '{}')
+url_router = PlatformRouter(profiles=PLATFORM_PROFILES, expand_short_links=EXPAND_SHORT_LINKS)
+
+def limit_rate(rate, profile):
+    """全局带宽份额和平台限速取较小值，0/None 表示不限"""
+    limit = profile.get('ratelimit')
+    if not limit:
+        return rate
+    return min(rate, limit) if rate else limit
+
+# 流式下载：同时进行的流数量上限，以及是否把流写入下载目录供后续复用
+MAX_STREAMS = int(os.environ.get('MAX_STREAMS', 8))
+STREAM_TEE = os.environ.get('STREAM_TEE', '1') != '0'
+stream_slots = threading.BoundedSemaphore(MAX_STREAMS)
+
+# 元数据缓存：同一 URL 的 extract_info 结果在 TTL 内复用（直链会过期，TTL 不宜过长）
+INFO_CACHE_TTL = int(os.environ.get('INFO_CACHE_TTL', 600))
+INFO_CACHE_MAX_ENTRIES = int(os.environ.get('INFO_CACHE_MAX_ENTRIES', 500))
+INFO_CACHE_DIR = os.environ.get('INFO_CACHE_DIR') or None
+info_cache = InfoCache(ttl=INFO_CACHE_TTL, max_entries=INFO_CACHE_MAX_ENTRIES, cache_dir=INFO_CACHE_DIR)
+
+# 运行指标，由 /metrics 输出；JOB_SPANS 开启时在任务记录中保存各阶段耗时
+JOB_SPANS = os.environ.get('JOB_SPANS', '0') != '0'
+metrics = MetricsRegistry(prefix='vdl_')
+extract_seconds = metrics.histogram('extract_seconds', '元数据提取耗时（秒）', labels=('platform',))
+download_seconds = metrics.histogram('download_seconds', '媒体下载耗时（秒）', labels=('platform', 'format'))
+download_speed = metrics.histogram(
+    'download_bytes_per_second', '下载速度（字节/秒）', labels=('platform',),
+    buckets=(64 * 1024, 256 * 1024, 1 << 20, 4 << 20, 16 << 20, 64 << 20, 256 << 20, 1 << 30),
+)
+merge_seconds = metrics.histogram('merge_seconds', '并行下载后合并音视频流的耗时（秒）')
+transcode_seconds = metrics.histogram('transcode_seconds', '流复制封装或转码的耗时（秒）', labels=('mode',))
+finalize_seconds = metrics.histogram('finalize_seconds', '移动到下载目录的耗时（秒）')
+download_requests = metrics.counter(
+    'download_requests_total', '下载请求数，result 为 cached / queued / deduplicated / rejected',
+    labels=('platform', 'format', 'result'),
+)
+jobs_completed = metrics.counter('jobs_total', '已结束的下载任务数', labels=('platform', 'format', 'status'))
+
+# 转码：同时进行的转码进程数（默认等于 CPU 核数）、每个进程的线程数、nice 值，以及各格式的质量档位
+TRANSCODE_WORKERS = int(os.environ.get('TRANSCODE_WORKERS') or os.cpu_count() or 1)
+TRANSCODE_THREADS = int(os.environ.get('TRANSCODE_THREADS', 1))
+TRANSCODE_NICE = int(os.environ.get('TRANSCODE_NICE', 10))
+transcoder = TranscodeEngine(
+    FFMPEG_PATH,
+    workers=TRANSCODE_WORKERS,
+    threads=TRANSCODE_THREADS,
+    nice=TRANSCODE_NICE,
+    presets={fmt: os.environ.get(f'TRANSCODE_PRESET_{fmt.upper()}', 'standard') for fmt in TARGETS},
+    on_finish=lambda mode, seconds: transcode_seconds.observe(seconds, mode=mode),
+)
+
+# 音频下载完成后额外生成的变速版本（逗号分隔，如 0.8,1.5；留空关闭）及每个任务使用的进程数。
+# 由 process_audio.py 在子进程中生成，需要安装 librosa 和 soundfile
+SPEED_VARIANT_RATES = [float(r) for r in os.environ.get('SPEED_VARIANT_RATES', '').split(',') if r.strip()]
+SPEED_VARIANT_WORKERS = int(os.environ.get('SPEED_VARIANT_WORKERS', 2))
+SPEED_VARIANT_SCRIPT = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'process_audio.py')
+
+# 存储管理：下载目录配额（0 不限）、保留的最小剩余空间、无法估算大小时的预留量、临时文件过期时间、清理间隔
+# 旧配置 CACHE_MAX_BYTES 作为配额的后备值
+STORAGE_QUOTA_BYTES = int(os.environ.get('STORAGE_QUOTA_BYTES') or os.environ.get('CACHE_MAX_BYTES') or 0)
+STORAGE_MIN_FREE_BYTES = int(os.environ.get('STORAGE_MIN_FREE_BYTES', 512 * 1024 * 1024))
+STORAGE_DEFAULT_RESERVE = int(os.environ.get('STORAGE_DEFAULT_RESERVE', 100 * 1024 * 1024))
+STORAGE_ORPHAN_AGE = int(os.environ.get('STORAGE_ORPHAN_AGE', 6 * 3600))
+STORAGE_JANITOR_INTERVAL = int(os.environ.get('STORAGE_JANITOR_INTERVAL', 300))
+# 中断任务的暂存目录（含 .part 文件）超过这个时间没有变化就删除
+STAGING_MAX_AGE = int(os.environ.get('STAGING_MAX_AGE', 24 * 3600))
+storage_manager = StorageManager(
+    DOWNLOAD_FOLDER,
+    file_catalog,
+    quota_bytes=STORAGE_QUOTA_BYTES,
+    min_free_bytes=STORAGE_MIN_FREE_BYTES,
+    default_reserve=STORAGE_DEFAULT_RESERVE,
+    orphan_age=STORAGE_ORPHAN_AGE,
+    interval=STORAGE_JANITOR_INTERVAL,
+    on_evict=download_cache.discard_file,
+    staging_max_age=STAGING_MAX_AGE,
+)
+
+# 环境检查：后台任务启动时执行一次，之后按间隔在后台刷新，请求只读取缓存结果
+HEALTH_CHECK_INTERVAL = int(os.environ.get('HEALTH_CHECK_INTERVAL', 60))
+health_monitor = HealthMonitor(
+    DOWNLOAD_FOLDER,
+    FFMPEG_PATH,
+    min_free_bytes=STORAGE_MIN_FREE_BYTES,
+    interval=HEALTH_CHECK_INTERVAL,
+)
+
+# 用户反馈：保存在 SQLite 中，首次启动时在后台导入旧版的逐条文本文件
+FEEDBACK_DIR = os.path.join(os.path.dirname(__file__), 'feedback')
+# 数据库和其他状态文件一样放在数据目录，不写进源码目录
+FEEDBACK_DB_PATH = os.environ.get('FEEDBACK_DB_PATH') or os.path.join(DOWNLOAD_FOLDER, '.feedback.sqlite3')
+FEEDBACK_PER_PAGE = int(os.environ.get('FEEDBACK_PER_PAGE', 50))
+os.makedirs(os.path.dirname(os.path.abspath(FEEDBACK_DB_PATH)), exist_ok=True)
+feedback_store = FeedbackStore(FEEDBACK_DB_PATH)
+
+def format_file_entry(entry):
+    return {
+        'name': entry['name'],
+        'size': f"{entry['size'] / (1024 * 1024):.2f} MB",
+        'bytes': entry['size'],
+        'modified': datetime.fromtimestamp(entry['mtime']).strftime('%Y-%m-%d %H:%M:%S'),
+    }
+
+def list_files_page(args):
+    """按查询参数分页列出文件，返回模板和 JSON 接口共用的数据"""
+    page = max(args.get('page', 1, type=int) or 1, 1)
+    per_page = min(max(args.get('per_page', FILES_PER_PAGE, type=int) or FILES_PER_PAGE, 1), 500)
+    sort = args.get('sort', 'date')
+    order = args.get('order', 'desc')
+    entries, total = file_catalog.list(page=page, per_page=per_page, sort=sort, order=order)
+    return {
+        'files': [format_file_entry(e) for e in entries],
+        'total': total,
+        'page': page,
+        'per_page': per_page,
+        'pages': max((total + per_page - 1) // per_page, 1),
+        'sort': sort,
+        'order': order,
+    }
+
 @app.route('/')
 def home():
     try:
-        files = []
-        if os.path.exists(DOWNLOAD_FOLDER):
-            logger.info(f"Scanning download folder: {DOWNLOAD_FOLDER}")
-            for filename in os.listdir(DOWNLOAD_FOLDER):
-                file_path = os.path.join(DOWNLOAD_FOLDER, filename)
-                if os.path.isfile(file_path):
-                    try:
-                        file_stats = os.stat(file_path)
-                        size_mb = file_stats.st_size / (1024 * 1024)
-                        files.append({
-                            'name': filename,
-                            'size': f'{size_mb:.2f} MB',
-                            'path': file_path
-                        })
-                        logger.info(f"Found file: {filename}, size: {size_mb:.2f} MB")
-                    except Exception as e:
-                        logger.error(f"Error processing file {file_path}: {str(e)}")
-        else:
-            logger.warning(f"Download folder {DOWNLOAD_FOLDER} does not exist")
-            
-        logger.info(f"Found {len(files)} files")
-        return render_template('index.html', files=files)
+        listing = list_files_page(request.args)
+        return render_template('index.html', **listing)
     except Exception as e:
         logger.error(f"Error in home route: {str(e)}")
         return "Error loading page. Check server logs for details.", 500
 
+@app.route('/api/files')
+def api_files():
+    try:
+        return jsonify({'success': True, **list_files_page(request.args)})
+    except Exception as e:
+        logger.error(f"Error listing files: {str(e)}")
+        return jsonify({'success': False, 'message': str(e)}), 500
+
 def progress_hook(d):
-    with progress_lock:
-        if d['status'] == 'downloading':
-            percent = d.get('_percent_str', None)
-            if percent and '%' in percent:
-                percent = percent.strip().replace('N/A', '0.0%')
+    """把 yt-dlp 的进度回调转换成进度字段"""
+    if d['status'] == 'downloading':
+        percent = d.get('_percent_str', None)
+        if percent and '%' in percent:
+            percent = percent.strip().replace('N/A', '0.0%')
+        else:
+            # 计算百分比
+            downloaded = d.get('downloaded_bytes', 0)
+            total = d.get('total_bytes', 0) or d.get('total_bytes_estimate', 0)
+            if total:
+                percent = f"{downloaded / total * 100:.1f}%"
             else:
-                # 计算百分比
-                downloaded = d.get('downloaded_bytes', 0)
-                total = d.get('total_bytes', 0) or d.get('total_bytes_estimate', 0)
-                if total:
-                    percent = f"{downloaded / total * 100:.1f}%"
-                else:
-                    percent = "0.0%"
-            
-            # 获取下载速度
-            speed = d.get('_speed_str', '')
-            
-            # 计算剩余时间 (ETA)
-            eta = d.get('_eta_str', '')
-            
-            # 只保留数字和百分号
-            if not percent.endswith('%'):
                 percent = "0.0%"
-                
-            download_progress['status'] = 'downloading'
-            download_progress['percent'] = percent
-            download_progress['message'] = d.get('filename', '')
-            download_progress['speed'] = speed
-            download_progress['eta'] = eta
-        elif d['status'] == 'finished':
-            download_progress['status'] = 'finished'
-            download_progress['percent'] = '100.0%'
-            download_progress['message'] = 'Download finished'
-        elif d['status'] == 'error':
-            download_progress['status'] = 'error'
-            download_progress['message'] = 'Download error'
+        
+        # 获取下载速度
+        speed = d.get('_speed_str', '')
+        
+        # 计算剩余时间 (ETA)
+        eta = d.get('_eta_str', '')
+        
+        # 只保留数字和百分号
+        if not percent.endswith('%'):
+            percent = "0.0%"
+            
+        return {
+            'status': 'downloading',
+            'percent': percent,
+            'message': d.get('filename', ''),
+            'speed': speed,
+            'eta': eta,
+        }
+    elif d['status'] == 'finished':
+        # 单个流下载完成，之后可能还要合并或转码，整个任务结束前不标记为 finished
+        return {
+            'status': 'processing',
+            'percent': '100.0%',
+            'message': 'Download finished, processing...',
+            'speed': '',
+            'eta': '',
+        }
+    elif d['status'] == 'error':
+        return {
+            'status': 'error',
+            'message': 'Download error',
+        }
+    return None
+
+# 文件名处理函数
+# 输出格式同时用作扩展名：TARGETS 之外的格式不转换、原样保留，但只接受短的小写字母和数字，
+# 防止 mp4/../../x 之类的值把文件写到下载目录之外
+FORMAT_RE = re.compile(r'^[a-z0-9]{1,8}$')
+
+def valid_format(format_type):
+    return isinstance(format_type, str) and FORMAT_RE.match(format_type) is not None
+
+def format_label(format_type):
+    """指标标签中的格式：TARGETS 之外的统一记为 other，避免标签取值无限增长"""
+    return format_type if format_type in TARGETS else 'other'
+
+def sanitize_filename(filename):
+    if not filename:
+        return f"video_{int(time.time())}"
+
+    # 移除非法字符
+    s = re.sub(r'[\\/*?:"<>|]', "", filename)
+    # 替换空格为下划线
+    s = re.sub(r'\s+', '_', s)
+    # 移除前后的点和空格
+    s = s.strip('. ')
+    # 移除其他潜在问题字符
+    s = re.sub(r'[^\w\.-]', '_', s)
+    # 截断长文件名
+    if len(s) > 50:  # 更短的长度限制
+        s = s[:47] + "..."
+    # 如果文件名为空，使用时间戳
+    return s if s else f"video_{int(time.time())}"
+
+def extract_video_info(url):
+    """只提取元数据不下载，返回可以 JSON 序列化、可交给 process_ie_result 的 info 字典"""
+    ydl_opts = {
+        'quiet': True,
+        'no_warnings': True,
+        'skip_download': True,
+        'ffmpeg_location': FFMPEG_PATH,
+    }
+    with extract_seconds.time(platform=url_router.resolve(url, expand=False)['platform']), yt_dlp.YoutubeDL(ydl_opts) as ydl:
+        info = ydl.extract_info(url, download=False)
+        return ydl.sanitize_info(info, remove_private_keys=True)
+
+def probe_info(url):
+    """带缓存的元数据提取"""
+    return info_cache.get_or_extract(url, extract_video_info)
+
+def media_url_of(info):
+    """取一个实际媒体地址，用于按域名限制连接数"""
+    formats = info.get('formats') or []
+    return info.get('url') or (formats[-1].get('url') if formats else None) or info.get('webpage_url')
+
+def download_streams_in_parallel(info, ydl_opts, temp_dir, temp_output, hook, profile):
+    """视频流和音频流同时下载，再用 ffmpeg 无损合并；选中的格式不需要合并时返回 None"""
+    with yt_dlp.YoutubeDL({**ydl_opts, 'quiet': True, 'progress_hooks': []}) as ydl:
+        selected = ydl.process_ie_result(copy.deepcopy(info), download=False)
+    formats = selected.get('requested_formats') or []
+    if len(formats) < 2:
+        return None
+
+    logger.info(f"并行下载 {len(formats)} 个流: {', '.join(f['format_id'] for f in formats)}")
+    combined = CombinedProgress(hook, len(formats))
+    paths = [None] * len(formats)
+    errors = []
+
+    def fetch(index, fmt):
+        try:
+            with host_limiter.connections(fmt.get('url'), profile['fragments'] or DOWNLOAD_FRAGMENTS) as fragments, \
+                    bandwidth_budget.share() as rate:
+                opts = {
+                    **ydl_opts,
+                    'format': fmt['format_id'],
+                    'outtmpl': os.path.join(temp_dir, f'stream_{index}.%(ext)s'),
+                    'progress_hooks': [combined.stream_hook(index)],
+                    'concurrent_fragment_downloads': fragments,
+                    'ratelimit': limit_rate(rate, profile),
+                }
+                opts.pop('postprocessors', None)
+                with yt_dlp.YoutubeDL(opts) as ydl:
+                    result = ydl.process_ie_result(copy.deepcopy(info), download=True)
+                paths[index] = result['requested_downloads'][0]['filepath']
+        except Exception as e:
+            errors.append(e)
+
+    # 复制当前上下文，子线程的日志也带上任务 ID
+    threads = [
+        threading.Thread(target=contextvars.copy_context().run, args=(fetch, i, f), daemon=True)
+        for i, f in enumerate(formats)
+    ]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    if errors:
+        raise errors[0]
+
+    # 各流已是目标编码，直接复制到同一个容器
+    cmd = [os.path.join(FFMPEG_PATH, 'ffmpeg'), '-y', '-loglevel', 'error']
+    for path in paths:
+        cmd += ['-i', path]
+    for i in range(len(paths)):
+        cmd += ['-map', str(i)]
+    cmd += ['-c', 'copy', temp_output]
+    with merge_seconds.time():
+        result = subprocess.run(cmd, capture_output=True)
+    if result.returncode != 0:
+        raise Exception(f"合并音视频失败: {result.stderr.decode('utf-8', 'replace')[-300:]}")
+    for path in paths:
+        os.remove(path)
+    return selected
+
+def download_media(url, info, ydl_opts, format_type, temp_dir, temp_output, hook, profile):
+    """下载到临时目录，返回 info 字典。单个视频复用缓存的元数据，能并行时视频和音频流同时下载"""
+    fragments = profile['fragments'] or DOWNLOAD_FRAGMENTS
+    if not info or info.get('_type', 'video') != 'video':
+        # 播放列表等结果不能直接复用，走完整流程
+        with bandwidth_budget.share() as rate:
+            with yt_dlp.YoutubeDL({**ydl_opts, 'concurrent_fragment_downloads': fragments, 'ratelimit': limit_rate(rate, profile)}) as ydl:
+                return ydl.extract_info(url, download=True)
+
+    if PARALLEL_STREAMS and format_type not in AUDIO_FORMATS:
+        info_dict = download_streams_in_parallel(info, ydl_opts, temp_dir, temp_output, hook, profile)
+        if info_dict is not None:
+            return info_dict
+
+    with host_limiter.connections(media_url_of(info), fragments) as granted, \
+            bandwidth_budget.share() as rate:
+        opts = {**ydl_opts, 'concurrent_fragment_downloads': granted, 'ratelimit': limit_rate(rate, profile)}
+        with yt_dlp.YoutubeDL(opts) as ydl:
+            # 复用已提取的元数据，只重新做格式选择和下载
+            return ydl.process_ie_result(copy.deepcopy(info), download=True)
+
+def create_speed_variants(job, src, format_type, safe_title, temp_dir, output_dir):
+    """为下载的音频生成各速度的版本并放入下载目录，返回文件信息列表"""
+    work_dir = os.path.join(temp_dir, 'variants')
+    os.makedirs(work_dir, exist_ok=True)
+    # m4a / opus 等格式 soundfile 读不了，先解码为单声道 wav
+    wav = os.path.join(work_dir, 'source.wav')
+    cmd = [os.path.join(FFMPEG_PATH, 'ffmpeg'), '-y', '-loglevel', 'error', '-i', src, '-vn', '-ac', '1', wav]
+    result = subprocess.run(cmd, capture_output=True, stdin=subprocess.DEVNULL)
+    if result.returncode != 0:
+        raise Exception(f"解码音频失败: {result.stderr.decode('utf-8', 'replace')[-300:]}")
+
+    # 在独立进程中运行，取消任务时可以直接终止
+    cmd = [
+        sys.executable, SPEED_VARIANT_SCRIPT, wav,
+        '--rates', ','.join(str(r) for r in SPEED_VARIANT_RATES),
+        '--output-dir', work_dir, '--workers', str(SPEED_VARIANT_WORKERS), '--sr', '0',
+    ]
+    proc = subprocess.Popen(cmd, stdin=subprocess.DEVNULL, stdout=subprocess.DEVNULL, stderr=subprocess.PIPE)
+    try:
+        while True:
+            try:
+                stderr = proc.communicate(timeout=1)[1]
+                break
+            except subprocess.TimeoutExpired:
+                job.check_cancelled()
+    finally:
+        if proc.poll() is None:
+            proc.kill()
+            proc.wait()
+    if proc.returncode != 0:
+        raise Exception(f"生成变速版本失败: {stderr.decode('utf-8', 'replace')[-300:]}")
+
+    variants = []
+    for i, rate in enumerate(SPEED_VARIANT_RATES):
+        job.check_cancelled()
+        converted = transcoder.convert(
+            os.path.join(work_dir, f"source_{rate:g}x.wav"),
+            os.path.join(work_dir, f"variant_{i}.{format_type}"),
+            format_type,
+            check=job.check_cancelled,
+        )
+        filename = f"{safe_title}_{rate:g}x.{format_type}"
+        move_into_place(converted, os.path.join(output_dir, filename))
+        file_catalog.add(filename)
+        size = os.path.getsize(os.path.join(output_dir, filename))
+        variants.append({'name': filename, 'rate': rate, 'size': f"{size/1024/1024:.2f} MB"})
+        logger.info(f"已生成变速版本: {filename}")
+    return variants
+
+def run_download(job):
+    """在下载线程中执行完整的下载流程，返回结果或抛出异常"""
+    url = job.url
+    format_type = job.format_type
+    platform = job.options.get('platform') or url_router.resolve(url, expand=False)['platform']
+    profile = url_router.options(platform)
+
+    # 下载前重置进度
+    download_progress.update(job.id, status='downloading', percent='0.0%', message='开始下载...')
+    update_progress = download_progress.make_hook(job.id, progress_hook)
+
+    publish_job(job)
+    last_remote_check = [0.0]
+
+    def job_progress_hook(d):
+        # 每次回调时检查取消标记，yt-dlp 会因异常中止下载；其他 worker 转交的取消请求每秒查一次
+        now = time.monotonic()
+        if now - last_remote_check[0] >= 1:
+            last_remote_check[0] = now
+            if remote_cancel_requested(job):
+                download_jobs.cancel(job.id)
+        job.check_cancelled()
+        update_progress(d)
+
+    # 生成唯一的时间戳
+    timestamp = int(time.time())
+
+    # 使用绝对路径
+    output_dir = os.path.abspath(DOWNLOAD_FOLDER)
+    logger.debug(f"下载目录(绝对路径): {output_dir}")
+
+    # 对于TikTok视频，使用更简单的文件名
+    filename_base = f"video_{timestamp}"
+    if platform == "tiktok":
+        filename_base = f"tiktok_{timestamp}"
+    elif platform == "youtube":
+        filename_base = f"youtube_{timestamp}"
+    elif platform == "bilibili":
+        filename_base = f"bilibili_{timestamp}"
+
+    # 使用按任务 ID 固定的暂存目录，进程中断后恢复的任务从其中的 .part 文件继续下载
+    with storage_manager.staging_dir(job.id) as temp_dir:
+        logger.info(f"暂存目录: {temp_dir}")
+
+        # 设置临时输出路径
+        temp_output = os.path.join(temp_dir, f"temp_output.{format_type}")
+        logger.debug(f"临时输出文件: {temp_output}")
+
+        # 配置yt-dlp选项
+        ydl_opts = {
+            'quiet': False,
+            'no_warnings': False,
+            'outtmpl': temp_output,
+            'ffmpeg_location': FFMPEG_PATH,
+            'progress_hooks': [job_progress_hook],
+            'logger': YtDlpLogger(ytdlp_logger, YTDLP_LOG_LEVEL, YTDLP_PROGRESS_INTERVAL),
+            # yt-dlp 只有 verbose 时才产生 [debug] 输出
+            'verbose': YTDLP_LOG_LEVEL <= logging.DEBUG,
+            'http_chunk_size': HTTP_CHUNK_SIZE or None,
+        }
+
+        if format_type in AUDIO_FORMATS:
+            # 只下载音频流，保留原始扩展名，下载后再决定复制封装还是转码
+            ydl_opts.update({
+                'format': profile['audio_format'],
+                'outtmpl': os.path.join(temp_dir, 'source.%(ext)s'),
+            })
+        else:
+            ydl_opts.update({
+                'format': profile['video_format'],
+            })
+
+        try:
+            # 下载视频
+            logger.info(f"开始下载: {url}")
+            with span(job, 'probe', record=JOB_SPANS):
+                info = probe_info(url)
+            # 按元数据估算大小预留空间，不够时先淘汰最久未下载的文件
+            storage_manager.reserve(job.id, estimate_size(info))
+            download_started = time.monotonic()
+            try:
+                info_dict = download_media(url, info, ydl_opts, format_type, temp_dir, temp_output, job_progress_hook, profile)
+            except yt_dlp.utils.DownloadError:
+                job.check_cancelled()
+                if not info or time.time() - info.get('epoch', 0) < 60:
+                    raise
+                # 缓存中的直链可能已经过期，重新提取一次
+                logger.warning(f"使用缓存的元数据下载失败，重新提取: {url}")
+                info_cache.invalidate(url)
+                info_dict = download_media(url, probe_info(url), ydl_opts, format_type, temp_dir, temp_output, job_progress_hook, profile)
+            if not info_dict:
+                raise Exception("无法获取视频信息")
+            job.check_cancelled()
+            download_elapsed = time.monotonic() - download_started
+            download_seconds.observe(download_elapsed, platform=platform, format=format_label(format_type))
+            if JOB_SPANS:
+                job.add_span('download', download_started, download_elapsed)
+
+            # 提取视频标题
+            original_title = info_dict.get('title', filename_base)
+            logger.info(f"视频标题: {original_title}")
+            safe_title = sanitize_filename(original_title)
+            logger.debug(f"安全的标题: {safe_title}")
+
+            # 更新最终文件名
+            final_filename = f"{safe_title}.{format_type}"
+            output_file = os.path.join(output_dir, final_filename)
+            logger.debug(f"输出文件: {output_file}")
+
+            # 检查临时文件是否存在
+            if not os.path.exists(temp_output):
+                actual_temp_file = None
+                # 查找实际下载的文件
+                for file in sorted(os.listdir(temp_dir)):
+                    logger.debug(f"临时目录中的文件: {file}")
+                    # 跳过未完成的分片和上次中断时留下的转换结果
+                    if file.endswith(('.part', '.ytdl')) or file.startswith('converted.'):
+                        continue
+                    if os.path.isfile(os.path.join(temp_dir, file)):
+                        actual_temp_file = os.path.join(temp_dir, file)
+                        break
+
+                if actual_temp_file:
+                    logger.info(f"找到实际下载的文件: {actual_temp_file}")
+                    temp_output = actual_temp_file
+                else:
+                    raise Exception("下载失败，临时目录中未找到文件")
+            download_speed.observe(os.path.getsize(temp_output) / max(download_elapsed, 0.001), platform=platform)
+
+            # 按源编码选择流复制或转码，已是目标格式时不做处理
+            download_progress.update(job.id, status='processing', message='正在处理音视频...')
+            with span(job, 'transcode', record=JOB_SPANS):
+                temp_output = transcoder.convert(
+                    temp_output,
+                    os.path.join(temp_dir, f"converted.{format_type}"),
+                    format_type,
+                    check=job.check_cancelled,
+                )
+            job.check_cancelled()
+
+            # 检查文件大小
+            file_size = os.path.getsize(temp_output)
+            logger.debug(f"下载的文件大小: {file_size/1024/1024:.2f} MB")
+
+            if file_size == 0:
+                raise Exception("下载的文件大小为0")
+
+            # 确保输出目录存在
+            os.makedirs(output_dir, exist_ok=True)
+
+            # 将文件移动到最终位置（同一文件系统直接 rename，否则流式复制后 rename）
+            logger.debug(f"将文件从 {temp_output} 移动到 {output_file}")
+            with span(job, 'finalize', finalize_seconds, record=JOB_SPANS):
+                move_into_place(temp_output, output_file)
+
+            # 验证最终文件存在
+            if not os.path.exists(output_file):
+                raise Exception(f"无法创建最终文件: {output_file}")
+
+            logger.info(f"成功创建最终文件: {output_file}")
+            final_size = os.path.getsize(output_file)
+            logger.debug(f"最终文件大小: {final_size/1024/1024:.2f} MB")
+            file_catalog.add(final_filename)
+            download_cache.put(job.key, final_filename)
+
+            result = {
+                'message': f'下载成功: {safe_title}',
+                'file': {
+                    'name': final_filename,
+                    'size': f"{final_size/1024/1024:.2f} MB"
+                }
+            }
+
+            if SPEED_VARIANT_RATES and format_type in AUDIO_FORMATS:
+                download_progress.update(job.id, status='processing', message='正在生成变速版本...')
+                try:
+                    with span(job, 'speed_variants', record=JOB_SPANS):
+                        result['variants'] = create_speed_variants(job, output_file, format_type, safe_title, temp_dir, output_dir)
+                except JobCancelled:
+                    raise
+                except Exception as e:
+                    # 主文件已经完成，变速版本失败不影响下载结果
+                    logger.error(f"生成变速版本时出错: {str(e)}")
+                    result['variants'] = []
+
+            return result
+        except Exception as e:
+            if not job.cancel_event.is_set():
+                logger.error(f"下载过程中出错: {str(e)}")
+            raise
+        finally:
+            storage_manager.release(job.id)
+
+def on_job_done(job):
+    """任务结束后写入最终进度，此时任务状态和结果已经可读"""
+    if job.status == 'finished':
+        download_progress.update(job.id, status='finished', percent='100.0%', message=job.result.get('message', ''))
+    elif job.status == 'cancelled':
+        download_progress.update(job.id, status='cancelled', message='下载已取消')
+    else:
+        download_progress.update(job.id, status='error', message=f'下载错误: {job.error}')
+    publish_job(job)
+    jobs_completed.inc(platform=job.options.get('platform', ''), format=format_label(job.format_type), status=job.status)
+    download_batches.job_done(job)
+
+# 后台下载线程池
+# 任务记录：未完成的任务保存在 SQLite 中，进程崩溃或被回收后由存活（或重启后）的进程接手；
+# 检查间隔（秒）以及同一任务最多恢复的次数
+JOB_JOURNAL_PATH = os.environ.get('JOB_JOURNAL_PATH') or os.path.join(DOWNLOAD_FOLDER, '.jobs.sqlite3')
+JOB_JOURNAL_INTERVAL = int(os.environ.get('JOB_JOURNAL_INTERVAL', 10))
+JOB_MAX_RESUMES = int(os.environ.get('JOB_MAX_RESUMES', 3))
+job_journal = JobJournal(JOB_JOURNAL_PATH, interval=JOB_JOURNAL_INTERVAL, max_attempts=JOB_MAX_RESUMES)
+
+def lane_options(url):
+    """提交任务时的车道参数。元数据已缓存时直接分车道；否则先按短任务排队并标记 lane_pending，
+    由下载线程取出后探测再调整，请求线程不提取元数据"""
+    info = info_cache.get(normalize_url(url))
+    if info is None:
+        return {'lane': SHORT, 'lane_pending': True}
+    return {'lane': classify(info, SHORT_JOB_SECONDS, SHORT_JOB_BYTES)}
+
+def classify_job(job):
+    """下载线程中探测元数据后分车道；探测结果进入缓存，随后的下载直接复用"""
+    return classify(probe_info(job.url), SHORT_JOB_SECONDS, SHORT_JOB_BYTES)
+
+download_scheduler = LaneScheduler(
+    DOWNLOAD_WORKERS,
+    max_long=LONG_JOB_WORKERS or None,
+    max_queued=DOWNLOAD_QUEUE_SIZE,
+    max_per_client=MAX_JOBS_PER_CLIENT,
+    max_wait=MAX_QUEUE_WAIT,
+)
+download_jobs = JobManager(
+    run_download,
+    workers=DOWNLOAD_WORKERS,
+    on_done=on_job_done,
+    journal=job_journal,
+    scheduler=download_scheduler,
+    classify=classify_job,
+)
+
+def client_id():
+    if TRUST_PROXY_HEADERS and request.access_route:
+        return request.access_route[0]
+    return request.remote_addr
+
+def recover_job(entry):
+    """重新提交中断的任务，沿用原任务 ID，客户端可以继续查询原来的进度"""
+    job = download_jobs.submit(entry['url'], entry['format'], key=entry['key'], job_id=entry['id'], **entry['options'])
+    if job.id != entry['id']:
+        # 同一视频已有新的任务在进行，旧任务的记录和暂存文件不再需要
+        job_journal.remove(entry['id'])
+        storage_manager.remove_staging(entry['id'])
+        return
+    download_progress.create(job.id, message='恢复中断的下载...')
+    publish_job(job)
+
+def abandon_job(entry):
+    storage_manager.remove_staging(entry['id'])
+    download_progress.create(entry['id'], status='error', message='下载错误: 任务多次中断，已放弃')
+
+def expand_playlist(url):
+    """只列出播放列表/频道的条目，不逐个提取；单个视频的完整元数据顺便放进缓存"""
+    ydl_opts = {
+        'quiet': True,
+        'no_warnings': True,
+        'skip_download': True,
+        'extract_flat': 'in_playlist',
+        'ffmpeg_location': FFMPEG_PATH,
+    }
+    with yt_dlp.YoutubeDL(ydl_opts) as ydl:
+        info = ydl.extract_info(url, download=False)
+        if info.get('_type') not in ('playlist', 'multi_video'):
+            # 以规范地址为键，提交下载时可以直接复用
+            info_cache.put(normalize_url(url_router.resolve(url)['url']), ydl.sanitize_info(info, remove_private_keys=True))
+            return [{'url': url, 'title': info.get('title')}]
+    entries = []
+    for entry in info.get('entries') or []:
+        entry_url = entry and (entry.get('webpage_url') or entry.get('url'))
+        if entry_url:
+            entries.append({'url': entry_url, 'title': entry.get('title')})
+    logger.info(f"播放列表 {info.get('title')} 展开为 {len(entries)} 个条目")
+    return entries
+
+def start_batch_entry(url, format_type, client=None):
+    """提交批量任务中的一个条目：缓存命中返回结果，否则返回下载任务；条目计入客户端的任务数限额"""
+    target = url_router.resolve(url)
+    cache_key = url_router.cache_key(target, format_type)
+    cached = download_cache.lookup(cache_key)
+    if cached:
+        return {'file': {'name': cached['filename'], 'size': f"{cached['size']/1024/1024:.2f} MB"}}
+    lanes = {} if download_jobs.inflight(cache_key) else lane_options(target['url'])
+    job = download_jobs.submit(target['url'], format_type, key=cache_key, platform=target['platform'], client=client,
+                               **lanes)
+    download_progress.create(job.id)
+    publish_job(job)
+    return job
+
+# 批量下载：每个批次同时占用的下载任务数上限，以及单个批次最多的条目数
+BATCH_MAX_CONCURRENCY = int(os.environ.get('BATCH_MAX_CONCURRENCY', 2))
+BATCH_MAX_ENTRIES = int(os.environ.get('BATCH_MAX_ENTRIES', 200))
+download_batches = BatchManager(
+    expand_playlist,
+    start_batch_entry,
+    download_jobs.cancel,
+    max_entries=BATCH_MAX_ENTRIES,
+)
+
+# 后台线程（日志输出、存储清理、环境检查、旧反馈导入、任务记录）不在导入时启动：
+# gunicorn --preload 时导入发生在主进程，fork 出的 worker 中不会有这些线程。改为在每个进程处理第一个请求
+# （或 ASGI 启动）时启动，与 JobManager 在第一次提交时才启动下载线程的做法相同
+_background_started = False
+_background_lock = threading.Lock()
+
+def start_background_tasks():
+    global _background_started
+    with _background_lock:
+        if _background_started:
+            return
+        _background_started = True
+        start_listener(log_handler)
+        storage_manager.start_janitor()
+        health_monitor.start()
+        feedback_store.import_in_background(FEEDBACK_DIR)
+        job_journal.start(recover_job, abandon_job)
+        logger.info(f"后台任务已启动 (pid {os.getpid()})")
+
+@app.before_request
+def ensure_background_tasks():
+    start_background_tasks()
+
+def cache_hit_ratio():
+    lookups = download_cache.hits + download_cache.misses
+    return download_cache.hits / lookups if lookups else 0
+
+metrics.gauge('queue_depth', '排队中的下载任务数', download_jobs.queue_depth)
+metrics.gauge('active_jobs', '正在执行的下载任务数', download_jobs.active_count)
+metrics.gauge('log_records_dropped_total', '日志队列已满时丢弃的记录数', lambda: log_handler.dropped, kind='counter')
+metrics.gauge(
+    'lane_jobs', '各车道排队和运行中的任务数', labels=('lane', 'state'),
+    callback=lambda: {
+        (lane, state): stats[state]
+        for lane, stats in download_jobs.scheduler_stats().items() for state in ('queued', 'running')
+    },
+)
+metrics.gauge(
+    'lane_estimated_wait_seconds', '新任务进入各车道的预计等待时间（秒）', labels=('lane',),
+    callback=lambda: {(lane,): stats['estimated_wait'] for lane, stats in download_jobs.scheduler_stats().items()},
+)
+metrics.gauge('cache_hits_total', '下载缓存命中次数', lambda: download_cache.hits, kind='counter')
+metrics.gauge('cache_misses_total', '下载缓存未命中次数', lambda: download_cache.misses, kind='counter')
+metrics.gauge('cache_hit_ratio', '下载缓存命中率', cache_hit_ratio)
+metrics.gauge('storage_used_bytes', '下载目录中文件的总大小', file_catalog.total_bytes)
+metrics.gauge('storage_reserved_bytes', '为进行中的下载预留的空间', storage_manager.reserved_bytes)
+
+@app.route('/metrics')
+def metrics_endpoint():
+    """Prometheus 文本格式的运行指标（每个 worker 进程各自统计）"""
+    return Response(metrics.render(), mimetype='text/plain; version=0.0.4')
+
+@app.route('/healthz')
+def healthz():
+    """存活检查：进程能响应即返回 200，附带最近一次环境检查结果"""
+    return jsonify({'status': 'ok', **health_monitor.report()})
+
+@app.route('/readyz')
+def readyz():
+    """就绪检查：ffmpeg 可用、下载目录可写且剩余空间充足时返回 200，否则 503"""
+    report = health_monitor.report()
+    return jsonify(report), 200 if report['ready'] else 503
+
+def rejected_response(e):
+    """调度器拒绝时的 429 响应，带上建议的重试时间"""
+    retry_after = getattr(e, 'retry_after', None)
+    logger.warning(f"拒绝下载请求: {str(e)}，预计等待 {retry_after} 秒")
+    response = jsonify({
+        'success': False,
+        'message': str(e),
+        'retry_after': retry_after,
+    })
+    response.status_code = 429
+    if retry_after is not None:
+        response.headers['Retry-After'] = str(max(int(retry_after), 1))
+    return response
 
 @app.route('/download', methods=['POST'])
 def download_video():
     try:
         url = unquote(request.form['url'])
         format_type = request.form.get('format', 'mp4')
+        if not valid_format(format_type):
+            return jsonify({
+                'success': False,
+                'message': '无效的格式'
+            }), 400
         logger.info(f"下载请求收到, URL: {url}, 格式: {format_type}")
 
-        # 检查目标平台
-        platform = "unknown"
-        if "tiktok.com" in url:
-            platform = "tiktok"
-            logger.info("检测到TikTok URL")
-        elif "youtube.com" in url or "youtu.be" in url:
-            platform = "youtube"
-            logger.info("检测到YouTube URL")
-        elif "bilibili.com" in url:
-            platform = "bilibili"
-            logger.info("检测到Bilibili URL")
-        
-        # 确保下载目录存在
-        if not os.path.exists(DOWNLOAD_FOLDER):
-            logger.info(f"创建下载目录: {DOWNLOAD_FOLDER}")
-            os.makedirs(DOWNLOAD_FOLDER, exist_ok=True)
-        
-        # 显示当前目录和下载目录
-        logger.info(f"当前工作目录: {os.getcwd()}")
-        logger.info(f"下载目录: {DOWNLOAD_FOLDER}")
-        logger.info(f"下载目录是否存在: {os.path.exists(DOWNLOAD_FOLDER)}")
-        logger.info(f"下载目录权限: {oct(os.stat(DOWNLOAD_FOLDER).st_mode)[-3:]}")
+        # 识别平台并规范化 URL：同一视频的不同写法得到相同的缓存键
+        target = url_router.resolve(url)
+        platform = target['platform']
+        logger.debug(f"检测到平台: {platform}, 规范地址: {target['url']}")
 
-        # 测试临时文件写入和读取
-        try:
-            test_file_path = os.path.join(DOWNLOAD_FOLDER, f"test_file_{int(time.time())}.txt")
-            with open(test_file_path, 'w') as f:
-                f.write('Test content')
-            logger.info(f"成功创建测试文件: {test_file_path}")
-            
-            with open(test_file_path, 'r') as f:
-                content = f.read()
-            logger.info(f"成功读取测试文件内容: {content}")
-            
-            os.remove(test_file_path)
-            logger.info(f"成功删除测试文件")
-        except Exception as e:
-            logger.error(f"测试文件操作失败: {str(e)}")
+        # 缓存命中时直接返回已下载的文件，不再调用 yt-dlp
+        cache_key = url_router.cache_key(target, format_type)
+        cached = download_cache.lookup(cache_key)
+        if cached:
+            logger.info(f"缓存命中: {cache_key} -> {cached['filename']}")
+            download_requests.inc(platform=platform, format=format_label(format_type), result='cached')
             return jsonify({
-                'success': False,
-                'message': f'无法写入下载目录: {str(e)}'
+                'success': True,
+                'cached': True,
+                'status': 'finished',
+                'message': f"下载成功: {os.path.splitext(cached['filename'])[0]}",
+                'file': {
+                    'name': cached['filename'],
+                    'size': f"{cached['size']/1024/1024:.2f} MB"
+                }
             })
 
-        # 检查FFMPEG路径
-        ffmpeg_exec = os.path.join(FFMPEG_PATH, 'ffmpeg')
-        logger.info(f"FFmpeg路径: {ffmpeg_exec}")
-        logger.info(f"FFmpeg是否存在: {os.path.exists(ffmpeg_exec)}")
-        
-        if not os.path.exists(ffmpeg_exec):
-            logger.error(f"未找到FFmpeg: {ffmpeg_exec}")
+        # 环境检查结果由后台定期刷新，这里不访问文件系统
+        if not health_monitor.ready():
             return jsonify({
                 'success': False,
-                'message': f'未找到FFmpeg。请检查安装。'
-            })
+                'message': health_monitor.reason()
+            }), 503
 
-        # 下载前重置进度
-        with progress_lock:
-            download_progress['status'] = 'downloading'
-            download_progress['percent'] = '0.0%'
-            download_progress['message'] = '开始下载...'
-
-        # 文件名处理函数
-        def sanitize_filename(filename):
-            if not filename:
-                return f"video_{int(time.time())}"
-            
-            # 移除非法字符
-            s = re.sub(r'[\\/*?:"<>|]', "", filename)
-            # 替换空格为下划线
-            s = re.sub(r'\s+', '_', s)
-            # 移除前后的点和空格
-            s = s.strip('. ')
-            # 移除其他潜在问题字符
-            s = re.sub(r'[^\w\.-]', '_', s)
-            # 截断长文件名
-            if len(s) > 50:  # 更短的长度限制
-                s = s[:47] + "..."
-            # 如果文件名为空，使用时间戳
-            return s if s else f"video_{int(time.time())}"
-
-        # 生成唯一的时间戳
-        timestamp = int(time.time())
-        
-        # 使用绝对路径
-        output_dir = os.path.abspath(DOWNLOAD_FOLDER)
-        logger.info(f"下载目录(绝对路径): {output_dir}")
-        
-        # 对于TikTok视频，使用更简单的文件名
-        filename_base = f"video_{timestamp}"
-        if platform == "tiktok":
-            filename_base = f"tiktok_{timestamp}"
-        elif platform == "youtube":
-            filename_base = f"youtube_{timestamp}"
-        elif platform == "bilibili":
-            filename_base = f"bilibili_{timestamp}"
-            
-        # 确定最终文件名
-        final_filename = f"{filename_base}.{format_type}"
-        output_file = os.path.join(output_dir, final_filename)
-        logger.info(f"输出文件: {output_file}")
-        
-        # 使用临时目录下载
-        with tempfile.TemporaryDirectory() as temp_dir:
-            logger.info(f"创建临时目录: {temp_dir}")
-            
-            # 设置临时输出路径
-            temp_output = os.path.join(temp_dir, f"temp_output.{format_type}")
-            logger.info(f"临时输出文件: {temp_output}")
-            
-            # 配置yt-dlp选项
-            ydl_opts = {
-                'quiet': False,
-                'no_warnings': False,
-                'outtmpl': temp_output,
-                'ffmpeg_location': FFMPEG_PATH,
-                'progress_hooks': [progress_hook],
-                'verbose': True,
-            }
-            
-            if format_type == 'mp3':
-                ydl_opts.update({
-                    'format': 'bestaudio/best',
-                    'postprocessors': [{
-                        'key': 'FFmpegExtractAudio',
-                        'preferredcodec': 'mp3',
-                        'preferredquality': '192',
-                    }],
-                })
-                # 对于mp3，修改临时输出路径
-                temp_output = os.path.join(temp_dir, "temp_output.mp3")
-                logger.info(f"修正的MP3临时输出: {temp_output}")
-            else:
-                ydl_opts.update({
-                    'format': 'bestvideo[ext=mp4]+bestaudio[ext=m4a]/best[ext=mp4]/best',
-                })
-            
-            try:
-                # 下载视频
-                logger.info(f"开始下载: {url}")
-                with yt_dlp.YoutubeDL(ydl_opts) as ydl:
-                    info_dict = ydl.extract_info(url, download=True)
-                    if info_dict:
-                        # 提取视频标题
-                        original_title = info_dict.get('title', filename_base)
-                        logger.info(f"视频标题: {original_title}")
-                        safe_title = sanitize_filename(original_title)
-                        logger.info(f"安全的标题: {safe_title}")
-                        
-                        # 更新最终文件名
-                        final_filename = f"{safe_title}.{format_type}"
-                        output_file = os.path.join(output_dir, final_filename)
-                        
-                        # 检查临时文件是否存在
-                        if not os.path.exists(temp_output):
-                            actual_temp_file = None
-                            # 查找实际下载的文件
-                            for file in os.listdir(temp_dir):
-                                logger.info(f"临时目录中的文件: {file}")
-                                if os.path.isfile(os.path.join(temp_dir, file)):
-                                    actual_temp_file = os.path.join(temp_dir, file)
-                                    break
-                            
-                            if actual_temp_file:
-                                logger.info(f"找到实际下载的文件: {actual_temp_file}")
-                                temp_output = actual_temp_file
-                            else:
-                                raise Exception("下载失败，临时目录中未找到文件")
-                        
-                        # 检查文件大小
-                        file_size = os.path.getsize(temp_output)
-                        logger.info(f"下载的文件大小: {file_size/1024/1024:.2f} MB")
-                        
-                        if file_size == 0:
-                            raise Exception("下载的文件大小为0")
-                        
-                        # 确保输出目录存在
-                        os.makedirs(output_dir, exist_ok=True)
-                        
-                        # 将文件复制到最终位置
-                        logger.info(f"将文件从 {temp_output} 复制到 {output_file}")
-                        with open(temp_output, 'rb') as src_file:
-                            with open(output_file, 'wb') as dest_file:
-                                dest_file.write(src_file.read())
-                        
-                        # 验证最终文件存在
-                        if os.path.exists(output_file):
-                            logger.info(f"成功创建最终文件: {output_file}")
-                            final_size = os.path.getsize(output_file)
-                            logger.info(f"最终文件大小: {final_size/1024/1024:.2f} MB")
-                            
-                            with progress_lock:
-                                download_progress['status'] = 'finished'
-                                download_progress['percent'] = '100.0%'
-                                download_progress['message'] = f'下载完成: {safe_title}'
-                            
-                            return jsonify({
-                                'success': True,
-                                'message': f'下载成功: {safe_title}',
-                                'file': {
-                                    'name': final_filename,
-                                    'size': f"{final_size/1024/1024:.2f} MB"
-                                }
-                            })
-                        else:
-                            raise Exception(f"无法创建最终文件: {output_file}")
-                    else:
-                        raise Exception("无法获取视频信息")
-            except Exception as e:
-                logger.error(f"下载过程中出错: {str(e)}")
-                with progress_lock:
-                    download_progress['status'] = 'error'
-                    download_progress['message'] = f'下载错误: {str(e)}'
-                return jsonify({
-                    'success': False,
-                    'message': f'下载错误: {str(e)}'
-                })
+        # 相同视频和格式的进行中任务会被合并，共享进度和结果；新任务先做不需要元数据的检查，饱和时立即拒绝，
+        # 再按时长 / 大小分车道（没有缓存的元数据时由下载线程探测后调整），请求立即返回任务 ID
+        client = client_id()
+        lanes = {}
+        if download_jobs.inflight(cache_key) is None:
+            download_jobs.check_admission(client)
+            lanes = lane_options(target['url'])
+        job = download_jobs.submit(target['url'], format_type, key=cache_key, platform=platform, client=client, **lanes)
+        download_progress.create(job.id)
+        publish_job(job)
+        download_requests.inc(
+            platform=platform, format=format_label(format_type),
+            result='deduplicated' if job.subscribers > 1 else 'queued',
+        )
+        return jsonify({
+            'success': True,
+            'job_id': job.id,
+            'status': job.status,
+            'deduplicated': job.subscribers > 1,
+            'lane': job.options.get('lane'),
+            'estimated_wait': job.estimated_wait,
+            'message': '任务已加入下载队列'
+        })
+    except QueueFullError as e:
+        download_requests.inc(platform=platform, format=format_label(format_type), result='rejected')
+        return rejected_response(e)
     except Exception as e:
         logger.error(f"意外错误: {str(e)}")
-        with progress_lock:
-            download_progress['status'] = 'error'
-            download_progress['message'] = f'下载错误: {str(e)}'
         return jsonify({
             'success': False,
             'message': f'意外错误: {str(e)}'
         })
 
+@app.route('/probe', methods=['GET', 'POST'])
+def probe_video():
+    url = request.values.get('url', '').strip()
+    if not url:
+        return jsonify({'success': False, 'message': 'URL不能为空'}), 400
+    try:
+        info = probe_info(url_router.resolve(unquote(url))['url'])
+        if not info:
+            return jsonify({'success': False, 'message': '无法获取视频信息'})
+        return jsonify({'success': True, 'info': summarize_info(info)})
+    except Exception as e:
+        logger.error(f"获取视频信息失败: {str(e)}")
+        return jsonify({'success': False, 'message': f'获取视频信息失败: {str(e)}'})
+
+@app.route('/jobs/<job_id>')
+def get_job(job_id):
+    job = download_jobs.get(job_id)
+    if job is None:
+        # 任务可能在其他 worker / 节点上
+        shared_job = share_state(shared_store.get, JOBS, job_id)
+        if shared_job is None:
+            return jsonify({'success': False, 'message': '任务不存在'}), 404
+        return jsonify({
+            'success': True,
+            'job': shared_job,
+            'progress': share_state(shared_store.get, PROGRESS, job_id)
+        })
+    return jsonify({
+        'success': True,
+        'job': job.to_dict(),
+        'progress': download_progress.get(job_id),
+        'logs': job_logs.get(job_id),
+    })
+
+@app.route('/jobs/<job_id>/cancel', methods=['POST'])
+def cancel_job(job_id):
+    job = download_jobs.cancel(job_id)
+    if job is None:
+        shared_job = share_state(shared_store.get, JOBS, job_id)
+        if shared_job is None:
+            return jsonify({'success': False, 'message': '任务不存在'}), 404
+        # 交给执行任务的 worker 处理
+        if shared_job['status'] not in FINAL_STATES:
+            share_state(shared_store.set, CANCEL, job_id, True, ttl=ACTIVE_STATE_TTL)
+        logger.info(f"收到取消请求，已转交节点 {shared_job.get('node')}: {job_id}")
+        return jsonify({'success': True, 'job': shared_job})
+    logger.info(f"收到取消请求: {job_id}")
+    publish_job(job)
+    return jsonify({'success': True, 'job': job.to_dict()})
+
+@app.route('/batch', methods=['POST'])
+def create_batch():
+    """批量下载：多个链接，或一个播放列表/频道链接"""
+    data = request.get_json(silent=True) or {}
+    urls = data.get('urls')
+    if urls is None:
+        urls = request.form.get('urls', '').split()
+    if isinstance(urls, str):
+        urls = urls.split()
+    urls = [unquote(u).strip() for u in urls if u and u.strip()]
+    format_type = data.get('format') or request.form.get('format', 'mp4')
+    if not urls:
+        return jsonify({'success': False, 'message': 'URL不能为空'}), 400
+    if not valid_format(format_type):
+        return jsonify({'success': False, 'message': '无效的格式'}), 400
+    if len(urls) > BATCH_MAX_ENTRIES:
+        return jsonify({'success': False, 'message': f'一次最多提交 {BATCH_MAX_ENTRIES} 个链接'}), 400
+    if not health_monitor.ready():
+        return jsonify({'success': False, 'message': health_monitor.reason()}), 503
+    try:
+        concurrency = int(data.get('concurrency') or request.form.get('concurrency') or BATCH_MAX_CONCURRENCY)
+    except (TypeError, ValueError):
+        concurrency = BATCH_MAX_CONCURRENCY
+    concurrency = min(max(concurrency, 1), BATCH_MAX_CONCURRENCY)
+    # 批次的条目计入客户端的任务数限额；已达上限时直接拒绝，不再创建新批次
+    client = client_id()
+    try:
+        download_jobs.check_admission(client)
+    except QueueFullError as e:
+        return rejected_response(e)
+    batch = download_batches.create(urls, format_type, concurrency, client=client)
+    return jsonify({
+        'success': True,
+        'batch_id': batch.id,
+        'status': batch.status,
+        'message': '批量任务已创建'
+    })
+
+@app.route('/batch/<batch_id>')
+def get_batch(batch_id):
+    batch = download_batches.get(batch_id)
+    if batch is None:
+        return jsonify({'success': False, 'message': '批量任务不存在'}), 404
+    data = batch.to_dict()
+    for entry in data['entries']:
+        if entry['job_id'] and entry['status'] not in FINAL_STATES:
+            entry['progress'] = download_progress.get(entry['job_id'])
+    return jsonify({'success': True, 'batch': data})
+
+@app.route('/batch/<batch_id>/cancel', methods=['POST'])
+def cancel_batch(batch_id):
+    batch = download_batches.cancel(batch_id)
+    if batch is None:
+        return jsonify({'success': False, 'message': '批量任务不存在'}), 404
+    logger.info(f"收到批量取消请求: {batch_id}")
+    return jsonify({'success': True, 'batch': batch.to_dict()})
+
+@app.route('/batch/<batch_id>/zip')
+def download_batch_zip(batch_id):
+    """边下载边打包：每个条目完成后立即写入 ZIP 发送给客户端"""
+    batch = download_batches.get(batch_id)
+    if batch is None:
+        return jsonify({'success': False, 'message': '批量任务不存在'}), 404
+    return Response(stream_zip(download_batches, batch, DOWNLOAD_FOLDER), mimetype='application/zip', headers={
+        'Content-Disposition': content_disposition(f'batch_{batch_id[:8]}.zip'),
+        'Cache-Control': 'no-store',
+        'X-Accel-Buffering': 'no',
+    })
+
+@app.route('/stream')
+def stream_download():
+    """边下载边发送：只适用于无需合并的单一流（已合并的 mp4、音频）"""
+    url = unquote(request.args.get('url', '')).strip()
+    format_type = request.args.get('format', 'mp4')
+    if not url:
+        return jsonify({'success': False, 'message': 'URL不能为空'}), 400
+    if format_type not in STREAM_FORMATS:
+        return jsonify({'success': False, 'message': f'不支持流式下载的格式: {format_type}'}), 400
+
+    # 已经缓存的文件直接走普通文件下载（支持 Range）
+    target = url_router.resolve(url)
+    url = target['url']
+    cache_key = url_router.cache_key(target, format_type)
+    cached = download_cache.lookup(cache_key)
+    if cached:
+        return redirect(f"/download_file/{quote(cached['filename'])}")
+
+    if not stream_slots.acquire(blocking=False):
+        return jsonify({'success': False, 'message': '当前流式下载过多，请稍后再试'}), 503
+
+    try:
+        info = probe_info(url)
+        if not info or info.get('_type', 'video') != 'video':
+            raise StreamError('只支持单个视频的流式下载')
+        filename = f"{sanitize_filename(info.get('title'))}.{format_type}"
+
+        def save_streamed_file(tee_path):
+            # 流完整发送后把副本放进下载目录和缓存
+            move_into_place(tee_path, os.path.join(DOWNLOAD_FOLDER, filename))
+            file_catalog.add(filename)
+            download_cache.put(cache_key, filename)
+
+        stream = MediaStream(
+            info, format_type, FFMPEG_PATH,
+            tee_dir=DOWNLOAD_FOLDER if STREAM_TEE else None,
+            on_complete=save_streamed_file,
+            storage=storage_manager,
+        )
+        chunks = stream.chunks()
+        # 先读到第一块数据再发送响应头，启动失败时还能返回错误信息
+        first = next(chunks, b'')
+    except Exception as e:
+        stream_slots.release()
+        logger.error(f"流式下载失败: {str(e)}")
+        return jsonify({'success': False, 'message': f'流式下载失败: {str(e)}'}), 502
+
+    def generate():
+        if first:
+            yield first
+        yield from chunks
+
+    def close_stream():
+        chunks.close()
+        stream_slots.release()
+
+    logger.info(f"开始流式下载: {url} -> {filename}")
+    response = Response(generate(), mimetype=stream.mimetype, headers={
+        'Content-Disposition': content_disposition(filename),
+        'Cache-Control': 'no-store',
+        'X-Accel-Buffering': 'no',
+    })
+    response.call_on_close(close_stream)
+    return response
+
 @app.route('/progress')
 def get_progress():
-    with progress_lock:
-        return jsonify(download_progress)
+    # 兼容旧页面：返回最近更新的任务进度
+    return jsonify(download_progress.latest() or {'status': 'idle', 'percent': '0.0%', 'message': '', 'speed': '', 'eta': ''})
+
+@app.route('/progress/<job_id>')
+def get_job_progress(job_id):
+    progress = download_progress.get(job_id) or share_state(shared_store.get, PROGRESS, job_id)
+    if progress is None:
+        return jsonify({'success': False, 'message': '任务不存在'}), 404
+    return jsonify(progress)
+
+def stream_remote_progress(job_id):
+    """任务在其他 worker / 节点上时轮询共享存储推送进度"""
+    last_update = None
+    last_sent = time.monotonic()
+    yield "retry: 3000\n\n"
+    while True:
+        data = share_state(shared_store.get, PROGRESS, job_id)
+        if data is None:
+            yield f"event: done\ndata: {json.dumps({'status': 'error', 'message': '任务不存在'})}\n\n"
+            return
+        if data['updated_at'] != last_update:
+            last_update = data['updated_at']
+            last_sent = time.monotonic()
+            if data['status'] in FINAL_STATES:
+                payload = {'progress': data, 'job': share_state(shared_store.get, JOBS, job_id)}
+                yield f"event: done\ndata: {json.dumps(payload)}\n\n"
+                return
+            yield f"event: progress\ndata: {json.dumps(data)}\n\n"
+        elif time.monotonic() - last_sent >= 15:
+            last_sent = time.monotonic()
+            yield ": keep-alive\n\n"
+        time.sleep(REMOTE_PROGRESS_POLL_INTERVAL)
+
+@app.route('/progress/<job_id>/stream')
+def stream_progress(job_id):
+    if download_progress.get(job_id) is None:
+        if share_state(shared_store.get, PROGRESS, job_id) is None:
+            return jsonify({'success': False, 'message': '任务不存在'}), 404
+        return Response(stream_remote_progress(job_id), mimetype='text/event-stream', headers={
+            'Cache-Control': 'no-cache',
+            'X-Accel-Buffering': 'no',
+        })
+
+    min_interval = 1.0 / PROGRESS_STREAM_MAX_RATE if PROGRESS_STREAM_MAX_RATE > 0 else 0
+
+    def generate():
+        version = -1
+        # 告诉浏览器断线后 3 秒重连
+        yield "retry: 3000\n\n"
+        while True:
+            data, new_version = download_progress.wait(job_id, version, timeout=15)
+            if data is None:
+                yield f"event: done\ndata: {json.dumps({'status': 'error', 'message': '任务不存在'})}\n\n"
+                return
+            if new_version == version:
+                # 心跳，防止代理断开空闲连接
+                yield ": keep-alive\n\n"
+                continue
+            version = new_version
+            if data['status'] in FINAL_STATES:
+                job = download_jobs.get(job_id)
+                payload = {'progress': data, 'job': job.to_dict() if job else None}
+                yield f"event: done\ndata: {json.dumps(payload)}\n\n"
+                return
+            yield f"event: progress\ndata: {json.dumps(data)}\n\n"
+            # 合并推送：间隔内的中间状态直接跳过，下次只发最新快照
+            time.sleep(min_interval)
+
+    return Response(generate(), mimetype='text/event-stream', headers={
+        'Cache-Control': 'no-cache',
+        'X-Accel-Buffering': 'no',
+    })
 
 @app.route('/download_file/<filename>')
 def download_file(filename):
@@ -364,16 +1293,23 @@ def download_file(filename):
         decoded_filename = unquote(filename)
         file_path = os.path.join(DOWNLOAD_FOLDER, decoded_filename)
         
-        logger.info(f"Request to download file: {file_path}")
+        logger.debug(f"Request to download file: {file_path}")
         
-        # 检查文件是否存在
-        if not os.path.exists(file_path):
+        # 检查文件是否存在（查目录索引，不访问磁盘）
+        entry = file_catalog.get(decoded_filename)
+        if entry is None:
+            # 文件可能在其他节点上
+            remote_url = remote_file_url(decoded_filename)
+            if remote_url:
+                logger.info(f"File is on another node, redirecting: {remote_url}")
+                return redirect(remote_url, code=307)
             logger.error(f"File not found: {file_path}")
             return "File not found", 404
             
-        # 使用Flask的send_file函数提供文件下载
-        logger.info(f"Sending file: {file_path}")
-        return send_file(file_path, as_attachment=True)
+        # 支持 Range / ETag / 条件请求，可选交给 nginx 或 X-Sendfile 发送
+        logger.debug(f"Sending file: {file_path}")
+        storage_manager.touch(decoded_filename)
+        return serve_file(file_path, entry, offload=FILE_OFFLOAD, accel_prefix=ACCEL_REDIRECT_PREFIX)
     except Exception as e:
         logger.error(f"Error downloading file: {str(e)}")
         return str(e), 500
@@ -387,8 +1323,12 @@ def delete_file(filename):
         
         logger.info(f"Request to delete file: {file_path}")
         
-        # 检查文件是否存在
-        if not os.path.exists(file_path):
+        # 检查文件是否存在（查目录索引，不访问磁盘）
+        if file_catalog.get(decoded_filename) is None:
+            remote_url = remote_file_url(decoded_filename)
+            if remote_url:
+                # 307 保留 POST 方法，由持有文件的节点删除
+                return redirect(remote_url.replace('/download_file/', '/delete/', 1), code=307)
             logger.warning(f"Attempting to delete non-existent file: {file_path}")
             return jsonify({
                 'success': False,
@@ -397,6 +1337,8 @@ def delete_file(filename):
         
         # 尝试删除文件
         os.remove(file_path)
+        file_catalog.remove(decoded_filename)
+        download_cache.discard_file(decoded_filename)
         logger.info(f"File deleted successfully: {file_path}")
         
         return jsonify({
@@ -420,22 +1362,12 @@ def send_feedback():
         if not from_email or not message:
             return jsonify({'success': False, 'message': '邮箱和消息不能为空'})
         
-        # 创建feedback目录（如果不存在）
-        feedback_dir = os.path.join(os.path.dirname(__file__), 'feedback')
-        os.makedirs(feedback_dir, exist_ok=True)
-        
-        # 添加时间戳到文件名
-        timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
-        filename = f"feedback_{timestamp}_{from_email.replace('@', '_at_')}.txt"
-        filepath = os.path.join(feedback_dir, filename)
-        
-        # 写入反馈内容（添加更多信息）
-        with open(filepath, 'w', encoding='utf-8') as f:
-            f.write(f"时间: {datetime.now().strftime('%Y-%m-%d %H:%M:%S')}\n")
-            f.write(f"发件人: {from_email}\n")
-            f.write(f"IP地址: {request.remote_addr}\n")
-            f.write(f"用户代理: {request.headers.get('User-Agent', 'Unknown')}\n")
-            f.write(f"\n消息内容:\n{'='*50}\n{message}\n{'='*50}\n")
+        feedback_store.add(
+            from_email,
+            message,
+            ip=request.remote_addr,
+            user_agent=request.headers.get('User-Agent', 'Unknown'),
+        )
         
         # 记录到日志
         logger.info(f"收到来自 {from_email} 的反馈")
@@ -446,6 +1378,13 @@ def send_feedback():
         logger.error(f"保存反馈错误: {str(e)}")
         return jsonify({'success': False, 'message': f'发送失败: {str(e)}'})
 
+def parse_day(value):
+    """把 YYYY-MM-DD 转成当天零点的时间戳，空值或格式错误返回 None"""
+    try:
+        return datetime.strptime(value, '%Y-%m-%d').timestamp() if value else None
+    except ValueError:
+        return None
+
 @app.route('/admin/feedback', methods=['GET'])
 def view_feedback():
     # 设置一个安全的密钥（不要使用默认值）
@@ -453,33 +1392,36 @@ def view_feedback():
     if admin_key != '你的安全密钥':  # 替换为你自己设定的复杂密钥
         return "未授权访问", 401
     
-    feedback_dir = os.path.join(os.path.dirname(__file__), 'feedback')
-    feedbacks = []
-    
-    if os.path.exists(feedback_dir):
-        for filename in sorted(os.listdir(feedback_dir), reverse=True):
-            if filename.startswith('feedback_') and filename.endswith('.txt'):
-                file_path = os.path.join(feedback_dir, filename)
-                with open(file_path, 'r', encoding='utf-8') as f:
-                    content = f.read()
-                
-                # 提取基本信息
-                email = "Unknown"
-                date = "Unknown"
-                for line in content.split('\n'):
-                    if line.startswith("发件人:"):
-                        email = line.replace("发件人:", "").strip()
-                    elif line.startswith("时间:"):
-                        date = line.replace("时间:", "").strip()
-                
-                feedbacks.append({
-                    'filename': filename,
-                    'email': email,
-                    'date': date,
-                    'content': content
-                })
+    # 筛选条件：邮箱、起止日期（含结束当天）；before 是上一页最后一条的 id
+    email = request.args.get('email', '').strip()
+    since = request.args.get('since', '').strip()
+    until = request.args.get('until', '').strip()
+    until_ts = parse_day(until)
+    per_page = min(max(request.args.get('per_page', FEEDBACK_PER_PAGE, type=int) or FEEDBACK_PER_PAGE, 1), 500)
+    rows, has_more = feedback_store.list(
+        limit=per_page,
+        before=request.args.get('before', type=int),
+        email=email or None,
+        since=parse_day(since),
+        until=until_ts + 86400 if until_ts is not None else None,
+    )
+    feedbacks = [{
+        'id': row['id'],
+        'email': row['email'],
+        'date': datetime.fromtimestamp(row['created_at']).strftime('%Y-%m-%d %H:%M:%S'),
+        'ip': row['ip'],
+        'user_agent': row['user_agent'],
+        'content': row['message'],
+    } for row in rows]
     
-    return render_template('admin_feedback.html', feedbacks=feedbacks)
+    return render_template(
+        'admin_feedback.html',
+        feedbacks=feedbacks,
+        key=admin_key,
+        filters={'email': email, 'since': since, 'until': until, 'per_page': per_page},
+        next_before=feedbacks[-1]['id'] if has_more else None,
+        is_first_page=not request.args.get('before'),
+    )
 
 # 主程序入口
 if __name__ == '__main__':
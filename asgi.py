@@ -0,0 +1,336 @@
+"""ASGI 入口：进度推送、文件列表和文件下载由异步处理器直接服务，其余请求交给 Flask。
+
+    uvicorn asgi:application --host 0.0.0.0 --port 8000
+
+空闲的 SSE 连接和慢速下载只占用一个协程；磁盘读取、目录扫描等阻塞操作放进 I/O 线程池，
+Flask 视图在 WSGI 线程池中执行。服务器支持 zerocopysend / pathsend 扩展时直接用 sendfile 发送文件。
+"""
+import asyncio
+import json
+import logging
+import mimetypes
+import os
+import re
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import parse_qsl, unquote
+
+from a2wsgi import WSGIMiddleware
+from werkzeug.datastructures import MultiDict
+from werkzeug.http import http_date, parse_date, parse_etags, parse_if_range_header, parse_range_header
+
+from app import (
+    app as flask_app, download_jobs, download_progress, file_catalog, storage_manager, shared_store,
+    share_state, remote_file_url, list_files_page, start_background_tasks,
+    DOWNLOAD_FOLDER, FILE_OFFLOAD, PROGRESS_STREAM_MAX_RATE, REMOTE_PROGRESS_POLL_INTERVAL,
+)
+from fileserve import READ_CHUNK_SIZE, content_disposition, file_etag, normalize_ranges
+from progress import FINAL_STATES
+from store import JOBS, PROGRESS
+
+logger = logging.getLogger(__name__)
+
+# 执行 Flask 视图的线程数，与原先 gthread 的线程数一致
+ASGI_WSGI_THREADS = int(os.environ.get('ASGI_WSGI_THREADS', 32))
+# 异步处理器中读文件、查共享存储等阻塞操作使用的线程数
+ASGI_IO_THREADS = int(os.environ.get('ASGI_IO_THREADS', 8))
+
+_io_pool = ThreadPoolExecutor(max_workers=ASGI_IO_THREADS, thread_name_prefix='asgi-io')
+
+SSE_HEADERS = [
+    (b'content-type', b'text/event-stream; charset=utf-8'),
+    (b'cache-control', b'no-cache'),
+    (b'x-accel-buffering', b'no'),
+]
+
+
+def _request_headers(scope):
+    return {k.decode('latin-1').lower(): v.decode('latin-1') for k, v in scope['headers']}
+
+
+async def _run_blocking(func, *args):
+    return await asyncio.get_running_loop().run_in_executor(_io_pool, func, *args)
+
+
+async def _send_response(send, status, body=b'', headers=(), head=False):
+    headers = list(headers) + [(b'content-length', str(len(body)).encode('ascii'))]
+    await send({'type': 'http.response.start', 'status': status, 'headers': headers})
+    await send({'type': 'http.response.body', 'body': b'' if head else body})
+
+
+async def _send_json(send, data, status=200):
+    body = json.dumps(data).encode('utf-8')
+    await _send_response(send, status, body, [(b'content-type', b'application/json')])
+
+
+async def _until_disconnect(receive):
+    while True:
+        message = await receive()
+        if message['type'] == 'http.disconnect':
+            return
+
+
+async def _run_until_disconnect(receive, coro):
+    """执行发送响应体的协程，客户端断开时立即取消，不再读取文件或等待进度"""
+    task = asyncio.ensure_future(coro)
+    watcher = asyncio.ensure_future(_until_disconnect(receive))
+    done, pending = await asyncio.wait({task, watcher}, return_when=asyncio.FIRST_COMPLETED)
+    for t in pending:
+        t.cancel()
+    if task in done:
+        task.result()
+
+
+# ---- 进度 ----
+
+def _sse(event, data):
+    return f"event: {event}\ndata: {json.dumps(data)}\n\n".encode('utf-8')
+
+
+async def _local_progress_events(job_id):
+    min_interval = 1.0 / PROGRESS_STREAM_MAX_RATE if PROGRESS_STREAM_MAX_RATE > 0 else 0
+    version = -1
+    yield b"retry: 3000\n\n"
+    while True:
+        data, new_version = await download_progress.wait_async(job_id, version, timeout=15)
+        if data is None:
+            yield _sse('done', {'status': 'error', 'message': '任务不存在'})
+            return
+        if new_version == version:
+            yield b": keep-alive\n\n"
+            continue
+        version = new_version
+        if data['status'] in FINAL_STATES:
+            job = download_jobs.get(job_id)
+            yield _sse('done', {'progress': data, 'job': job.to_dict() if job else None})
+            return
+        yield _sse('progress', data)
+        # 合并推送：间隔内的中间状态直接跳过，下次只发最新快照
+        await asyncio.sleep(min_interval)
+
+
+async def _remote_progress_events(job_id):
+    """任务在其他 worker / 节点上时轮询共享存储"""
+    loop = asyncio.get_running_loop()
+    last_update = None
+    last_sent = loop.time()
+    yield b"retry: 3000\n\n"
+    while True:
+        data = await _run_blocking(share_state, shared_store.get, PROGRESS, job_id)
+        if data is None:
+            yield _sse('done', {'status': 'error', 'message': '任务不存在'})
+            return
+        if data['updated_at'] != last_update:
+            last_update = data['updated_at']
+            last_sent = loop.time()
+            if data['status'] in FINAL_STATES:
+                job = await _run_blocking(share_state, shared_store.get, JOBS, job_id)
+                yield _sse('done', {'progress': data, 'job': job})
+                return
+            yield _sse('progress', data)
+        elif loop.time() - last_sent >= 15:
+            last_sent = loop.time()
+            yield b": keep-alive\n\n"
+        await asyncio.sleep(REMOTE_PROGRESS_POLL_INTERVAL)
+
+
+async def stream_progress(scope, receive, send, job_id):
+    if download_progress.get(job_id) is not None:
+        events = _local_progress_events(job_id)
+    elif await _run_blocking(share_state, shared_store.get, PROGRESS, job_id) is not None:
+        events = _remote_progress_events(job_id)
+    else:
+        await _send_json(send, {'success': False, 'message': '任务不存在'}, 404)
+        return
+
+    async def pump():
+        await send({'type': 'http.response.start', 'status': 200, 'headers': SSE_HEADERS})
+        async for chunk in events:
+            await send({'type': 'http.response.body', 'body': chunk, 'more_body': True})
+        await send({'type': 'http.response.body', 'body': b''})
+
+    await _run_until_disconnect(receive, pump())
+
+
+async def get_job_progress(scope, receive, send, job_id):
+    progress = download_progress.get(job_id)
+    if progress is None:
+        progress = await _run_blocking(share_state, shared_store.get, PROGRESS, job_id)
+    if progress is None:
+        await _send_json(send, {'success': False, 'message': '任务不存在'}, 404)
+        return
+    await _send_json(send, progress)
+
+
+async def get_latest_progress(scope, receive, send):
+    await _send_json(send, download_progress.latest() or {
+        'status': 'idle', 'percent': '0.0%', 'message': '', 'speed': '', 'eta': '',
+    })
+
+
+# ---- 文件列表 ----
+
+async def api_files(scope, receive, send):
+    args = MultiDict(parse_qsl(scope.get('query_string', b'').decode('latin-1')))
+    try:
+        listing = await _run_blocking(list_files_page, args)
+    except Exception as e:
+        logger.error(f"Error listing files: {str(e)}")
+        await _send_json(send, {'success': False, 'message': str(e)}, 500)
+        return
+    await _send_json(send, {'success': True, **listing})
+
+
+# ---- 文件下载 ----
+
+def _if_range_matches(value, etag, mtime):
+    if_range = parse_if_range_header(value)
+    if not if_range.etag and not if_range.date:
+        return True
+    if if_range.etag:
+        return if_range.etag == etag
+    return int(mtime) <= if_range.date.timestamp()
+
+
+def _not_modified(headers, etag, mtime):
+    if 'if-none-match' in headers:
+        return parse_etags(headers['if-none-match']).contains(etag)
+    since = parse_date(headers.get('if-modified-since'))
+    return since is not None and int(mtime) <= since.timestamp()
+
+
+async def _send_file_body(scope, send, path, start, stop, size):
+    extensions = scope.get('extensions') or {}
+    if 'http.response.zerocopysend' in extensions:
+        with open(path, 'rb') as f:
+            await send({
+                'type': 'http.response.zerocopysend', 'file': f,
+                'offset': start, 'count': stop - start,
+            })
+        return
+    if 'http.response.pathsend' in extensions and start == 0 and stop == size:
+        await send({'type': 'http.response.pathsend', 'path': os.path.abspath(path)})
+        return
+
+    f = await _run_blocking(open, path, 'rb')
+    try:
+        await _run_blocking(f.seek, start)
+        remaining = stop - start
+        while remaining > 0:
+            chunk = await _run_blocking(f.read, min(READ_CHUNK_SIZE, remaining))
+            if not chunk:
+                break
+            remaining -= len(chunk)
+            await send({'type': 'http.response.body', 'body': chunk, 'more_body': remaining > 0})
+        if remaining > 0:
+            # 文件在发送过程中被截断
+            await send({'type': 'http.response.body', 'body': b''})
+    finally:
+        f.close()
+
+
+async def download_file(scope, receive, send, filename, fallback):
+    head = scope['method'] == 'HEAD'
+    name = unquote(filename)
+    headers = _request_headers(scope)
+    rng = parse_range_header(headers.get('range'))
+    # 交给前端服务器发送和多段 Range 仍由 Flask 处理（包括 werkzeug 解析不了的重叠、乱序区间）
+    if FILE_OFFLOAD or ',' in headers.get('range', ''):
+        await fallback(scope, receive, send)
+        return
+
+    entry = await _run_blocking(file_catalog.get, name)
+    if entry is None:
+        remote_url = await _run_blocking(remote_file_url, name)
+        if remote_url:
+            logger.info(f"File is on another node, redirecting: {remote_url}")
+            await _send_response(send, 307, headers=[(b'location', remote_url.encode('latin-1'))], head=head)
+            return
+        logger.error(f"File not found: {os.path.join(DOWNLOAD_FOLDER, name)}")
+        await _send_response(send, 404, b'File not found', [(b'content-type', b'text/plain; charset=utf-8')], head)
+        return
+
+    path = os.path.join(DOWNLOAD_FOLDER, name)
+    size = entry['size']
+    etag = file_etag(entry)
+    response_headers = [
+        (b'etag', f'"{etag}"'.encode('ascii')),
+        (b'last-modified', http_date(entry['mtime']).encode('ascii')),
+        (b'cache-control', b'no-cache'),
+        (b'accept-ranges', b'bytes'),
+    ]
+    if _not_modified(headers, etag, entry['mtime']):
+        await send({'type': 'http.response.start', 'status': 304, 'headers': response_headers})
+        await send({'type': 'http.response.body', 'body': b''})
+        return
+
+    storage_manager.touch(name)
+    status, start, stop = 200, 0, size
+    if rng is not None and rng.units == 'bytes' and _if_range_matches(headers.get('if-range'), etag, entry['mtime']):
+        ranges = normalize_ranges(rng.ranges, size)
+        if not ranges:
+            await _send_response(send, 416, headers=[(b'content-range', f'bytes */{size}'.encode('ascii'))], head=head)
+            return
+        status, (start, stop) = 206, ranges[0]
+        response_headers.append((b'content-range', f'bytes {start}-{stop - 1}/{size}'.encode('ascii')))
+
+    mimetype = mimetypes.guess_type(name)[0] or 'application/octet-stream'
+    response_headers += [
+        (b'content-type', mimetype.encode('latin-1')),
+        (b'content-length', str(stop - start).encode('ascii')),
+        (b'content-disposition', content_disposition(name).encode('latin-1')),
+    ]
+    logger.info(f"Sending file: {path}")
+    await send({'type': 'http.response.start', 'status': status, 'headers': response_headers})
+    if head or stop == start:
+        await send({'type': 'http.response.body', 'body': b''})
+        return
+    await _run_until_disconnect(receive, _send_file_body(scope, send, path, start, stop, size))
+
+
+class ASGIApp:
+    """按路径分发：少数 I/O 密集的接口走异步处理器，其余交给 WSGI 线程池中的 Flask"""
+
+    routes = [
+        (('GET',), re.compile(r'^/progress/([^/]+)/stream$'), stream_progress),
+        (('GET',), re.compile(r'^/progress/([^/]+)$'), get_job_progress),
+        (('GET',), re.compile(r'^/progress$'), get_latest_progress),
+        (('GET',), re.compile(r'^/api/files$'), api_files),
+    ]
+    file_route = re.compile(r'^/download_file/([^/]+)$')
+
+    def __init__(self, wsgi_app, threads=ASGI_WSGI_THREADS):
+        self.wsgi = WSGIMiddleware(wsgi_app, workers=threads)
+
+    async def __call__(self, scope, receive, send):
+        if scope['type'] == 'lifespan':
+            await self._lifespan(receive, send)
+            return
+        if scope['type'] != 'http':
+            return
+        path = scope['path']
+        method = scope['method']
+        m = self.file_route.match(path)
+        if m and method in ('GET', 'HEAD'):
+            await download_file(scope, receive, send, m.group(1), self.wsgi)
+            return
+        for methods, pattern, handler in self.routes:
+            m = pattern.match(path)
+            if m and method in methods:
+                await handler(scope, receive, send, *m.groups())
+                return
+        await self.wsgi(scope, receive, send)
+
+    async def _lifespan(self, receive, send):
+        while True:
+            message = await receive()
+            if message['type'] == 'lifespan.startup':
+                # 在 worker 进程中启动后台线程；不支持 lifespan 的服务器由第一个 Flask 请求启动
+                start_background_tasks()
+                await send({'type': 'lifespan.startup.complete'})
+            elif message['type'] == 'lifespan.shutdown':
+                _io_pool.shutdown(wait=False)
+                await send({'type': 'lifespan.shutdown.complete'})
+                return
+
+
+application = ASGIApp(flask_app)
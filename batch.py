@@ -0,0 +1,290 @@
+import logging
+import os
+import threading
+import time
+import uuid
+import zipfile
+from collections import OrderedDict
+
+from jobs import QueueFullError, TERMINAL_STATES
+
+logger = logging.getLogger(__name__)
+
+READ_CHUNK_SIZE = 256 * 1024
+
+
+class Batch:
+    """一组下载任务：多个链接，或由一个播放列表/频道展开得到的视频"""
+
+    def __init__(self, urls, format_type, concurrency, client=None):
+        self.id = uuid.uuid4().hex
+        self.urls = urls
+        self.format_type = format_type
+        self.concurrency = concurrency
+        # 提交批次的客户端，条目计入该客户端的任务数限额
+        self.client = client
+        # expanding -> running -> finished / cancelled / error
+        self.status = 'expanding'
+        self.entries = []
+        self.error = None
+        self.created_at = time.time()
+        self.finished_at = None
+        self.cancel_event = threading.Event()
+
+    @property
+    def done(self):
+        return self.status in ('finished', 'cancelled', 'error')
+
+    def active(self):
+        return sum(1 for e in self.entries if e['status'] in ('queued', 'running'))
+
+    def to_dict(self):
+        counts = {}
+        for e in self.entries:
+            counts[e['status']] = counts.get(e['status'], 0) + 1
+        return {
+            'id': self.id,
+            'format': self.format_type,
+            'status': self.status,
+            'concurrency': self.concurrency,
+            'total': len(self.entries),
+            'counts': counts,
+            'entries': [dict(e) for e in self.entries],
+            'error': self.error,
+            'created_at': self.created_at,
+            'finished_at': self.finished_at,
+        }
+
+
+class BatchManager:
+    """展开播放列表，按每个批次的并发上限把条目逐个提交到下载线程池。
+
+    expand(url) 返回 [{'url', 'title'}]；start(url, format_type, client) 返回 Job，缓存命中时返回结果字典；
+    cancel(job_id) 取消单个任务。任务结束时由 job_done 通知。"""
+
+    def __init__(self, expand, start, cancel, max_entries=200, max_history=100):
+        self._expand = expand
+        self._start = start
+        self._cancel = cancel
+        self.max_entries = max_entries
+        self._max_history = max_history
+        self._batches = OrderedDict()
+        self._by_job = {}
+        self._cond = threading.Condition()
+
+    def create(self, urls, format_type, concurrency, client=None):
+        batch = Batch(urls, format_type, concurrency, client)
+        with self._cond:
+            self._batches[batch.id] = batch
+            self._trim_history()
+        threading.Thread(target=self._run, args=(batch,), name=f'batch-{batch.id[:8]}', daemon=True).start()
+        logger.info(f"批量任务 {batch.id} 已创建: {len(urls)} 个链接, 并发 {concurrency}")
+        return batch
+
+    def get(self, batch_id):
+        with self._cond:
+            return self._batches.get(batch_id)
+
+    def cancel(self, batch_id):
+        with self._cond:
+            batch = self._batches.get(batch_id)
+            if batch is None:
+                return None
+            batch.cancel_event.set()
+            job_ids = [e['job_id'] for e in batch.entries if e['job_id'] and e['status'] in ('queued', 'running')]
+            for e in batch.entries:
+                if e['status'] == 'pending':
+                    e['status'] = 'cancelled'
+            self._cond.notify_all()
+        for job_id in job_ids:
+            self._cancel(job_id)
+        return batch
+
+    def wait_for_change(self, batch, seen, timeout=None):
+        """等待批次中出现 seen（条目 id 的集合）之外的已完成条目，或批次结束。
+
+        返回 (新完成的条目, 批次是否结束)；超时返回当时的状态"""
+        def ready():
+            return [e for e in batch.entries if e['status'] == 'finished' and e['file'] and id(e) not in seen]
+
+        with self._cond:
+            self._cond.wait_for(lambda: batch.done or ready(), timeout)
+            return ready(), batch.done
+
+    def job_done(self, job):
+        with self._cond:
+            for batch, entry in self._by_job.pop(job.id, []):
+                self._apply_job(entry, job)
+            self._cond.notify_all()
+
+    def _trim_history(self):
+        # 调用方已持有锁；只淘汰已结束的批次
+        for batch_id in list(self._batches):
+            if len(self._batches) <= self._max_history:
+                break
+            if self._batches[batch_id].done:
+                del self._batches[batch_id]
+
+    def _apply_job(self, entry, job):
+        entry['status'] = job.status
+        if job.status == 'finished' and job.result:
+            entry['file'] = job.result.get('file')
+        elif job.done:
+            entry['error'] = job.error
+
+    def _expand_all(self, batch):
+        entries = []
+        # 多个链接按单个视频处理；只有一个链接时才展开播放列表/频道
+        if len(batch.urls) > 1:
+            items = [{'url': url, 'title': None} for url in batch.urls]
+        else:
+            items = self._expand(batch.urls[0])
+        for item in items[:self.max_entries]:
+            entries.append({
+                'url': item['url'],
+                'title': item.get('title'),
+                'job_id': None,
+                'status': 'pending',
+                'file': None,
+                'error': None,
+            })
+        if len(items) > self.max_entries:
+            logger.warning(f"批量任务 {batch.id} 条目过多，只处理前 {self.max_entries} 个")
+        return entries
+
+    def _submit(self, batch, entry):
+        while not batch.cancel_event.is_set():
+            try:
+                return self._start(entry['url'], batch.format_type, batch.client)
+            except QueueFullError:
+                # 全局队列已满或客户端的任务数已达上限，等有任务结束再提交
+                with self._cond:
+                    self._cond.wait(1)
+        return None
+
+    def _run(self, batch):
+        try:
+            entries = self._expand_all(batch)
+        except Exception as e:
+            logger.error(f"批量任务 {batch.id} 展开失败: {str(e)}")
+            with self._cond:
+                batch.status = 'error'
+                batch.error = str(e)
+                batch.finished_at = time.time()
+                self._cond.notify_all()
+            return
+        with self._cond:
+            batch.entries = entries
+            batch.status = 'running'
+            self._cond.notify_all()
+        logger.info(f"批量任务 {batch.id} 共 {len(entries)} 个条目")
+
+        for entry in entries:
+            with self._cond:
+                while batch.active() >= batch.concurrency and not batch.cancel_event.is_set():
+                    self._cond.wait(1)
+            if batch.cancel_event.is_set():
+                break
+            try:
+                result = self._submit(batch, entry)
+            except Exception as e:
+                logger.error(f"批量任务 {batch.id} 提交失败 {entry['url']}: {str(e)}")
+                with self._cond:
+                    entry['status'] = 'error'
+                    entry['error'] = str(e)
+                    self._cond.notify_all()
+                continue
+            if result is None:
+                break
+            with self._cond:
+                if isinstance(result, dict):
+                    # 缓存命中，无需下载
+                    entry['status'] = 'finished'
+                    entry['file'] = result.get('file')
+                else:
+                    entry['job_id'] = result.id
+                    if result.status in TERMINAL_STATES:
+                        self._apply_job(entry, result)
+                    else:
+                        entry['status'] = result.status
+                        self._by_job.setdefault(result.id, []).append((batch, entry))
+                self._cond.notify_all()
+
+        with self._cond:
+            while batch.active() and not batch.cancel_event.is_set():
+                self._cond.wait(1)
+            for entry in entries:
+                if entry['status'] == 'pending':
+                    entry['status'] = 'cancelled'
+            batch.status = 'cancelled' if batch.cancel_event.is_set() else 'finished'
+            batch.finished_at = time.time()
+            self._cond.notify_all()
+        logger.info(f"批量任务 {batch.id} 结束: {batch.status}")
+
+
+class _ZipSink:
+    """不可 seek 的输出缓冲，zipfile 写入的数据在这里取出后发送给客户端"""
+
+    def __init__(self):
+        self._chunks = []
+
+    def write(self, data):
+        self._chunks.append(bytes(data))
+        return len(data)
+
+    def flush(self):
+        pass
+
+    def drain(self):
+        data = b''.join(self._chunks)
+        self._chunks = []
+        return data
+
+
+def _unique_name(name, used):
+    base, ext = os.path.splitext(name)
+    candidate, i = name, 1
+    while candidate in used:
+        candidate = f"{base} ({i}){ext}"
+        i += 1
+    used.add(candidate)
+    return candidate
+
+
+def stream_zip(manager, batch, folder):
+    """按完成顺序把批次中的文件写进 ZIP 并立即发送，不等全部下载完成。
+
+    媒体文件本身已压缩，使用 ZIP_STORED；失败的条目列在 errors.txt 中。"""
+    sink = _ZipSink()
+    sent = set()
+    used_names = set()
+    missing = []
+    with zipfile.ZipFile(sink, 'w', compression=zipfile.ZIP_STORED) as zf:
+        while True:
+            ready, finished = manager.wait_for_change(batch, sent, timeout=1)
+            for entry in ready:
+                sent.add(id(entry))
+                path = os.path.join(folder, entry['file']['name'])
+                try:
+                    f = open(path, 'rb')
+                except OSError as e:
+                    logger.warning(f"打包时文件不可读 {path}: {str(e)}")
+                    missing.append(f"{entry['url']}: 文件已被删除")
+                    continue
+                with f, zf.open(_unique_name(entry['file']['name'], used_names), 'w', force_zip64=True) as dest:
+                    while True:
+                        chunk = f.read(READ_CHUNK_SIZE)
+                        if not chunk:
+                            break
+                        dest.write(chunk)
+                        data = sink.drain()
+                        if data:
+                            yield data
+                yield sink.drain()
+            if finished and not ready:
+                break
+        errors = [f"{e['url']}: {e['error'] or e['status']}" for e in batch.entries if e['status'] != 'finished']
+        errors.extend(missing)
+        if errors:
+            zf.writestr('errors.txt', '\n'.join(errors) + '\n')
+    yield sink.drain()
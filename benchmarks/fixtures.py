@@ -0,0 +1,58 @@
+"""用 ffmpeg 生成基准测试用的媒体文件（mp4 / m4a / HLS），相同参数只生成一次"""
+import json
+import logging
+import os
+import subprocess
+
+logger = logging.getLogger(__name__)
+
+# 名称 -> (源站上的路径, 说明)
+FIXTURES = {
+    'mp4': ('video.mp4', 'H.264 + AAC 单文件'),
+    'm4a': ('audio.m4a', 'AAC 音频'),
+    'hls': ('hls/stream.m3u8', 'H.264 + AAC，HLS 分片'),
+}
+
+
+def _run(cmd):
+    result = subprocess.run(cmd, capture_output=True)
+    if result.returncode != 0:
+        raise RuntimeError(f"ffmpeg 失败: {result.stderr.decode('utf-8', 'replace')[-500:]}")
+
+
+def generate(directory, ffmpeg_path, duration=30, resolution='1280x720', video_bitrate='2M'):
+    """在 directory 中生成全部样本，返回 {名称: 相对路径}；参数未变化时复用已有文件"""
+    os.makedirs(directory, exist_ok=True)
+    ffmpeg = os.path.join(ffmpeg_path, 'ffmpeg')
+    params = {'duration': duration, 'resolution': resolution, 'video_bitrate': video_bitrate}
+    stamp_path = os.path.join(directory, 'fixtures.json')
+    try:
+        with open(stamp_path, encoding='utf-8') as f:
+            if json.load(f) == params and all(os.path.exists(os.path.join(directory, p)) for p, _ in FIXTURES.values()):
+                return {name: path for name, (path, _) in FIXTURES.items()}
+    except (OSError, ValueError):
+        pass
+
+    logger.info(f"生成样本: {duration}s {resolution} {video_bitrate}")
+    video = os.path.join(directory, 'video.mp4')
+    _run([
+        ffmpeg, '-y', '-loglevel', 'error',
+        '-f', 'lavfi', '-i', f'testsrc2=size={resolution}:rate=30',
+        '-f', 'lavfi', '-i', 'sine=frequency=440:sample_rate=44100',
+        '-t', str(duration),
+        '-c:v', 'libx264', '-preset', 'ultrafast', '-b:v', video_bitrate, '-pix_fmt', 'yuv420p',
+        '-c:a', 'aac', '-b:a', '128k',
+        '-movflags', '+faststart', video,
+    ])
+    _run([ffmpeg, '-y', '-loglevel', 'error', '-i', video, '-vn', '-c:a', 'copy', os.path.join(directory, 'audio.m4a')])
+    hls_dir = os.path.join(directory, 'hls')
+    os.makedirs(hls_dir, exist_ok=True)
+    _run([
+        ffmpeg, '-y', '-loglevel', 'error', '-i', video, '-c', 'copy',
+        '-f', 'hls', '-hls_time', '2', '-hls_playlist_type', 'vod',
+        '-hls_segment_filename', os.path.join(hls_dir, 'segment_%03d.ts'),
+        os.path.join(hls_dir, 'stream.m3u8'),
+    ])
+    with open(stamp_path, 'w', encoding='utf-8') as f:
+        json.dump(params, f)
+    return {name: path for name, (path, _) in FIXTURES.items()}
@@ -0,0 +1,115 @@
+"""模拟视频源站的本地 HTTP 服务：支持 Range，可限速。
+
+/r<n>/<path> 会映射到样本目录中的 <path>，文件名中的 _<n> 后缀会被去掉，
+这样每个请求的 URL 和标题都不同，不会命中下载缓存或写到同一个文件名。"""
+import http.server
+import os
+import re
+import socketserver
+import threading
+import time
+
+_PREFIX_RE = re.compile(r'^/r(\d+)(/.*)$')
+CHUNK_SIZE = 64 * 1024
+
+
+class _Handler(http.server.SimpleHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+
+    def log_message(self, format, *args):
+        pass
+
+    def translate_path(self, path):
+        path = path.split('?', 1)[0]
+        m = _PREFIX_RE.match(path)
+        if m:
+            # 只去掉与请求编号相同的后缀，HLS 分片名中的序号保持不变
+            path = re.sub(rf'_{m.group(1)}(\.[^./]+)$', r'\1', m.group(2))
+        return super().translate_path(path)
+
+    def _send_body(self, f, length):
+        rate = self.server.rate_limit
+        started = time.monotonic()
+        sent = 0
+        while sent < length:
+            chunk = f.read(min(CHUNK_SIZE, length - sent))
+            if not chunk:
+                break
+            self.wfile.write(chunk)
+            sent += len(chunk)
+            if rate:
+                # 按平均速率限速
+                delay = sent / rate - (time.monotonic() - started)
+                if delay > 0:
+                    time.sleep(delay)
+        self.server.count(sent)
+
+    def do_GET(self):
+        path = self.translate_path(self.path)
+        if not os.path.isfile(path):
+            self.send_error(404, 'File not found')
+            return
+        size = os.path.getsize(path)
+        start, stop = 0, size
+        m = re.match(r'bytes=(\d*)-(\d*)$', self.headers.get('Range', ''))
+        if m and (m.group(1) or m.group(2)):
+            if m.group(1):
+                start = int(m.group(1))
+                stop = min(int(m.group(2)) + 1, size) if m.group(2) else size
+            else:
+                start = max(size - int(m.group(2)), 0)
+            if start >= size:
+                self.send_response(416)
+                self.send_header('Content-Range', f'bytes */{size}')
+                self.send_header('Content-Length', '0')
+                self.end_headers()
+                return
+            self.send_response(206)
+            self.send_header('Content-Range', f'bytes {start}-{stop - 1}/{size}')
+        else:
+            self.send_response(200)
+        self.send_header('Content-Type', self.guess_type(path))
+        self.send_header('Content-Length', str(stop - start))
+        self.send_header('Accept-Ranges', 'bytes')
+        self.end_headers()
+        with open(path, 'rb') as f:
+            f.seek(start)
+            self._send_body(f, stop - start)
+
+    def do_HEAD(self):
+        path = self.translate_path(self.path)
+        if not os.path.isfile(path):
+            self.send_error(404, 'File not found')
+            return
+        self.send_response(200)
+        self.send_header('Content-Type', self.guess_type(path))
+        self.send_header('Content-Length', str(os.path.getsize(path)))
+        self.send_header('Accept-Ranges', 'bytes')
+        self.end_headers()
+
+
+class OriginServer(socketserver.ThreadingMixIn, http.server.HTTPServer):
+    daemon_threads = True
+    allow_reuse_address = True
+
+    def __init__(self, directory, host='127.0.0.1', port=0, rate_limit=0):
+        self.directory = directory
+        # 每个连接的限速（字节/秒），0 不限
+        self.rate_limit = rate_limit
+        self.bytes_sent = 0
+        self._lock = threading.Lock()
+        handler = lambda *args, **kwargs: _Handler(*args, directory=directory, **kwargs)
+        super().__init__((host, port), handler)
+
+    def count(self, n):
+        with self._lock:
+            self.bytes_sent += n
+
+    @property
+    def base_url(self):
+        host, port = self.server_address[:2]
+        return f'http://{host}:{port}'
+
+    def start(self):
+        threading.Thread(target=self.serve_forever, name='bench-origin', daemon=True).start()
+        return self
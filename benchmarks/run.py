@@ -0,0 +1,348 @@
+"""下载流程的离线基准测试：/download -> 后台下载 -> 转码/合并 -> 落盘 -> /download_file。
+
+全部请求都发往本地模拟源站，不访问外网。示例：
+
+    python benchmarks/run.py --scenario mp4:mp4,m4a:mp3,hls:mp4 --concurrency 1,4 --requests 20 \\
+        --output results.json --compare previous.json
+"""
+import argparse
+import json
+import os
+import platform
+import resource
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import urllib.parse
+import urllib.request
+from concurrent.futures import ThreadPoolExecutor
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+REPO_DIR = os.path.dirname(BENCH_DIR)
+sys.path.insert(0, REPO_DIR)
+
+from fixtures import FIXTURES, generate  # noqa: E402
+from origin import OriginServer  # noqa: E402
+
+TERMINAL = ('finished', 'error', 'cancelled')
+
+
+def percentile(values, q):
+    """最近秩法分位数"""
+    if not values:
+        return None
+    ordered = sorted(values)
+    index = max(int(round(q / 100 * len(ordered) + 0.5)) - 1, 0)
+    return ordered[min(index, len(ordered) - 1)]
+
+
+def summarize(values):
+    if not values:
+        return None
+    return {
+        'p50': percentile(values, 50),
+        'p90': percentile(values, 90),
+        'p99': percentile(values, 99),
+        'max': max(values),
+        'mean': sum(values) / len(values),
+    }
+
+
+def read_proc_io():
+    """本进程的磁盘读写字节数（仅 Linux）"""
+    try:
+        with open('/proc/self/io') as f:
+            fields = dict(line.split(': ') for line in f.read().splitlines())
+        return {'read_bytes': int(fields['read_bytes']), 'write_bytes': int(fields['write_bytes'])}
+    except (OSError, KeyError, ValueError):
+        return None
+
+
+def read_rss_kb():
+    try:
+        with open('/proc/self/status') as f:
+            for line in f:
+                if line.startswith('VmRSS:'):
+                    return int(line.split()[1])
+    except OSError:
+        pass
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+
+class RssSampler:
+    """后台采样本进程 RSS，取本轮的峰值"""
+
+    def __init__(self, interval=0.1):
+        self.interval = interval
+        self.peak = 0
+        self._stop = threading.Event()
+        self._thread = None
+
+    def __enter__(self):
+        self.peak = read_rss_kb()
+        self._thread = threading.Thread(target=self._loop, daemon=True)
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        self._stop.set()
+        self._thread.join()
+
+    def _loop(self):
+        while not self._stop.wait(self.interval):
+            self.peak = max(self.peak, read_rss_kb())
+
+
+class Client:
+    """调用被测服务的 HTTP 接口"""
+
+    def __init__(self, base_url, timeout):
+        self.base_url = base_url
+        self.timeout = timeout
+
+    def _json(self, method, path, data=None):
+        body = urllib.parse.urlencode(data).encode() if data is not None else None
+        req = urllib.request.Request(self.base_url + path, data=body, method=method)
+        try:
+            with urllib.request.urlopen(req, timeout=self.timeout) as resp:
+                return json.loads(resp.read())
+        except urllib.error.HTTPError as e:
+            return json.loads(e.read() or b'{}')
+
+    def download(self, url, format_type):
+        """完整走一遍下载流程，返回本次请求的测量结果"""
+        started = time.perf_counter()
+        result = {'ok': False, 'url': url}
+        submitted = self._json('POST', '/download', {'url': url, 'format': format_type})
+        job_id = submitted.get('job_id')
+        file_info = submitted.get('file')
+        job = None
+        if job_id:
+            deadline = started + self.timeout
+            while time.perf_counter() < deadline:
+                job = self._json('GET', f'/jobs/{job_id}')['job']
+                if job['status'] in TERMINAL:
+                    break
+                time.sleep(0.05)
+            if not job or job['status'] != 'finished':
+                result['error'] = (job or {}).get('error') or (job or {}).get('status') or 'timeout'
+                return result
+            file_info = job['result']['file']
+        elif not file_info:
+            result['error'] = submitted.get('message', 'unknown')
+            return result
+        job_done = time.perf_counter()
+
+        size = 0
+        name = urllib.parse.quote(file_info['name'])
+        with urllib.request.urlopen(f'{self.base_url}/download_file/{name}', timeout=self.timeout) as resp:
+            while True:
+                chunk = resp.read(1024 * 1024)
+                if not chunk:
+                    break
+                size += len(chunk)
+        finished = time.perf_counter()
+        result.update({
+            'ok': True,
+            'file': file_info['name'],
+            'bytes': size,
+            'latency': finished - started,
+            'job_seconds': job_done - started,
+            'fetch_seconds': finished - job_done,
+            'spans': (job or {}).get('spans', []),
+        })
+        return result
+
+    def delete(self, filename):
+        self._json('POST', f"/delete/{urllib.parse.quote(filename)}")
+
+
+def run_scenario(client, origin, fixture, format_type, concurrency, requests, counter, keep_files):
+    path = FIXTURES[fixture][0]
+    base, ext = os.path.splitext(path)
+
+    def one(_):
+        with counter['lock']:
+            counter['n'] += 1
+            n = counter['n']
+        url = f"{origin.base_url}/r{n}/{base}_{n}{ext}"
+        result = client.download(url, format_type)
+        if result['ok'] and not keep_files:
+            client.delete(result['file'])
+        return result
+
+    io_before = read_proc_io()
+    children_before = resource.getrusage(resource.RUSAGE_CHILDREN)
+    self_before = resource.getrusage(resource.RUSAGE_SELF)
+    origin_before = origin.bytes_sent
+    started = time.perf_counter()
+    with RssSampler() as rss, ThreadPoolExecutor(max_workers=concurrency) as pool:
+        results = list(pool.map(one, range(requests)))
+    wall = time.perf_counter() - started
+    io_after = read_proc_io()
+    children_after = resource.getrusage(resource.RUSAGE_CHILDREN)
+    self_after = resource.getrusage(resource.RUSAGE_SELF)
+
+    ok = [r for r in results if r['ok']]
+    phases = {}
+    for r in ok:
+        for s in r['spans']:
+            phases.setdefault(s['name'], []).append(s['seconds'])
+    served = sum(r['bytes'] for r in ok)
+    return {
+        'scenario': f'{fixture}:{format_type}',
+        'fixture': fixture,
+        'format': format_type,
+        'concurrency': concurrency,
+        'requests': requests,
+        'ok': len(ok),
+        'errors': sorted({r.get('error', '') for r in results if not r['ok']}),
+        'wall_seconds': wall,
+        'throughput_rps': len(ok) / wall if wall else 0,
+        'served_mbps': served / wall / 1024 / 1024 if wall else 0,
+        'origin_mbps': (origin.bytes_sent - origin_before) / wall / 1024 / 1024 if wall else 0,
+        'latency': summarize([r['latency'] for r in ok]),
+        'job_seconds': summarize([r['job_seconds'] for r in ok]),
+        'fetch_seconds': summarize([r['fetch_seconds'] for r in ok]),
+        'phases': {name: summarize(values) for name, values in phases.items()},
+        'peak_rss_kb': rss.peak,
+        'children_peak_rss_kb': children_after.ru_maxrss,
+        'cpu_seconds': {
+            'self': (self_after.ru_utime + self_after.ru_stime) - (self_before.ru_utime + self_before.ru_stime),
+            'children': (children_after.ru_utime + children_after.ru_stime)
+            - (children_before.ru_utime + children_before.ru_stime),
+        },
+        'io': {
+            'self_read_bytes': io_after['read_bytes'] - io_before['read_bytes'] if io_before else None,
+            'self_write_bytes': io_after['write_bytes'] - io_before['write_bytes'] if io_before else None,
+            # 子进程（yt-dlp 合并、ffmpeg）的块设备读写，单位 512 字节
+            'children_in_blocks': children_after.ru_inblock - children_before.ru_inblock,
+            'children_out_blocks': children_after.ru_oublock - children_before.ru_oublock,
+        },
+    }
+
+
+def git_commit():
+    try:
+        return subprocess.run(['git', 'rev-parse', 'HEAD'], cwd=REPO_DIR, capture_output=True,
+                              text=True).stdout.strip() or None
+    except OSError:
+        return None
+
+
+def print_table(results, previous=None, out=None):
+    prev = {(r['scenario'], r['concurrency']): r for r in (previous or {}).get('results', [])}
+    print(f"{'scenario':<12}{'conc':>5}{'ok':>6}{'req/s':>9}{'p50 s':>9}{'p99 s':>9}{'MB/s':>9}{'rss MB':>9}", file=out)
+    for r in results:
+        lat = r['latency'] or {}
+        line = (f"{r['scenario']:<12}{r['concurrency']:>5}{r['ok']:>6}{r['throughput_rps']:>9.2f}"
+                f"{lat.get('p50') or 0:>9.3f}{lat.get('p99') or 0:>9.3f}{r['served_mbps']:>9.1f}"
+                f"{r['peak_rss_kb'] / 1024:>9.1f}")
+        old = prev.get((r['scenario'], r['concurrency']))
+        if old and old['throughput_rps'] and (old['latency'] or {}).get('p50'):
+            line += (f"   req/s {(r['throughput_rps'] / old['throughput_rps'] - 1) * 100:+.1f}%"
+                     f"  p50 {((lat.get('p50') or 0) / old['latency']['p50'] - 1) * 100:+.1f}%")
+        print(line, file=out)
+        for error in r['errors']:
+            print(f"    error: {error[:200]}", file=out)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='视频下载流程的离线基准测试')
+    parser.add_argument('--scenario', default='mp4:mp4,m4a:mp3,hls:mp4',
+                        help='逗号分隔的 样本:格式，样本可选 ' + ', '.join(FIXTURES))
+    parser.add_argument('--concurrency', default='1,4', help='逗号分隔的并发客户端数')
+    parser.add_argument('--requests', type=int, default=10, help='每个场景、每档并发的请求数')
+    parser.add_argument('--workers', type=int, default=0, help='DOWNLOAD_WORKERS，默认等于最大并发')
+    parser.add_argument('--duration', type=int, default=30, help='样本时长（秒）')
+    parser.add_argument('--resolution', default='1280x720')
+    parser.add_argument('--video-bitrate', default='2M')
+    parser.add_argument('--rate-limit', type=int, default=0, help='源站每个连接的限速（字节/秒），0 不限')
+    parser.add_argument('--ffmpeg-path', default=os.environ.get('FFMPEG_PATH', '/usr/bin'))
+    parser.add_argument('--fixtures-dir', default=os.path.join(tempfile.gettempdir(), 'vdl-bench-fixtures'))
+    parser.add_argument('--timeout', type=int, default=600, help='单个请求的超时（秒）')
+    parser.add_argument('--keep-files', action='store_true', help='不删除下载完成的文件')
+    parser.add_argument('--output', help='结果 JSON 的保存路径')
+    parser.add_argument('--compare', help='与之前保存的结果 JSON 对比')
+    parser.add_argument('--log', default=os.path.join(tempfile.gettempdir(), 'vdl-bench.log'),
+                        help='被测服务的日志输出位置')
+    args = parser.parse_args()
+
+    scenarios = [s.split(':', 1) for s in args.scenario.split(',') if s]
+    for fixture, _ in scenarios:
+        if fixture not in FIXTURES:
+            parser.error(f'未知样本: {fixture}')
+    levels = [int(c) for c in args.concurrency.split(',') if c]
+
+    print(f"准备样本: {args.fixtures_dir}", flush=True)
+    generate(args.fixtures_dir, args.ffmpeg_path, args.duration, args.resolution, args.video_bitrate)
+    origin = OriginServer(args.fixtures_dir, rate_limit=args.rate_limit).start()
+
+    work_dir = tempfile.mkdtemp(prefix='vdl-bench-')
+    os.environ.update({
+        'DOWNLOAD_FOLDER': os.path.join(work_dir, 'downloads'),
+        'FFMPEG_PATH': args.ffmpeg_path,
+        'DOWNLOAD_WORKERS': str(args.workers or max(levels)),
+        'DOWNLOAD_QUEUE_SIZE': str(max(levels) * 4 + 100),
+        'JOB_SPANS': '1',
+        'STORAGE_MIN_FREE_BYTES': '0',
+        # 所有请求都来自 127.0.0.1，关闭按客户端和预计等待时间的限流，否则高并发档位会收到 429
+        'MAX_JOBS_PER_CLIENT': '0',
+        'MAX_QUEUE_WAIT': '0',
+    })
+    # 服务端日志（包括 yt-dlp 和 ffmpeg 的输出）写入日志文件，终端只显示结果
+    print(f"服务日志: {args.log}", flush=True)
+    console = os.fdopen(os.dup(1), 'w', buffering=1, encoding='utf-8')
+    log_fd = os.open(args.log, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o644)
+    sys.stdout.flush()
+    os.dup2(log_fd, 1)
+    os.dup2(log_fd, 2)
+
+    import app as app_module
+    from werkzeug.serving import make_server
+
+    app_module.start_background_tasks()
+
+    server = make_server('127.0.0.1', 0, app_module.app, threaded=True)
+    threading.Thread(target=server.serve_forever, name='bench-app', daemon=True).start()
+    client = Client(f'http://127.0.0.1:{server.server_port}', args.timeout)
+    if not app_module.health_monitor.ready():
+        print(f"服务未就绪: {app_module.health_monitor.reason()}", file=console)
+        sys.exit(1)
+
+    counter = {'n': 0, 'lock': threading.Lock()}
+    results = []
+    for fixture, format_type in scenarios:
+        for concurrency in levels:
+            print(f"运行 {fixture}:{format_type} 并发 {concurrency} ...", file=console)
+            results.append(run_scenario(client, origin, fixture, format_type, concurrency,
+                                        args.requests, counter, args.keep_files))
+    server.shutdown()
+    origin.shutdown()
+
+    report = {
+        'meta': {
+            'timestamp': time.time(),
+            'git_commit': git_commit(),
+            'python': platform.python_version(),
+            'platform': platform.platform(),
+            'cpu_count': os.cpu_count(),
+            'args': vars(args),
+        },
+        'results': results,
+    }
+    previous = None
+    if args.compare:
+        with open(args.compare, encoding='utf-8') as f:
+            previous = json.load(f)
+    print_table(results, previous, console)
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            json.dump(report, f, indent=2, ensure_ascii=False)
+        print(f"结果已保存: {args.output}", file=console)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,156 @@
+import logging
+import os
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+# 支持的排序字段
+SORT_KEYS = {
+    'name': lambda e: e['name'].lower(),
+    'size': lambda e: e['size'],
+    'date': lambda e: e['mtime'],
+}
+
+
+class FileCatalog:
+    """下载目录的内存索引。
+
+    下载和删除时直接增量更新；目录 mtime 变化（外部改动）时才重新扫描一次，
+    排序结果按需缓存，分页只切片当前页。"""
+
+    def __init__(self, folder, refresh_interval=1.0, full_rescan_interval=300, on_add=None, on_remove=None):
+        self.folder = folder
+        self.refresh_interval = refresh_interval
+        self.full_rescan_interval = full_rescan_interval
+        # 文件出现 / 消失时的回调，用于同步到共享存储；参数分别为条目列表和文件名列表
+        self.on_add = on_add
+        self.on_remove = on_remove
+        self._files = {}
+        self._sorted = {}
+        self._dir_mtime_ns = None
+        self._last_check = 0.0
+        self._last_scan = 0.0
+        self._lock = threading.RLock()
+
+    def _entry(self, name, st):
+        return {'name': name, 'size': st.st_size, 'mtime': st.st_mtime, 'mtime_ns': st.st_mtime_ns}
+
+    def _rescan(self):
+        files = {}
+        try:
+            with os.scandir(self.folder) as it:
+                for de in it:
+                    # 跳过缓存索引、未完成的临时文件等隐藏文件
+                    if de.name.startswith('.'):
+                        continue
+                    try:
+                        if de.is_file():
+                            files[de.name] = self._entry(de.name, de.stat())
+                    except OSError as e:
+                        logger.error(f"读取文件信息失败 {de.name}: {str(e)}")
+        except FileNotFoundError:
+            logger.warning(f"Download folder {self.folder} does not exist")
+        previous = self._files
+        self._files = files
+        self._sorted.clear()
+        self._last_scan = time.monotonic()
+        logger.info(f"已重新扫描下载目录，共 {len(files)} 个文件")
+        # 只收集变化，由调用方释放锁后再通知
+        added = []
+        for name, entry in files.items():
+            old = previous.get(name)
+            if old is None or old['mtime_ns'] != entry['mtime_ns'] or old['size'] != entry['size']:
+                added.append(entry)
+        removed = list(previous.keys() - files.keys())
+        return added, removed
+
+    def _dir_mtime(self):
+        try:
+            return os.stat(self.folder).st_mtime_ns
+        except OSError:
+            return None
+
+    def refresh(self, force=False):
+        """目录 mtime 变化时重新扫描；两次检查之间至少间隔 refresh_interval 秒"""
+        now = time.monotonic()
+        with self._lock:
+            if not force and self._dir_mtime_ns is not None and now - self._last_check < self.refresh_interval:
+                return
+            self._last_check = now
+            mtime = self._dir_mtime()
+            # 自身的增量更新会同步 mtime，定期全量扫描兜底可能漏掉的外部改动
+            if now - self._last_scan > self.full_rescan_interval:
+                force = True
+            if not force and mtime == self._dir_mtime_ns:
+                return
+            self._dir_mtime_ns = mtime
+            added, removed = self._rescan()
+        # 回调可能访问共享存储，不在锁内调用，且整批只通知一次
+        if added:
+            self._notify(self.on_add, added)
+        if removed:
+            self._notify(self.on_remove, removed)
+
+    def _notify(self, callback, arg):
+        if callback is None:
+            return
+        try:
+            callback(arg)
+        except Exception as e:
+            logger.warning(f"目录索引回调失败: {str(e)}")
+
+    def _after_change(self):
+        # 调用方已持有锁。记下自身修改后的目录 mtime，避免下次请求无谓地重扫
+        self._sorted.clear()
+        if self._dir_mtime_ns is not None:
+            self._dir_mtime_ns = self._dir_mtime()
+
+    def add(self, name):
+        path = os.path.join(self.folder, name)
+        with self._lock:
+            try:
+                st = os.stat(path)
+            except OSError:
+                removed = self._files.pop(name, None) is not None
+                entry = None
+            else:
+                entry = self._files[name] = self._entry(name, st)
+            self._after_change()
+        if entry is not None:
+            self._notify(self.on_add, [entry])
+        elif removed:
+            self._notify(self.on_remove, [name])
+
+    def remove(self, name):
+        with self._lock:
+            removed = self._files.pop(name, None) is not None
+            self._after_change()
+        if removed:
+            self._notify(self.on_remove, [name])
+
+    def get(self, name):
+        self.refresh()
+        with self._lock:
+            return self._files.get(name)
+
+    def total_bytes(self):
+        self.refresh()
+        with self._lock:
+            return sum(e['size'] for e in self._files.values())
+
+    def list(self, page=1, per_page=50, sort='date', order='desc'):
+        """返回 (当前页文件列表, 文件总数)"""
+        if sort not in SORT_KEYS:
+            sort = 'date'
+        reverse = order != 'asc'
+        self.refresh()
+        with self._lock:
+            cache_key = (sort, reverse)
+            ordered = self._sorted.get(cache_key)
+            if ordered is None:
+                ordered = sorted(self._files.values(), key=SORT_KEYS[sort], reverse=reverse)
+                self._sorted[cache_key] = ordered
+            total = len(ordered)
+        start = (max(page, 1) - 1) * per_page
+        return ordered[start:start + per_page], total
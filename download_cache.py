@@ -0,0 +1,115 @@
+import json
+import logging
+import os
+import sqlite3
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+
+class DownloadCache:
+    """视频缓存索引：缓存键 -> 下载目录中的文件，索引存放在 SQLite 中，多个 worker 进程共用。
+
+    只负责索引，不删除文件：下载目录的容量和淘汰统一由 StorageManager 处理，淘汰时通过 discard_file 通知这里"""
+
+    def __init__(self, folder, index_path, save_interval=30, legacy_path=None):
+        self.folder = folder
+        self.index_path = index_path
+        # 命中时最近使用时间的更新间隔，避免每次命中都写库
+        self.save_interval = save_interval
+        self._local = threading.local()
+        # 命中统计（按进程）
+        self.hits = 0
+        self.misses = 0
+        with self._conn() as conn:
+            conn.execute('CREATE TABLE IF NOT EXISTS entries ('
+                         'key TEXT PRIMARY KEY, filename TEXT NOT NULL, size INTEGER NOT NULL, '
+                         'mtime_ns INTEGER NOT NULL, last_used REAL NOT NULL)')
+            conn.execute('CREATE INDEX IF NOT EXISTS entries_filename ON entries (filename)')
+        if legacy_path:
+            self._import_legacy(legacy_path)
+
+    def _conn(self):
+        # 每个线程一个连接
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = sqlite3.connect(self.index_path, timeout=10, isolation_level=None)
+            conn.execute('PRAGMA journal_mode=WAL')
+            conn.execute('PRAGMA synchronous=NORMAL')
+            conn.row_factory = sqlite3.Row
+            self._local.conn = conn
+        return conn
+
+    def _import_legacy(self, path):
+        """导入旧版的 JSON 索引，导入后删除该文件"""
+        if not os.path.exists(path):
+            return
+        try:
+            with open(path, 'r', encoding='utf-8') as f:
+                entries = json.load(f)
+            rows = [(key, e['filename'], e['size'], e['mtime_ns'], e.get('last_used', time.time()))
+                    for key, e in entries if self._is_valid(e)]
+            self._conn().executemany('INSERT OR IGNORE INTO entries VALUES (?, ?, ?, ?, ?)', rows)
+            os.remove(path)
+            logger.info(f"已导入旧缓存索引，共 {len(rows)} 条")
+        except Exception as e:
+            logger.error(f"导入旧缓存索引失败: {str(e)}")
+
+    def _is_valid(self, entry):
+        try:
+            st = os.stat(os.path.join(self.folder, entry['filename']))
+        except OSError:
+            return False
+        return st.st_size == entry['size'] and st.st_mtime_ns == entry['mtime_ns']
+
+    def total_bytes(self):
+        row = self._conn().execute('SELECT COALESCE(SUM(size), 0) FROM entries').fetchone()
+        return row[0]
+
+    def lookup(self, key):
+        if not key:
+            return None
+        try:
+            conn = self._conn()
+            row = conn.execute('SELECT * FROM entries WHERE key = ?', (key,)).fetchone()
+            if row is None:
+                self.misses += 1
+                return None
+            entry = dict(row)
+            if not self._is_valid(entry):
+                # 文件被删除或被同名文件覆盖；只删除仍是这条记录的行，避免误删其他进程刚写入的新记录
+                conn.execute('DELETE FROM entries WHERE key = ? AND mtime_ns = ?', (key, entry['mtime_ns']))
+                self.misses += 1
+                return None
+            self.hits += 1
+            now = time.time()
+            if now - entry['last_used'] > self.save_interval:
+                conn.execute('UPDATE entries SET last_used = ? WHERE key = ?', (now, key))
+                entry['last_used'] = now
+            del entry['key']
+            return entry
+        except sqlite3.Error as e:
+            logger.warning(f"读取缓存索引失败 {key}: {str(e)}")
+            self.misses += 1
+            return None
+
+    def put(self, key, filename):
+        if not key:
+            return
+        st = os.stat(os.path.join(self.folder, filename))
+        try:
+            with self._conn() as conn:
+                conn.execute('BEGIN IMMEDIATE')
+                # 同一个文件只对应一个缓存键
+                conn.execute('DELETE FROM entries WHERE filename = ?', (filename,))
+                conn.execute('INSERT OR REPLACE INTO entries VALUES (?, ?, ?, ?, ?)',
+                             (key, filename, st.st_size, st.st_mtime_ns, time.time()))
+        except sqlite3.Error as e:
+            logger.warning(f"写入缓存索引失败 {key}: {str(e)}")
+
+    def discard_file(self, filename):
+        try:
+            self._conn().execute('DELETE FROM entries WHERE filename = ?', (filename,))
+        except sqlite3.Error as e:
+            logger.warning(f"删除缓存索引失败 {filename}: {str(e)}")
@@ -0,0 +1,160 @@
+import logging
+import os
+import sqlite3
+import threading
+import time
+from datetime import datetime
+
+logger = logging.getLogger(__name__)
+
+# 旧版每条反馈一个文本文件：feedback_<时间>_<邮箱>.txt
+LEGACY_PREFIX = 'feedback_'
+LEGACY_SUFFIX = '.txt'
+IMPORT_BATCH = 1000
+
+
+def parse_legacy_file(content):
+    """解析旧版反馈文件，返回 (时间戳, 邮箱, IP, 用户代理, 消息)；时间无法解析时为 None"""
+    fields = {}
+    lines = content.split('\n')
+    for line in lines:
+        for label in ('时间', '发件人', 'IP地址', '用户代理'):
+            if line.startswith(f"{label}:") and label not in fields:
+                fields[label] = line[len(label) + 1:].strip()
+    # 消息位于两行 ===== 之间
+    separators = [i for i, line in enumerate(lines) if line and set(line) == {'='}]
+    if len(separators) >= 2:
+        message = '\n'.join(lines[separators[0] + 1:separators[-1]])
+    else:
+        message = content
+    try:
+        created_at = datetime.strptime(fields.get('时间', ''), '%Y-%m-%d %H:%M:%S').timestamp()
+    except ValueError:
+        created_at = None
+    return created_at, fields.get('发件人', 'Unknown'), fields.get('IP地址'), fields.get('用户代理'), message
+
+
+class FeedbackStore:
+    """反馈保存在单个 SQLite 文件中：写入是一次 INSERT，管理页按索引分页读取"""
+
+    def __init__(self, path):
+        self.path = path
+        self._local = threading.local()
+        with self._conn() as conn:
+            conn.execute('CREATE TABLE IF NOT EXISTS feedback ('
+                         'id INTEGER PRIMARY KEY AUTOINCREMENT, created_at REAL NOT NULL, '
+                         'email TEXT NOT NULL COLLATE NOCASE, ip TEXT, user_agent TEXT, message TEXT NOT NULL, '
+                         'source TEXT UNIQUE)')
+            conn.execute('CREATE INDEX IF NOT EXISTS feedback_created ON feedback (created_at)')
+            conn.execute('CREATE INDEX IF NOT EXISTS feedback_email ON feedback (email, created_at)')
+            conn.execute('CREATE TABLE IF NOT EXISTS imports (directory TEXT PRIMARY KEY, imported_at REAL, count INTEGER)')
+
+    def _conn(self):
+        # 每个线程一个连接
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=10, isolation_level=None)
+            conn.execute('PRAGMA journal_mode=WAL')
+            conn.execute('PRAGMA synchronous=NORMAL')
+            conn.row_factory = sqlite3.Row
+            self._local.conn = conn
+        return conn
+
+    def add(self, email, message, ip=None, user_agent=None, created_at=None):
+        cur = self._conn().execute(
+            'INSERT INTO feedback (created_at, email, ip, user_agent, message) VALUES (?, ?, ?, ?, ?)',
+            (created_at or time.time(), email, ip, user_agent, message),
+        )
+        return cur.lastrowid
+
+    def list(self, limit=50, before=None, email=None, since=None, until=None):
+        """按时间倒序返回 (条目列表, 是否还有更早的条目)。
+
+        before 是上一页最后一条的 id（游标分页，不用 OFFSET），since / until 为时间戳，email 不区分大小写"""
+        where = []
+        params = []
+        if email:
+            where.append('email = ?')
+            params.append(email)
+        if since is not None:
+            where.append('created_at >= ?')
+            params.append(since)
+        if until is not None:
+            where.append('created_at < ?')
+            params.append(until)
+        if before is not None:
+            where.append('(created_at, id) < (SELECT created_at, id FROM feedback WHERE id = ?)')
+            params.append(before)
+        sql = 'SELECT id, created_at, email, ip, user_agent, message FROM feedback'
+        if where:
+            sql += ' WHERE ' + ' AND '.join(where)
+        sql += ' ORDER BY created_at DESC, id DESC LIMIT ?'
+        rows = self._conn().execute(sql, params + [limit + 1]).fetchall()
+        return [dict(row) for row in rows[:limit]], len(rows) > limit
+
+    def imported(self, directory):
+        row = self._conn().execute('SELECT 1 FROM imports WHERE directory = ?', (os.path.abspath(directory),)).fetchone()
+        return row is not None
+
+    def import_directory(self, directory):
+        """一次性导入旧版文本文件，按文件名去重，可重复执行；返回新导入的条数"""
+        directory = os.path.abspath(directory)
+        conn = self._conn()
+        count = 0
+        batch = []
+
+        def flush():
+            nonlocal count
+            conn.execute('BEGIN')
+            try:
+                for row in batch:
+                    count += conn.execute(
+                        'INSERT OR IGNORE INTO feedback (created_at, email, ip, user_agent, message, source) '
+                        'VALUES (?, ?, ?, ?, ?, ?)', row).rowcount
+                conn.execute('COMMIT')
+            except Exception:
+                conn.execute('ROLLBACK')
+                raise
+            batch.clear()
+
+        with os.scandir(directory) as it:
+            for item in it:
+                if not (item.name.startswith(LEGACY_PREFIX) and item.name.endswith(LEGACY_SUFFIX)):
+                    continue
+                try:
+                    with open(item.path, 'r', encoding='utf-8', errors='replace') as f:
+                        created_at, email, ip, user_agent, message = parse_legacy_file(f.read())
+                    batch.append((created_at or item.stat().st_mtime, email, ip, user_agent, message, item.name))
+                except OSError as e:
+                    logger.warning(f"读取反馈文件失败 {item.name}: {str(e)}")
+                if len(batch) >= IMPORT_BATCH:
+                    flush()
+        if batch:
+            flush()
+        conn.execute('INSERT OR REPLACE INTO imports VALUES (?, ?, ?)', (directory, time.time(), count))
+        logger.info(f"已从 {directory} 导入 {count} 条反馈")
+        return count
+
+    def import_in_background(self, directory):
+        """目录还没导入过时在后台线程中导入，不阻塞启动"""
+        if not os.path.isdir(directory) or self.imported(directory):
+            return
+
+        def run():
+            try:
+                self.import_directory(directory)
+            except Exception as e:
+                logger.error(f"导入旧版反馈失败: {str(e)}")
+
+        threading.Thread(target=run, name='feedback-import', daemon=True).start()
+
+
+if __name__ == '__main__':
+    import argparse
+
+    parser = argparse.ArgumentParser(description='把旧版反馈文本文件导入 SQLite')
+    parser.add_argument('directory', help='旧版反馈文件所在目录')
+    parser.add_argument('--db', required=True, help='SQLite 数据库路径')
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO)
+    FeedbackStore(args.db).import_directory(args.directory)
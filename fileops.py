@@ -0,0 +1,91 @@
+import errno
+import logging
+import os
+import shutil
+import uuid
+
+logger = logging.getLogger(__name__)
+
+# 回退到普通复制时使用的缓冲区大小
+COPY_BUFFER_SIZE = 1024 * 1024
+# 单次 copy_file_range / sendfile 的最大字节数
+CHUNK_SIZE = 64 * 1024 * 1024
+
+
+def _copy_with_copy_file_range(fsrc, fdst, size):
+    offset = 0
+    while offset < size:
+        n = os.copy_file_range(fsrc, fdst, min(CHUNK_SIZE, size - offset))
+        if n == 0:
+            break
+        offset += n
+    return offset
+
+
+def _copy_with_sendfile(fsrc, fdst, size):
+    offset = 0
+    while offset < size:
+        n = os.sendfile(fdst, fsrc, offset, min(CHUNK_SIZE, size - offset))
+        if n == 0:
+            break
+        offset += n
+    return offset
+
+
+def copy_file(src, dst):
+    """在内核中复制文件（copy_file_range / sendfile），都不可用时用固定大小缓冲区流式复制"""
+    with open(src, 'rb') as fsrc, open(dst, 'wb') as fdst:
+        size = os.fstat(fsrc.fileno()).st_size
+        copied = None
+        for method in (getattr(os, 'copy_file_range', None), getattr(os, 'sendfile', None)):
+            if method is None:
+                continue
+            try:
+                if method is os.sendfile:
+                    copied = _copy_with_sendfile(fsrc.fileno(), fdst.fileno(), size)
+                else:
+                    copied = _copy_with_copy_file_range(fsrc.fileno(), fdst.fileno(), size)
+                break
+            except OSError as e:
+                if e.errno not in (errno.EXDEV, errno.ENOSYS, errno.EINVAL, errno.EOPNOTSUPP, errno.EBADF):
+                    raise
+                # 当前文件系统不支持，从头换下一种方式
+                fsrc.seek(0)
+                fdst.seek(0)
+                fdst.truncate()
+                copied = None
+        if copied is None:
+            shutil.copyfileobj(fsrc, fdst, COPY_BUFFER_SIZE)
+        elif copied != size:
+            raise IOError(f"复制不完整: {copied}/{size} 字节")
+        fdst.flush()
+        os.fsync(fdst.fileno())
+
+
+def move_into_place(src, dest):
+    """把文件放到最终位置：同一文件系统直接 rename，否则先复制到同目录的隐藏临时文件再 rename。
+    任何时候目标目录里都不会出现只写了一半的文件。"""
+    try:
+        os.replace(src, dest)
+        logger.info(f"已移动文件: {src} -> {dest}")
+        return
+    except OSError as e:
+        if e.errno != errno.EXDEV:
+            raise
+
+    tmp_path = os.path.join(os.path.dirname(dest), f".{os.path.basename(dest)}.{uuid.uuid4().hex[:8]}.part")
+    try:
+        copy_file(src, tmp_path)
+        os.replace(tmp_path, dest)
+    except BaseException:
+        try:
+            os.remove(tmp_path)
+        except OSError:
+            pass
+        raise
+    logger.info(f"已跨文件系统复制文件: {src} -> {dest}")
+    # 尽早释放临时目录所在磁盘的空间
+    try:
+        os.remove(src)
+    except OSError:
+        pass
@@ -0,0 +1,229 @@
+import logging
+import mimetypes
+import os
+import uuid
+from urllib.parse import quote
+
+from flask import Response, request, send_file
+from werkzeug.exceptions import RequestedRangeNotSatisfiable
+from werkzeug.http import http_date, is_byte_range_valid
+
+logger = logging.getLogger(__name__)
+
+# 多段 Range 请求最多处理的区间数，超过则返回完整文件，防止被切成大量小块
+MAX_RANGES = 16
+READ_CHUNK_SIZE = 256 * 1024
+
+
+def file_etag(entry):
+    """由目录索引中的大小和修改时间生成强 ETag（不带引号）"""
+    return f"{entry['size']:x}-{entry['mtime_ns']:x}"
+
+
+def content_disposition(filename):
+    try:
+        filename.encode('ascii')
+        return f'attachment; filename="{filename}"'
+    except UnicodeEncodeError:
+        return f"attachment; filename*=UTF-8''{quote(filename)}"
+
+
+def parse_byte_ranges(value):
+    """解析 bytes=... 形式的 Range 头，返回 werkzeug 格式的 (start, stop) 列表；格式不对时返回 None。
+
+    werkzeug 的 parse_range_header 遇到重叠或乱序的区间直接返回 None，这里保留原样交给 normalize_ranges 合并"""
+    if not value:
+        return None
+    units, _, specs = value.partition('=')
+    if units.strip().lower() != 'bytes':
+        return None
+    ranges = []
+    for spec in specs.split(','):
+        first, sep, last = spec.strip().partition('-')
+        if not sep:
+            return None
+        if not first:
+            # 后缀区间：最后 N 个字节
+            if not last.isdigit():
+                return None
+            ranges.append((-int(last), None))
+        elif not first.isdigit() or (last and not last.isdigit()):
+            return None
+        elif not last:
+            ranges.append((int(first), None))
+        elif int(last) < int(first):
+            return None
+        else:
+            ranges.append((int(first), int(last) + 1))
+    return ranges or None
+
+
+def normalize_ranges(ranges, size):
+    """把 Range 头中的区间换算成 [start, stop) 并合并重叠部分，无可满足区间时返回空列表"""
+    result = []
+    for start, stop in ranges:
+        if stop is None:
+            stop = size
+            if start < 0:
+                start = max(size + start, 0)
+        stop = min(stop, size)
+        if is_byte_range_valid(start, stop, size):
+            result.append([start, stop])
+    result.sort()
+    merged = []
+    for start, stop in result:
+        if merged and start <= merged[-1][1]:
+            merged[-1][1] = max(merged[-1][1], stop)
+        else:
+            merged.append([start, stop])
+    return merged
+
+
+def _if_range_matches(etag, mtime):
+    if_range = request.if_range
+    if not if_range or (not if_range.etag and not if_range.date):
+        return True
+    if if_range.etag:
+        return if_range.etag == etag
+    return int(mtime) <= if_range.date.timestamp()
+
+
+def _read_range(f, start, stop):
+    f.seek(start)
+    remaining = stop - start
+    while remaining > 0:
+        chunk = f.read(min(READ_CHUNK_SIZE, remaining))
+        if not chunk:
+            return
+        remaining -= len(chunk)
+        yield chunk
+
+
+def _read_single_range(path, start, stop):
+    with open(path, 'rb') as f:
+        yield from _read_range(f, start, stop)
+
+
+def _read_ranges(path, ranges, boundary, mimetype, size):
+    with open(path, 'rb') as f:
+        for start, stop in ranges:
+            yield (
+                f"\r\n--{boundary}\r\n"
+                f"Content-Type: {mimetype}\r\n"
+                f"Content-Range: bytes {start}-{stop - 1}/{size}\r\n\r\n"
+            ).encode('ascii')
+            yield from _read_range(f, start, stop)
+        yield f"\r\n--{boundary}--\r\n".encode('ascii')
+
+
+def _multipart_length(ranges, boundary, mimetype, size):
+    length = 0
+    for start, stop in ranges:
+        length += len(
+            f"\r\n--{boundary}\r\n"
+            f"Content-Type: {mimetype}\r\n"
+            f"Content-Range: bytes {start}-{stop - 1}/{size}\r\n\r\n"
+        )
+        length += stop - start
+    return length + len(f"\r\n--{boundary}--\r\n")
+
+
+def serve_file(path, entry, offload=None, accel_prefix='/protected-downloads/'):
+    """发送下载目录中的文件，支持 ETag / 条件请求 / 单段和多段 Range，以及交给前端服务器发送。
+
+    offload: None 由 Python 发送；'nginx' 返回 X-Accel-Redirect；'sendfile' 返回 X-Sendfile。"""
+    name = entry['name']
+    size = entry['size']
+    etag = file_etag(entry)
+    mimetype = mimetypes.guess_type(name)[0] or 'application/octet-stream'
+
+    if offload == 'nginx':
+        # 由 nginx 负责 Range 和条件请求，Python 只返回响应头
+        rv = Response(status=200, mimetype=mimetype)
+        rv.headers['X-Accel-Redirect'] = accel_prefix + quote(name)
+        rv.headers['Content-Disposition'] = content_disposition(name)
+        rv.set_etag(etag)
+        rv.headers['Last-Modified'] = http_date(entry['mtime'])
+        return rv
+    if offload == 'sendfile':
+        rv = Response(status=200, mimetype=mimetype)
+        rv.headers['X-Sendfile'] = os.path.abspath(path)
+        rv.headers['Content-Disposition'] = content_disposition(name)
+        rv.set_etag(etag)
+        rv.headers['Last-Modified'] = http_date(entry['mtime'])
+        return rv
+
+    # 多段 Range 自己解析；单段仍交给 send_file
+    range_header = request.headers.get('Range', '')
+    multi_range = ',' in range_header
+    byte_ranges = parse_byte_ranges(range_header) if multi_range else None
+    if (byte_ranges is not None
+            and not request.if_none_match.contains(etag)
+            and _if_range_matches(etag, entry['mtime'])):
+        ranges = normalize_ranges(byte_ranges, size)
+        if not ranges:
+            rv = Response(status=416)
+            rv.headers['Content-Range'] = f"bytes */{size}"
+            return rv
+        if len(ranges) == 1:
+            # 多个区间合并后只剩一段
+            start, stop = ranges[0]
+            rv = Response(
+                _read_single_range(path, start, stop),
+                status=206,
+                mimetype=mimetype,
+                direct_passthrough=True,
+            )
+            rv.content_length = stop - start
+            rv.headers['Content-Range'] = f"bytes {start}-{stop - 1}/{size}"
+            rv.headers['Content-Disposition'] = content_disposition(name)
+            rv.headers['Accept-Ranges'] = 'bytes'
+            rv.set_etag(etag)
+            rv.headers['Last-Modified'] = http_date(entry['mtime'])
+            return rv
+        if len(ranges) <= MAX_RANGES:
+            boundary = uuid.uuid4().hex
+            rv = Response(
+                _read_ranges(path, ranges, boundary, mimetype, size),
+                status=206,
+                mimetype=f'multipart/byteranges; boundary={boundary}',
+                direct_passthrough=True,
+            )
+            rv.content_length = _multipart_length(ranges, boundary, mimetype, size)
+            rv.headers['Content-Disposition'] = content_disposition(name)
+            rv.headers['Accept-Ranges'] = 'bytes'
+            rv.set_etag(etag)
+            rv.headers['Last-Modified'] = http_date(entry['mtime'])
+            return rv
+
+    if multi_range:
+        # 区间过多、格式不对或条件不满足的多段请求：忽略 Range，只处理条件请求，返回完整文件或 304
+        rv = send_file(
+            path,
+            mimetype=mimetype,
+            as_attachment=True,
+            download_name=name,
+            conditional=False,
+            etag=etag,
+            last_modified=entry['mtime'],
+        )
+        rv.make_conditional(request.environ)
+        rv.headers['Accept-Ranges'] = 'bytes'
+        return rv
+
+    # 完整文件、单段 Range、If-None-Match / If-Modified-Since 都由 send_file 处理，
+    # 在 gunicorn 下会通过 wsgi.file_wrapper 使用 sendfile
+    try:
+        return send_file(
+            path,
+            mimetype=mimetype,
+            as_attachment=True,
+            download_name=name,
+            conditional=True,
+            etag=etag,
+            last_modified=entry['mtime'],
+        )
+    except RequestedRangeNotSatisfiable:
+        rv = Response(status=416)
+        rv.headers['Content-Range'] = f"bytes */{size}"
+        return rv
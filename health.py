@@ -0,0 +1,120 @@
+import logging
+import os
+import shutil
+import subprocess
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+
+class HealthMonitor:
+    """启动时和后台定期检查运行环境（ffmpeg、下载目录读写、剩余空间），请求只读取缓存的结果"""
+
+    def __init__(self, folder, ffmpeg_path, min_free_bytes=0, interval=60):
+        self.folder = folder
+        self.ffmpeg_path = ffmpeg_path
+        self.min_free_bytes = min_free_bytes
+        self.interval = interval
+        self._report = None
+        self._lock = threading.Lock()
+        self._thread = None
+
+    def _check_ffmpeg(self):
+        ffmpeg_exec = os.path.join(self.ffmpeg_path, 'ffmpeg')
+        try:
+            out = subprocess.run(
+                [ffmpeg_exec, '-version'],
+                capture_output=True, timeout=10, stdin=subprocess.DEVNULL,
+            )
+        except (OSError, subprocess.TimeoutExpired) as e:
+            return {'ok': False, 'path': ffmpeg_exec, 'error': str(e)}
+        if out.returncode != 0:
+            return {'ok': False, 'path': ffmpeg_exec, 'error': f'ffmpeg -version 返回 {out.returncode}'}
+        first_line = out.stdout.decode('utf-8', 'replace').splitlines()[:1]
+        return {'ok': True, 'path': ffmpeg_exec, 'version': first_line[0] if first_line else ''}
+
+    def _check_writable(self):
+        # 隐藏文件不会出现在文件列表中
+        test_path = os.path.join(self.folder, f'.healthcheck_{os.getpid()}')
+        try:
+            os.makedirs(self.folder, exist_ok=True)
+            with open(test_path, 'w') as f:
+                f.write('ok')
+            with open(test_path, 'r') as f:
+                if f.read() != 'ok':
+                    raise OSError('读回的内容不一致')
+            os.remove(test_path)
+        except OSError as e:
+            return {'ok': False, 'path': self.folder, 'error': str(e)}
+        return {'ok': True, 'path': self.folder}
+
+    def _check_disk(self):
+        try:
+            usage = shutil.disk_usage(self.folder)
+        except OSError as e:
+            return {'ok': False, 'error': str(e)}
+        return {
+            'ok': usage.free >= self.min_free_bytes,
+            'free_bytes': usage.free,
+            'total_bytes': usage.total,
+            'min_free_bytes': self.min_free_bytes,
+        }
+
+    def check(self):
+        """执行一次全部检查并缓存结果"""
+        checks = {
+            'ffmpeg': self._check_ffmpeg(),
+            'storage': self._check_writable(),
+            'disk': self._check_disk(),
+        }
+        report = {
+            'ready': all(c['ok'] for c in checks.values()),
+            'checked_at': time.time(),
+            'checks': checks,
+        }
+        with self._lock:
+            previous = self._report
+            self._report = report
+        if previous is None or previous['ready'] != report['ready']:
+            failed = [name for name, c in checks.items() if not c['ok']]
+            if report['ready']:
+                logger.info(f"环境检查通过，ffmpeg: {checks['ffmpeg'].get('version', '')}")
+            else:
+                logger.error(f"环境检查未通过: {', '.join(failed)} {checks}")
+        return report
+
+    def report(self):
+        with self._lock:
+            report = self._report
+        return report if report is not None else self.check()
+
+    def ready(self):
+        return self.report()['ready']
+
+    def reason(self):
+        """未就绪时给用户看的原因"""
+        checks = self.report()['checks']
+        if not checks['ffmpeg']['ok']:
+            return '未找到FFmpeg。请检查安装。'
+        if not checks['storage']['ok']:
+            return f"无法写入下载目录: {checks['storage'].get('error', '')}"
+        if not checks['disk']['ok']:
+            return '下载目录剩余空间不足'
+        return ''
+
+    def start(self):
+        """立即检查一次，之后在后台线程中定期检查"""
+        if self._thread is not None:
+            return
+        self.check()
+        self._thread = threading.Thread(target=self._loop, name='health-monitor', daemon=True)
+        self._thread.start()
+
+    def _loop(self):
+        while True:
+            time.sleep(self.interval)
+            try:
+                self.check()
+            except Exception as e:
+                logger.error(f"环境检查失败: {str(e)}")
@@ -0,0 +1,283 @@
+import logging
+import threading
+import time
+import uuid
+from collections import OrderedDict
+
+from logconfig import job_context
+from scheduler import LaneScheduler, QueueFullError
+
+logger = logging.getLogger(__name__)
+
+# 任务状态
+QUEUED = 'queued'
+RUNNING = 'running'
+FINISHED = 'finished'
+ERROR = 'error'
+CANCELLED = 'cancelled'
+
+TERMINAL_STATES = (FINISHED, ERROR, CANCELLED)
+
+
+class JobCancelled(Exception):
+    """任务在执行过程中被取消"""
+
+
+class Job:
+    """单个下载任务的状态"""
+
+    def __init__(self, url, format_type, key=None, options=None, job_id=None):
+        # 恢复中断的任务时沿用原来的 ID
+        self.id = job_id or uuid.uuid4().hex
+        self.url = url
+        self.format_type = format_type
+        # 去重键：相同键的进行中任务会被合并
+        self.key = key
+        self.options = options or {}
+        # 关联到该任务的请求数，全部取消后才真正取消
+        self.subscribers = 1
+        self.status = QUEUED
+        self.result = None
+        self.error = None
+        self.created_at = time.time()
+        self.started_at = None
+        self.finished_at = None
+        self.cancel_event = threading.Event()
+        # 各阶段耗时，开启任务计时时才会记录
+        self.spans = []
+        # 加入队列时调度器估计的等待秒数
+        self.estimated_wait = None
+        self._created_monotonic = time.monotonic()
+
+    @property
+    def done(self):
+        return self.status in TERMINAL_STATES
+
+    def check_cancelled(self):
+        if self.cancel_event.is_set():
+            raise JobCancelled('任务已取消')
+
+    def add_span(self, name, start, seconds):
+        """记录一个阶段，start 为 time.monotonic() 的值"""
+        self.spans.append({
+            'name': name,
+            'offset': round(start - self._created_monotonic, 3),
+            'seconds': round(seconds, 3),
+        })
+
+    def to_dict(self):
+        return {
+            'id': self.id,
+            'url': self.url,
+            'format': self.format_type,
+            'lane': self.options.get('lane'),
+            'status': self.status,
+            'subscribers': self.subscribers,
+            'result': self.result,
+            'error': self.error,
+            'created_at': self.created_at,
+            'started_at': self.started_at,
+            'finished_at': self.finished_at,
+            'estimated_wait': self.estimated_wait,
+            'spans': list(self.spans),
+        }
+
+
+class JobManager:
+    """调度队列 + 固定数量的后台下载线程"""
+
+    def __init__(self, handler, workers=2, max_queued=100, max_history=500, on_done=None, journal=None,
+                 scheduler=None, classify=None):
+        self._handler = handler
+        self._on_done = on_done
+        # classify(job) 返回车道；options 中带 lane_pending 的任务取出后先调用它，车道不同时重新排队
+        self._classify = classify
+        # 持久化的任务记录（JobJournal），进程退出后由其他进程接手未完成的任务
+        self._journal = journal
+        self._workers = max(1, workers)
+        # 按车道排队、限制并发的调度器（LaneScheduler），默认所有任务同一车道、先进先出
+        self._queue = scheduler or LaneScheduler(self._workers, max_queued=max_queued)
+        self._jobs = OrderedDict()
+        self._inflight = {}
+        self._lock = threading.Lock()
+        self._threads = []
+        self._max_history = max_history
+
+    def _ensure_started(self):
+        # 线程在第一次提交时才启动，避免 gunicorn fork 之前就创建线程
+        with self._lock:
+            if self._threads:
+                return
+            for i in range(self._workers):
+                t = threading.Thread(target=self._worker_loop, name=f'download-worker-{i}', daemon=True)
+                t.start()
+                self._threads.append(t)
+            logger.info(f"已启动 {self._workers} 个下载线程")
+
+    def _trim_history(self):
+        # 只淘汰已结束的任务，正在排队或运行的任务始终保留
+        if len(self._jobs) <= self._max_history:
+            return
+        for job_id in list(self._jobs):
+            if len(self._jobs) <= self._max_history:
+                break
+            if self._jobs[job_id].done:
+                del self._jobs[job_id]
+
+    def submit(self, url, format_type, key=None, job_id=None, **options):
+        """提交任务；key 相同的任务仍在进行时直接返回该任务（single-flight）。job_id 用于恢复中断的任务"""
+        self._ensure_started()
+        with self._lock:
+            existing = self._inflight.get(key) if key else None
+            if existing is not None and not existing.done:
+                existing.subscribers += 1
+                logger.info(f"合并到进行中的任务 {existing.id}: {url}")
+                return existing
+            job = Job(url, format_type, key, options, job_id)
+            self._jobs[job.id] = job
+            if key:
+                self._inflight[key] = job
+            self._trim_history()
+        # 先写任务记录再入队：工作线程可能立即执行完并删除记录，晚写会留下已结束任务的记录
+        if self._journal is not None:
+            self._journal.add(job)
+        try:
+            self._queue.put(job)
+        except QueueFullError:
+            with self._lock:
+                self._jobs.pop(job.id, None)
+                self._release(job)
+            # 恢复的任务保留原有记录，由任务记录稍后重新认领
+            if self._journal is not None and job_id is None:
+                self._journal.remove(job.id)
+            raise
+        logger.info(f"任务 {job.id} 已加入队列: {url}")
+        return job
+
+    def _release(self, job):
+        # 调用方已持有锁；任务结束后不再接受合并
+        if job.key and self._inflight.get(job.key) is job:
+            del self._inflight[job.key]
+
+    def inflight(self, key):
+        """key 对应的进行中任务，没有时返回 None"""
+        with self._lock:
+            job = self._inflight.get(key) if key else None
+            return job if job is not None and not job.done else None
+
+    def get(self, job_id):
+        with self._lock:
+            return self._jobs.get(job_id)
+
+    def cancel(self, job_id):
+        with self._lock:
+            job = self._jobs.get(job_id)
+            if job is None:
+                return None
+            if job.done:
+                return job
+            job.subscribers -= 1
+            if job.subscribers > 0:
+                # 还有其他请求在等待这个任务，只减少引用计数
+                return job
+            job.cancel_event.set()
+            cancelled_in_queue = job.status == QUEUED
+            if cancelled_in_queue:
+                # 还没开始的任务直接标记为取消，工作线程取到后会跳过
+                job.status = CANCELLED
+                job.error = '任务已取消'
+                job.finished_at = time.time()
+                self._release(job)
+        if cancelled_in_queue:
+            self._queue.discard(job)
+            self._notify_done(job)
+        return job
+
+    def _notify_done(self, job):
+        if self._journal is not None:
+            self._journal.remove(job.id)
+        if self._on_done is None:
+            return
+        try:
+            self._on_done(job)
+        except Exception as e:
+            logger.error(f"任务 {job.id} 结束回调失败: {str(e)}")
+
+    def queue_depth(self):
+        return self._queue.qsize()
+
+    def check_admission(self, client=None, lane=None):
+        """不提交任务，只检查调度器是否还能接收（用于在探测元数据之前快速拒绝）"""
+        self._queue.check(client, lane)
+
+    def scheduler_stats(self):
+        return self._queue.stats()
+
+    def active_count(self):
+        with self._lock:
+            return sum(1 for job in self._jobs.values() if job.status == RUNNING)
+
+    def _worker_loop(self):
+        while True:
+            job = self._queue.get()
+            started = time.monotonic()
+            ran = False
+            requeued = False
+            try:
+                # 执行期间的日志都带上任务 ID 和平台，便于过滤和按任务收集
+                with job_context(job.id, job.options.get('platform')):
+                    lane = self._pending_lane(job)
+                    if lane is not None:
+                        self._queue.requeue(job, lane)
+                        requeued = True
+                        logger.info(f"任务 {job.id} 探测后改为 {lane} 车道重新排队")
+                    else:
+                        ran = self._run(job)
+            finally:
+                if not requeued:
+                    self._queue.done(job, time.monotonic() - started if ran else None)
+
+    def _pending_lane(self, job):
+        """入队时还没有元数据的任务在这里确定车道，需要换车道时返回新车道，否则返回 None"""
+        if self._classify is None or not job.options.pop('lane_pending', False) or job.status != QUEUED:
+            return None
+        try:
+            lane = self._classify(job)
+        except Exception as e:
+            # 探测失败的任务留在当前车道，执行时很快就会结束
+            logger.warning(f"任务 {job.id} 分车道失败: {str(e)}")
+            return None
+        if job.status != QUEUED or lane == self._queue.lane_of(job):
+            return None
+        return lane
+
+    def _run(self, job):
+        """执行任务，返回是否真正运行（排队期间已取消的任务直接跳过）"""
+        with self._lock:
+            if job.status != QUEUED:
+                return False
+            job.status = RUNNING
+            job.started_at = time.time()
+        try:
+            result = self._handler(job)
+        except Exception as e:
+            if job.cancel_event.is_set():
+                status, error = CANCELLED, '任务已取消'
+                logger.info(f"任务 {job.id} 已取消")
+            else:
+                status, error = ERROR, str(e)
+                logger.error(f"任务 {job.id} 失败: {error}")
+            with self._lock:
+                job.status = status
+                job.error = error
+                job.finished_at = time.time()
+                self._release(job)
+        else:
+            with self._lock:
+                job.status = FINISHED
+                job.result = result
+                job.finished_at = time.time()
+                self._release(job)
+            logger.info(f"任务 {job.id} 已完成")
+        self._notify_done(job)
+        return True
@@ -0,0 +1,143 @@
+import json
+import logging
+import os
+import sqlite3
+import threading
+import time
+import uuid
+
+from storage import pid_alive
+
+logger = logging.getLogger(__name__)
+
+
+class JobJournal:
+    """下载任务的持久化记录：进程崩溃、重启或 worker 被回收后，其他进程接手未完成的任务。
+
+    每个进程有一个令牌并定期写入心跳；任务记录属于提交它的进程。所属进程已退出或心跳过期的任务
+    会被重新认领，用原来的任务 ID 重新提交，从而沿用同一个暂存目录里的 .part 文件继续下载。"""
+
+    def __init__(self, path, interval=10, lease=None, max_attempts=3):
+        self.path = path
+        self.interval = interval
+        # 心跳超过这个时间没有更新，即使进程号仍存在（可能已被复用）也视为失效
+        self.lease = lease or interval * 3
+        self.max_attempts = max_attempts
+        self.token = uuid.uuid4().hex
+        self._local = threading.local()
+        self._thread = None
+        with self._conn() as conn:
+            conn.execute('CREATE TABLE IF NOT EXISTS jobs ('
+                         'id TEXT PRIMARY KEY, url TEXT NOT NULL, format TEXT NOT NULL, key TEXT, options TEXT, '
+                         'owner TEXT NOT NULL, attempts INTEGER NOT NULL DEFAULT 0, '
+                         'created_at REAL NOT NULL, updated_at REAL NOT NULL)')
+            conn.execute('CREATE INDEX IF NOT EXISTS jobs_owner ON jobs (owner)')
+            conn.execute('CREATE TABLE IF NOT EXISTS owners (token TEXT PRIMARY KEY, pid INTEGER, heartbeat REAL)')
+
+    def _conn(self):
+        # 每个线程一个连接
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=10, isolation_level=None)
+            conn.execute('PRAGMA journal_mode=WAL')
+            conn.execute('PRAGMA synchronous=NORMAL')
+            conn.row_factory = sqlite3.Row
+            self._local.conn = conn
+        return conn
+
+    def add(self, job):
+        """登记新任务；接手的任务已有记录，只更新所属进程"""
+        now = time.time()
+        try:
+            self._conn().execute(
+                'INSERT INTO jobs (id, url, format, key, options, owner, created_at, updated_at) '
+                'VALUES (?, ?, ?, ?, ?, ?, ?, ?) '
+                'ON CONFLICT(id) DO UPDATE SET owner = excluded.owner, updated_at = excluded.updated_at',
+                (job.id, job.url, job.format_type, job.key, json.dumps(job.options), self.token, now, now),
+            )
+        except sqlite3.Error as e:
+            logger.warning(f"写入任务记录失败 {job.id}: {str(e)}")
+
+    def remove(self, job_id):
+        try:
+            self._conn().execute('DELETE FROM jobs WHERE id = ?', (job_id,))
+        except sqlite3.Error as e:
+            logger.warning(f"删除任务记录失败 {job_id}: {str(e)}")
+
+    def release(self, job_id):
+        """放弃认领（例如队列已满），让之后的检查重新处理"""
+        try:
+            self._conn().execute('UPDATE jobs SET owner = ?, attempts = attempts - 1 WHERE id = ? AND owner = ?',
+                                 ('', job_id, self.token))
+        except sqlite3.Error as e:
+            logger.warning(f"释放任务记录失败 {job_id}: {str(e)}")
+
+    def heartbeat(self):
+        self._conn().execute('INSERT OR REPLACE INTO owners VALUES (?, ?, ?)', (self.token, os.getpid(), time.time()))
+
+    def _stale_owners(self):
+        """返回已失效的进程令牌：进程已退出或心跳过期"""
+        now = time.time()
+        stale = set()
+        for row in self._conn().execute('SELECT token, pid, heartbeat FROM owners WHERE token != ?', (self.token,)):
+            if now - row['heartbeat'] > self.lease or not pid_alive(row['pid']):
+                stale.add(row['token'])
+        return stale
+
+    def claim_stale(self):
+        """认领失效进程留下的任务，返回 (接手的任务, 放弃的任务)，两者都是记录字典的列表"""
+        conn = self._conn()
+        stale = self._stale_owners()
+        live = {row['token'] for row in conn.execute('SELECT token FROM owners')} - stale
+        claimed = []
+        abandoned = []
+        for row in conn.execute('SELECT * FROM jobs WHERE owner != ?', (self.token,)).fetchall():
+            if row['owner'] in live:
+                continue
+            # 比较并交换：多个进程同时检查时只有一个能认领成功
+            cur = conn.execute(
+                'UPDATE jobs SET owner = ?, attempts = attempts + 1, updated_at = ? WHERE id = ? AND owner = ?',
+                (self.token, time.time(), row['id'], row['owner']),
+            )
+            if cur.rowcount != 1:
+                continue
+            entry = dict(row)
+            entry['options'] = json.loads(entry['options'] or '{}')
+            entry['attempts'] += 1
+            if entry['attempts'] > self.max_attempts:
+                # 反复中断的任务（可能每次都导致进程崩溃）不再重试
+                conn.execute('DELETE FROM jobs WHERE id = ?', (entry['id'],))
+                abandoned.append(entry)
+            else:
+                claimed.append(entry)
+        if stale:
+            conn.executemany('DELETE FROM owners WHERE token = ?', [(token,) for token in stale])
+        return claimed, abandoned
+
+    def start(self, on_recover, on_abandon=None):
+        """启动后台线程：定期写心跳并接手失效进程的任务（启动时立即执行一次）"""
+        if self._thread is not None:
+            return
+        self.heartbeat()
+        self._thread = threading.Thread(target=self._loop, args=(on_recover, on_abandon), name='job-journal', daemon=True)
+        self._thread.start()
+
+    def _loop(self, on_recover, on_abandon):
+        while True:
+            try:
+                self.heartbeat()
+                claimed, abandoned = self.claim_stale()
+                for entry in abandoned:
+                    logger.warning(f"任务 {entry['id']} 已中断 {entry['attempts']} 次，不再恢复: {entry['url']}")
+                    if on_abandon is not None:
+                        on_abandon(entry)
+                for entry in claimed:
+                    logger.info(f"恢复中断的任务 {entry['id']}（第 {entry['attempts']} 次）: {entry['url']}")
+                    try:
+                        on_recover(entry)
+                    except Exception as e:
+                        logger.error(f"恢复任务 {entry['id']} 失败: {str(e)}")
+                        self.release(entry['id'])
+            except Exception as e:
+                logger.error(f"任务记录检查失败: {str(e)}")
+            time.sleep(self.interval)
@@ -0,0 +1,202 @@
+import atexit
+import contextlib
+import contextvars
+import json
+import logging
+import logging.handlers
+import queue
+import sys
+import time
+from collections import OrderedDict, deque
+from datetime import datetime
+
+# 当前线程正在处理的任务，由 job_context 设置，日志记录自动带上
+_job_id = contextvars.ContextVar('job_id', default=None)
+_platform = contextvars.ContextVar('platform', default=None)
+
+
+@contextlib.contextmanager
+def job_context(job_id, platform=None):
+    """在这段代码中产生的日志都标上任务 ID 和平台；新线程需要用 contextvars.copy_context() 传递"""
+    job_token = _job_id.set(job_id)
+    platform_token = _platform.set(platform)
+    try:
+        yield
+    finally:
+        _platform.reset(platform_token)
+        _job_id.reset(job_token)
+
+
+def parse_level(name, default=logging.INFO):
+    """把 DEBUG / info / 20 之类的级别名转成数字，无法识别时返回 default"""
+    name = str(name or '').strip().upper()
+    if name.isdigit():
+        return int(name)
+    level = logging.getLevelName(name)
+    # 未知的名字 getLevelName 返回字符串 'Level XXX'
+    return level if isinstance(level, int) else default
+
+
+class ContextFilter(logging.Filter):
+    """在产生日志的线程中读取任务上下文，写到记录的 job_id / platform 属性"""
+
+    def filter(self, record):
+        if getattr(record, 'job_id', None) is None:
+            record.job_id = _job_id.get()
+        if getattr(record, 'platform', None) is None:
+            record.platform = _platform.get()
+        return True
+
+
+class JsonFormatter(logging.Formatter):
+    """每条日志一行 JSON"""
+
+    def format(self, record):
+        data = {
+            'time': datetime.fromtimestamp(record.created).isoformat(timespec='milliseconds'),
+            'level': record.levelname,
+            'logger': record.name,
+            'message': record.getMessage(),
+        }
+        if getattr(record, 'job_id', None):
+            data['job_id'] = record.job_id
+        if getattr(record, 'platform', None):
+            data['platform'] = record.platform
+        if record.exc_info:
+            data['exc'] = self.formatException(record.exc_info)
+        return json.dumps(data, ensure_ascii=False)
+
+
+class TextFormatter(logging.Formatter):
+    """本地调试用的单行文本格式，有任务时带上任务 ID"""
+
+    def __init__(self):
+        super().__init__('%(asctime)s %(levelname)s %(name)s%(job_tag)s %(message)s')
+
+    def format(self, record):
+        job_id = getattr(record, 'job_id', None)
+        record.job_tag = f" [{job_id[:8]}]" if job_id else ''
+        return super().format(record)
+
+
+class DroppingQueueHandler(logging.handlers.QueueHandler):
+    """队列满时丢弃日志而不是阻塞调用线程，丢弃的条数通过 dropped 查看"""
+
+    def __init__(self, log_queue):
+        super().__init__(log_queue)
+        self.dropped = 0
+
+    def enqueue(self, record):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+
+
+class JobLogBuffer(logging.Handler):
+    """按任务保存最近的日志，供任务状态接口返回；只保留最近 max_jobs 个任务，每个任务 max_lines 行"""
+
+    def __init__(self, max_lines=200, max_jobs=500, level=logging.INFO):
+        super().__init__(level)
+        self.max_lines = max_lines
+        self.max_jobs = max_jobs
+        self._jobs = OrderedDict()
+
+    def emit(self, record):
+        job_id = getattr(record, 'job_id', None)
+        if not job_id:
+            return
+        lines = self._jobs.get(job_id)
+        if lines is None:
+            lines = self._jobs[job_id] = deque(maxlen=self.max_lines)
+            while len(self._jobs) > self.max_jobs:
+                self._jobs.popitem(last=False)
+        lines.append({
+            'time': round(record.created, 3),
+            'level': record.levelname,
+            'message': record.getMessage(),
+        })
+
+    def get(self, job_id):
+        # emit 在 Handler 自带的锁内执行
+        with self.lock:
+            lines = self._jobs.get(job_id)
+            return list(lines) if lines is not None else []
+
+
+class YtDlpLogger:
+    """交给 yt-dlp 的 logger 参数，替代 verbose 输出。
+
+    yt-dlp 把普通输出也通过 debug() 传入，真正的调试信息以 [debug] 开头；低于 level 的丢弃，
+    下载进度行每 progress_interval 秒最多保留一行（完成时的 100% 行总是保留）。"""
+
+    def __init__(self, logger, level=logging.INFO, progress_interval=10):
+        self.logger = logger
+        self.level = level
+        self.progress_interval = progress_interval
+        self._last_progress = 0.0
+
+    def debug(self, msg):
+        if msg.startswith('[debug] '):
+            self._log(logging.DEBUG, msg)
+        elif msg.startswith('[download]') and '%' in msg:
+            now = time.monotonic()
+            if '100%' in msg or now - self._last_progress >= self.progress_interval:
+                self._last_progress = now
+                self._log(logging.INFO, msg.strip())
+        else:
+            self._log(logging.INFO, msg)
+
+    def info(self, msg):
+        self._log(logging.INFO, msg)
+
+    def warning(self, msg):
+        self._log(logging.WARNING, msg)
+
+    def error(self, msg):
+        self._log(logging.ERROR, msg)
+
+    def _log(self, level, msg):
+        if level >= self.level:
+            self.logger.log(level, msg)
+
+
+def setup_logging(level='INFO', fmt='json', log_file=None, max_bytes=50 * 1024 * 1024, backup_count=5,
+                  queue_size=10000, job_buffer=None, start=True):
+    """替换根 logger 的处理器：调用线程只把记录放进有界队列，由后台线程格式化并写到 stderr（和可选的轮转文件）。
+
+    返回队列处理器，其 dropped 属性是因队列已满而丢弃的条数。start=False 时不启动后台线程，
+    之前的记录留在队列中，之后调用 start_listener(handler) 再输出（例如在 fork 出的 worker 进程中）"""
+    formatter = JsonFormatter() if fmt == 'json' else TextFormatter()
+    outputs = [logging.StreamHandler(sys.stderr)]
+    if log_file:
+        outputs.append(logging.handlers.RotatingFileHandler(
+            log_file, maxBytes=max_bytes, backupCount=backup_count, encoding='utf-8'))
+    for handler in outputs:
+        handler.setFormatter(formatter)
+
+    queue_handler = DroppingQueueHandler(queue.Queue(maxsize=queue_size))
+    queue_handler.addFilter(ContextFilter())
+    root = logging.getLogger()
+    for handler in list(root.handlers):
+        root.removeHandler(handler)
+    root.setLevel(parse_level(level))
+    root.addHandler(queue_handler)
+    if job_buffer is not None:
+        job_buffer.addFilter(ContextFilter())
+        root.addHandler(job_buffer)
+
+    queue_handler.listener = logging.handlers.QueueListener(queue_handler.queue, *outputs, respect_handler_level=True)
+    if start:
+        start_listener(queue_handler)
+    return queue_handler
+
+
+def start_listener(handler):
+    """启动 setup_logging 返回的处理器的输出线程，重复调用无影响"""
+    if getattr(handler, 'listening', False):
+        return
+    handler.listening = True
+    handler.listener.start()
+    # 退出时写完队列中剩余的日志
+    atexit.register(handler.listener.stop)
@@ -0,0 +1,141 @@
+import hashlib
+import json
+import logging
+import os
+import threading
+import time
+from collections import OrderedDict
+from urllib.parse import urlsplit, urlunsplit
+
+logger = logging.getLogger(__name__)
+
+
+def normalize_url(url):
+    """规范化 URL 作为元数据缓存键：去掉首尾空白和锚点，协议和域名转小写"""
+    parts = urlsplit(url.strip())
+    return urlunsplit((parts.scheme.lower(), parts.netloc.lower(), parts.path, parts.query, ''))
+
+
+def summarize_info(info):
+    """从完整的 info 字典中挑出预览页面需要的字段"""
+    formats = []
+    for f in info.get('formats') or []:
+        formats.append({
+            'format_id': f.get('format_id'),
+            'ext': f.get('ext'),
+            'resolution': f.get('resolution') or (f"{f['width']}x{f['height']}" if f.get('width') and f.get('height') else None),
+            'fps': f.get('fps'),
+            'vcodec': f.get('vcodec'),
+            'acodec': f.get('acodec'),
+            'filesize': f.get('filesize') or f.get('filesize_approx'),
+            'tbr': f.get('tbr'),
+            'protocol': f.get('protocol'),
+        })
+    return {
+        'id': info.get('id'),
+        'extractor': info.get('extractor_key') or info.get('extractor'),
+        'title': info.get('title'),
+        'uploader': info.get('uploader'),
+        'duration': info.get('duration'),
+        'thumbnail': info.get('thumbnail'),
+        'webpage_url': info.get('webpage_url'),
+        'is_live': info.get('is_live'),
+        'filesize': info.get('filesize') or info.get('filesize_approx'),
+        'formats': formats,
+    }
+
+
+class InfoCache:
+    """yt-dlp 元数据缓存：进程内 LRU + TTL，可选落盘以便多个 worker 共享"""
+
+    def __init__(self, ttl=600, max_entries=500, cache_dir=None):
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.cache_dir = cache_dir
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        # 每个键一把锁，同一 URL 的并发探测只会真正提取一次
+        self._key_locks = {}
+        if cache_dir:
+            os.makedirs(cache_dir, exist_ok=True)
+
+    def _disk_path(self, key):
+        return os.path.join(self.cache_dir, hashlib.sha1(key.encode('utf-8')).hexdigest() + '.json')
+
+    def get(self, key):
+        now = time.time()
+        with self._lock:
+            item = self._entries.get(key)
+            if item is not None:
+                cached_at, info = item
+                if now - cached_at <= self.ttl:
+                    self._entries.move_to_end(key)
+                    return info
+                del self._entries[key]
+        if not self.cache_dir:
+            return None
+        path = self._disk_path(key)
+        try:
+            if now - os.path.getmtime(path) > self.ttl:
+                return None
+            with open(path, 'r', encoding='utf-8') as f:
+                info = json.load(f)
+        except (OSError, ValueError):
+            return None
+        self._remember(key, info, os.path.getmtime(path))
+        return info
+
+    def _remember(self, key, info, cached_at):
+        with self._lock:
+            self._entries[key] = (cached_at, info)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def put(self, key, info):
+        self._remember(key, info, time.time())
+        if not self.cache_dir:
+            return
+        path = self._disk_path(key)
+        tmp_path = f"{path}.{threading.get_ident()}.tmp"
+        try:
+            with open(tmp_path, 'w', encoding='utf-8') as f:
+                json.dump(info, f)
+            os.replace(tmp_path, path)
+        except (OSError, TypeError, ValueError) as e:
+            logger.warning(f"元数据缓存写入磁盘失败: {str(e)}")
+
+    def invalidate(self, url):
+        key = normalize_url(url)
+        with self._lock:
+            self._entries.pop(key, None)
+        if self.cache_dir:
+            try:
+                os.remove(self._disk_path(key))
+            except OSError:
+                pass
+
+    def get_or_extract(self, url, extract):
+        """命中缓存直接返回，否则调用 extract(url) 并缓存结果"""
+        key = normalize_url(url)
+        info = self.get(key)
+        if info is not None:
+            return info
+        with self._lock:
+            key_lock = self._key_locks.setdefault(key, threading.Lock())
+        try:
+            with key_lock:
+                # 等锁期间其他线程可能已经提取完成
+                info = self.get(key)
+                if info is not None:
+                    return info
+                started = time.time()
+                info = extract(url)
+                logger.info(f"元数据提取耗时 {time.time() - started:.2f}s: {url}")
+                if info is not None:
+                    self.put(key, info)
+                return info
+        finally:
+            with self._lock:
+                if self._key_locks.get(key) is key_lock and not key_lock.locked():
+                    del self._key_locks[key]
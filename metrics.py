@@ -0,0 +1,161 @@
+import contextlib
+import threading
+import time
+
+# 耗时类直方图的默认分桶（秒）
+DEFAULT_BUCKETS = (0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300, 600)
+
+
+def _format_labels(names, values, extra=None):
+    pairs = list(zip(names, values))
+    if extra:
+        pairs.append(extra)
+    if not pairs:
+        return ''
+    escaped = (str(v).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n') for _, v in pairs)
+    return '{' + ','.join(f'{k}="{v}"' for (k, _), v in zip(pairs, escaped)) + '}'
+
+
+def _format_value(value):
+    if value == float('inf'):
+        return '+Inf'
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class _Metric:
+    kind = None
+
+    def __init__(self, name, documentation, labels=()):
+        self.name = name
+        self.documentation = documentation
+        self.label_names = tuple(labels)
+        self._lock = threading.Lock()
+
+    def _key(self, labels):
+        return tuple(str(labels.get(n, '')) for n in self.label_names)
+
+    def header(self):
+        return [f'# HELP {self.name} {self.documentation}', f'# TYPE {self.name} {self.kind}']
+
+
+class Counter(_Metric):
+    kind = 'counter'
+
+    def __init__(self, name, documentation, labels=()):
+        super().__init__(name, documentation, labels)
+        self._values = {}
+
+    def inc(self, amount=1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def render(self):
+        with self._lock:
+            values = dict(self._values)
+        return [f'{self.name}{_format_labels(self.label_names, k)} {_format_value(v)}' for k, v in values.items()]
+
+
+class Gauge(_Metric):
+    """抓取时调用 callback 取值；callback 返回数值，或 {标签值元组: 数值}。
+
+    其他对象自己维护的累计值也用它输出，此时 kind 为 counter。"""
+
+    def __init__(self, name, documentation, callback, labels=(), kind='gauge'):
+        super().__init__(name, documentation, labels)
+        self.callback = callback
+        self.kind = kind
+
+    def render(self):
+        value = self.callback()
+        if isinstance(value, dict):
+            return [f'{self.name}{_format_labels(self.label_names, k)} {_format_value(v)}' for k, v in value.items()]
+        return [f'{self.name} {_format_value(value)}']
+
+
+class Histogram(_Metric):
+    kind = 'histogram'
+
+    def __init__(self, name, documentation, labels=(), buckets=DEFAULT_BUCKETS):
+        super().__init__(name, documentation, labels)
+        self.buckets = tuple(sorted(buckets)) + (float('inf'),)
+        self._values = {}
+
+    def observe(self, value, **labels):
+        key = self._key(labels)
+        with self._lock:
+            counts, total = self._values.get(key, ([0] * len(self.buckets), 0.0))
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    counts[i] += 1
+                    break
+            self._values[key] = (counts, total + value)
+
+    @contextlib.contextmanager
+    def time(self, **labels):
+        start = time.monotonic()
+        try:
+            yield
+        finally:
+            self.observe(time.monotonic() - start, **labels)
+
+    def render(self):
+        with self._lock:
+            values = {k: (list(c), s) for k, (c, s) in self._values.items()}
+        lines = []
+        for key, (counts, total) in values.items():
+            cumulative = 0
+            for bound, count in zip(self.buckets, counts):
+                cumulative += count
+                labels = _format_labels(self.label_names, key, ('le', _format_value(bound)))
+                lines.append(f'{self.name}_bucket{labels} {cumulative}')
+            labels = _format_labels(self.label_names, key)
+            lines.append(f'{self.name}_sum{labels} {_format_value(total)}')
+            lines.append(f'{self.name}_count{labels} {cumulative}')
+        return lines
+
+
+class MetricsRegistry:
+    """进程内的指标集合，按 Prometheus 文本格式输出。gunicorn 多 worker 时每个 worker 各自统计"""
+
+    def __init__(self, prefix=''):
+        self.prefix = prefix
+        self._metrics = []
+
+    def _add(self, metric):
+        self._metrics.append(metric)
+        return metric
+
+    def counter(self, name, documentation, labels=()):
+        return self._add(Counter(self.prefix + name, documentation, labels))
+
+    def gauge(self, name, documentation, callback, labels=(), kind='gauge'):
+        return self._add(Gauge(self.prefix + name, documentation, callback, labels, kind))
+
+    def histogram(self, name, documentation, labels=(), buckets=DEFAULT_BUCKETS):
+        return self._add(Histogram(self.prefix + name, documentation, labels, buckets))
+
+    def render(self):
+        lines = []
+        for metric in self._metrics:
+            try:
+                samples = metric.render()
+            except Exception:
+                # 单个指标取值失败不影响其他指标
+                continue
+            lines += metric.header() + samples
+        return '\n'.join(lines) + '\n'
+
+
+@contextlib.contextmanager
+def span(job, name, histogram=None, record=True, **labels):
+    """统计一个阶段的耗时：写入直方图，并在 record 为真时记录到任务的 spans 中"""
+    start = time.monotonic()
+    try:
+        yield
+    finally:
+        elapsed = time.monotonic() - start
+        if histogram is not None:
+            histogram.observe(elapsed, **labels)
+        if record and job is not None:
+            job.add_span(name, start, elapsed)
@@ -0,0 +1,198 @@
+import logging
+import re
+import threading
+import urllib.error
+import urllib.request
+from collections import OrderedDict
+from urllib.parse import parse_qsl, urlencode, urljoin, urlsplit, urlunsplit
+
+logger = logging.getLogger(__name__)
+
+# 各平台通用的跟踪参数，不影响视频内容
+TRACKING_PARAMS = frozenset((
+    'fbclid', 'gclid', 'dclid', 'msclkid', 'yclid', 'igshid', 'mc_cid', 'mc_eid', '_hsenc', '_hsmi',
+))
+TRACKING_PREFIXES = ('utm_',)
+
+# 平台规则：按顺序匹配。patterns 提取视频 ID（可带 user 等其他命名分组），short 是需要跟随跳转的短链接，
+# keep 是影响内容、需要保留的查询参数，canonical 是交给 yt-dlp 的规范地址（缺少分组时保留原地址）。
+# ie_key 与 yt-dlp 提取器名一致，缓存键和之前由 yt-dlp 推出的格式相同。
+PLATFORMS = [
+    {
+        'name': 'youtube',
+        'ie_key': 'Youtube',
+        'patterns': (
+            r'^https?://youtu\.be/(?P<id>[0-9A-Za-z_-]{11})',
+            r'^https?://(?:[\w-]+\.)?youtube(?:-nocookie)?\.com/(?:shorts|embed|live|v|e)/(?P<id>[0-9A-Za-z_-]{11})',
+            r'^https?://(?:[\w-]+\.)?youtube\.com/(?:watch|watch_popup)?\?(?:[^#]*&)?v=(?P<id>[0-9A-Za-z_-]{11})',
+        ),
+        'short': (),
+        'keep': (),
+        'canonical': 'https://www.youtube.com/watch?v={id}',
+    },
+    {
+        'name': 'tiktok',
+        'ie_key': 'TikTok',
+        'patterns': (
+            r'^https?://(?:www\.|m\.)?tiktok\.com/@(?P<user>[\w.-]+)/video/(?P<id>\d+)',
+            r'^https?://(?:www\.|m\.)?tiktok\.com/(?:embed(?:/v2)?|v)/(?P<id>\d+)',
+        ),
+        'short': (r'^https?://(?:vm|vt)\.tiktok\.com/\w+', r'^https?://(?:www\.)?tiktok\.com/t/\w+'),
+        'keep': (),
+        'canonical': 'https://www.tiktok.com/@{user}/video/{id}',
+    },
+    {
+        'name': 'bilibili',
+        'ie_key': 'BiliBili',
+        'patterns': (
+            r'^https?://(?:www\.|m\.)?bilibili\.com/video/(?P<id>BV[0-9A-Za-z]{10}|av\d+)',
+        ),
+        'short': (r'^https?://b23\.tv/\w+',),
+        # 分P视频的 p 参数决定下载哪一集
+        'keep': ('p',),
+        'canonical': 'https://www.bilibili.com/video/{id}',
+    },
+]
+
+for _platform in PLATFORMS:
+    _platform['patterns'] = tuple(re.compile(p) for p in _platform['patterns'])
+    _platform['short'] = tuple(re.compile(p) for p in _platform['short'])
+
+# mp4 容器可以直接封装的视频编码，格式选择时优先于其他编码，避免下载后再转码
+MP4_VCODECS = "[vcodec~='^(avc|h26[45]|hev|hvc|av01)']"
+
+# 各平台的下载参数：格式选择、分片并发数（None 使用全局配置）、限速（字节/秒，None 不限）
+DEFAULT_PROFILES = {
+    'default': {
+        'video_format': f'bestvideo[ext=mp4]+bestaudio[ext=m4a]/best[ext=mp4]/best{MP4_VCODECS}/best',
+        'audio_format': 'bestaudio/best',
+        'fragments': None,
+        'ratelimit': None,
+    },
+    # TikTok 只提供音视频合一的 mp4，分片并发没有意义
+    'tiktok': {'video_format': 'best[ext=mp4]/best', 'fragments': 1},
+    # B 站对单 IP 的并发连接比较敏感
+    'bilibili': {
+        'video_format': f'bestvideo[ext=mp4]+bestaudio[ext=m4a]/bestvideo{MP4_VCODECS}+bestaudio/bestvideo+bestaudio/best',
+        'fragments': 2,
+    },
+}
+
+
+class _NoRedirect(urllib.request.HTTPRedirectHandler):
+    def redirect_request(self, req, fp, code, msg, headers, newurl):
+        return None
+
+
+def _clean_query(query, keep=None):
+    """去掉跟踪参数；给出 keep 时只保留其中的参数"""
+    params = []
+    for name, value in parse_qsl(query, keep_blank_values=True):
+        if keep is not None:
+            if name in keep:
+                params.append((name, value))
+        elif name not in TRACKING_PARAMS and not name.startswith(TRACKING_PREFIXES):
+            params.append((name, value))
+    return urlencode(params)
+
+
+def normalize(url):
+    """协议和域名转小写，去掉锚点和跟踪参数"""
+    parts = urlsplit(url.strip())
+    return urlunsplit((parts.scheme.lower(), parts.netloc.lower(), parts.path, _clean_query(parts.query), ''))
+
+
+class PlatformRouter:
+    """不经过 yt-dlp 的提取器列表，用预编译规则识别平台、规范化 URL 并生成缓存/去重键"""
+
+    def __init__(self, profiles=None, expand_short_links=True, timeout=5, max_cached=1000):
+        self.profiles = {name: dict(p) for name, p in DEFAULT_PROFILES.items()}
+        for name, overrides in (profiles or {}).items():
+            self.profiles.setdefault(name, {}).update(overrides)
+        self.expand_short_links = expand_short_links
+        self.timeout = timeout
+        self.max_cached = max_cached
+        # 短链接 -> 跳转后的地址
+        self._expanded = OrderedDict()
+        self._lock = threading.Lock()
+
+    def _match(self, url):
+        for platform in PLATFORMS:
+            for pattern in platform['patterns']:
+                m = pattern.match(url)
+                if m:
+                    return platform, m
+        return None, None
+
+    def _is_short(self, url):
+        return any(p.match(url) for platform in PLATFORMS for p in platform['short'])
+
+    def expand(self, url, max_hops=3):
+        """跟随短链接的跳转（只读响应头），结果缓存；失败时返回原地址"""
+        with self._lock:
+            if url in self._expanded:
+                self._expanded.move_to_end(url)
+                return self._expanded[url]
+        opener = urllib.request.build_opener(_NoRedirect)
+        target = url
+        try:
+            for _ in range(max_hops):
+                req = urllib.request.Request(target, headers={'User-Agent': 'Mozilla/5.0'})
+                try:
+                    opener.open(req, timeout=self.timeout).close()
+                    break
+                except urllib.error.HTTPError as e:
+                    location = e.headers.get('Location')
+                    if e.code not in (301, 302, 303, 307, 308) or not location:
+                        break
+                    target = urljoin(target, location)
+                if not self._is_short(normalize(target)):
+                    break
+        except Exception as e:
+            logger.warning(f"短链接展开失败 {url}: {str(e)}")
+            return url
+        logger.info(f"短链接 {url} -> {target}")
+        with self._lock:
+            self._expanded[url] = target
+            while len(self._expanded) > self.max_cached:
+                self._expanded.popitem(last=False)
+        return target
+
+    def resolve(self, url, expand=True):
+        """返回 {'platform', 'ie_key', 'id', 'url', 'key'}：url 交给 yt-dlp，key 用于缓存和合并任务。
+
+        expand 为假时不联网展开短链接（只用于统计标签等场合）"""
+        url = url.strip()
+        normalized = normalize(url)
+        if expand and self.expand_short_links and self._is_short(normalized):
+            url = self.expand(url)
+            normalized = normalize(url)
+        platform, m = self._match(normalized)
+        if platform is None:
+            # 未知平台保留原地址（直链的签名参数不能改动），键使用去掉跟踪参数后的地址
+            return {'platform': 'unknown', 'ie_key': 'Generic', 'id': None, 'url': url, 'key': f'Generic:{normalized}'}
+
+        groups = m.groupdict()
+        video_id = groups['id']
+        kept = _clean_query(urlsplit(normalized).query, keep=platform['keep'])
+        if all(groups.get(name) for name in re.findall(r'{(\w+)}', platform['canonical'])):
+            canonical = platform['canonical'].format(**groups)
+            if kept:
+                canonical += '?' + kept
+        else:
+            canonical = normalized
+        key_id = video_id + ''.join(f'_{name}{value}' for name, value in parse_qsl(kept))
+        return {
+            'platform': platform['name'],
+            'ie_key': platform['ie_key'],
+            'id': video_id,
+            'url': canonical,
+            'key': f"{platform['ie_key']}:{key_id}",
+        }
+
+    def cache_key(self, target, format_type):
+        return f"{target['key']}:{format_type}"
+
+    def options(self, platform):
+        """平台的下载参数，未单独配置的字段使用默认值"""
+        return {**self.profiles['default'], **self.profiles.get(platform, {})}
@@ -1,31 +1,302 @@
+"""批量生成音频的变速版本（时长改变、音高不变）。
+
+每个输入文件只做一次 STFT，所有速度都由同一份频谱通过相位声码器得到；文件和速度分发到进程池并行处理。
+分析时边读边算，频谱按块写入磁盘上的内存映射；输出按块做逆变换并用 soundfile 边算边写，长音频也不会整段放在内存里。
+
+    python process_audio.py chipi.wav other.mp3 --rates 0.8,1.2,1.5 --output-dir variants
+"""
+import argparse
+import itertools
+import logging
+import multiprocessing
+import os
+import shutil
+import tempfile
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+
 import librosa
-import soundfile as sf
 import numpy as np
+import soundfile as sf
+import soxr
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_RATES = (0.8, 1.0, 1.2, 1.5, 1.8, 2.0, 2.3, 2.5)
+# 与 librosa.effects.time_stretch 的默认参数一致
+N_FFT = 2048
+HOP_LENGTH = N_FFT // 4
+# 每次处理的帧数，决定单个速度任务的内存占用
+BLOCK_FRAMES = 256
+# 分析时每次读取的样本数
+BLOCK_SAMPLES = 256 * 1024
+
+
+def variant_path(src, rate, output_dir=None, ext=None):
+    """chipi.wav + 1.5 -> chipi_1.5x.wav"""
+    stem, src_ext = os.path.splitext(os.path.basename(src))
+    if not ext:
+        # 默认沿用输入格式，soundfile 写不了的格式（如 m4a）改为 wav
+        ext = src_ext.lstrip('.').lower()
+        if ext.upper() not in sf.available_formats():
+            ext = 'wav'
+    return os.path.join(output_dir or os.path.dirname(os.path.abspath(src)), f"{stem}_{rate:g}x.{ext}")
+
+
+def read_blocks(src, sr=None, block_samples=BLOCK_SAMPLES):
+    """按块读取音频并混成单声道，需要时流式重采样到 sr；返回 (采样率, 样本数, 样本块的迭代器)。
 
-def create_speed_variants():
-    print("开始处理音频文件...")
-    
-    # 加载原始音频
+    样本与 librosa.load(src, sr=sr) 一致（重采样为 soxr_hq，长度补齐或截断到相同的样本数）"""
     try:
-        y, sr = librosa.load('chipi.wav')
-        print(f"原始音频加载成功，采样率: {sr}")
-        
-        # 创建不同速度的版本
-        speeds = [0.8, 1.0, 1.2, 1.5, 1.8, 2.0, 2.3, 2.5]
-        for speed in speeds:
-            print(f"正在生成 {speed}x 速度的版本...")
-            # 使用 librosa 的时间拉伸
-            y_fast = librosa.effects.time_stretch(y=y, rate=speed)
-            # 保存新的音频文件
-            sf.write(f'chipi_{speed:.1f}x.wav', y_fast, sr)
-            print(f"已保存 chipi_{speed:.1f}x.wav")
-            
-        print("所有音频文件处理完成！")
+        f = sf.SoundFile(src)
+    except sf.SoundFileRuntimeError:
+        # soundfile 读不了的格式（如 m4a）交给 librosa 通过 audioread 解码，只能整段加载
+        y, sr = librosa.load(src, sr=sr)
+        return sr, len(y), iter([y])
+    native = f.samplerate
+    if not sr or sr == native:
+        sr, length, stream = native, f.frames, None
+    else:
+        length = int(np.ceil(f.frames * sr / native))
+        stream = soxr.ResampleStream(native, sr, 1, dtype='float32', quality='soxr_hq')
+
+    def blocks():
+        remaining = length
+        with f:
+            for block in itertools.chain(f.blocks(block_samples, dtype='float32', always_2d=True), [None]):
+                if stream is None:
+                    if block is None:
+                        break
+                    out = block.mean(axis=1)
+                else:
+                    last = block is None
+                    chunk = np.zeros(0, dtype=np.float32) if last else block.mean(axis=1)
+                    out = stream.resample_chunk(chunk, last=last)
+                out = out[:remaining]
+                remaining -= len(out)
+                if len(out):
+                    yield out
+        if remaining > 0:
+            yield np.zeros(remaining, dtype=np.float32)
+
+    return sr, length, blocks()
+
+
+def analyze(src, spec_path, sr=22050, n_fft=N_FFT, hop_length=HOP_LENGTH, block_samples=BLOCK_SAMPLES):
+    """边读音频（单声道）边计算 STFT，按 (帧, 频点) 逐块写入 spec_path 的内存映射；返回 (采样率, 样本数)。
+
+    结果与 librosa.stft(center=True) 相同，整段音频和完整频谱都不会放在内存里"""
+    sr, length, blocks = read_blocks(src, sr, block_samples)
+    n_frames = 1 + length // hop_length
+    # 转置存放，每帧在文件中连续，按帧读取内存映射时不会跳读
+    spec = np.lib.format.open_memmap(spec_path, mode='w+', dtype=np.complex64, shape=(n_frames, n_fft // 2 + 1))
+    window = librosa.filters.get_window('hann', n_fft, fftbins=True)
+    # center=True：首尾各补 n_fft // 2 个零，buf 中保存还没有算完的样本
+    pad = np.zeros(n_fft // 2, dtype=np.float32)
+    buf = pad
+    pos = 0
+    for block in itertools.chain(blocks, [pad]):
+        buf = np.concatenate([buf, block])
+        count = min((len(buf) - n_fft) // hop_length + 1, n_frames - pos) if len(buf) >= n_fft else 0
+        if count <= 0:
+            continue
+        frames = np.lib.stride_tricks.sliding_window_view(buf, n_fft)[::hop_length][:count]
+        spec[pos:pos + count] = np.fft.rfft(frames * window, axis=1)
+        pos += count
+        buf = buf[count * hop_length:]
+    spec.flush()
+    del spec
+    return sr, length
+
+
+def _frames(spec, index):
+    """按帧号取频谱，超出末尾的帧视为全零（与 librosa 在末尾补两帧零的做法一致）"""
+    out = np.zeros((len(index), spec.shape[1]), dtype=spec.dtype)
+    valid = index < spec.shape[0]
+    out[valid] = spec[index[valid]]
+    return out
+
+
+def phase_vocoder_blocks(spec, rate, hop_length=HOP_LENGTH, block_frames=BLOCK_FRAMES):
+    """librosa.phase_vocoder 的分块版本：spec 为 (帧, 频点)，逐块产出拉伸后的帧"""
+    n_frames, n_bins = spec.shape
+    phi_advance = hop_length * np.linspace(0, np.pi, n_bins)
+    time_steps = np.arange(0, n_frames, rate, dtype=np.float64)
+    phase_acc = np.angle(spec[0]).astype(np.float64)
+    for start in range(0, len(time_steps), block_frames):
+        steps = time_steps[start:start + block_frames]
+        index = steps.astype(np.int64)
+        alpha = np.mod(steps, 1.0)[:, None]
+        left = _frames(spec, index)
+        right = _frames(spec, index + 1)
+        mag = (1.0 - alpha) * np.abs(left) + alpha * np.abs(right)
+        dphase = np.angle(right) - np.angle(left) - phi_advance
+        dphase -= 2.0 * np.pi * np.round(dphase / (2.0 * np.pi))
+        advance = phi_advance + dphase
+        # 每帧使用累加到它之前的相位
+        phases = phase_acc + np.cumsum(advance, axis=0) - advance
+        phase_acc = phases[-1] + advance[-1]
+        yield (mag * np.exp(1j * phases)).astype(spec.dtype)
+
+
+class StreamingISTFT:
+    """分块重叠相加的逆 STFT（center=True），结果与 librosa.istft(length=...) 相同，完成的样本立即交给 write"""
+
+    def __init__(self, write, length, n_fft=N_FFT, hop_length=HOP_LENGTH):
+        self.write = write
+        self.n_fft = n_fft
+        self.hop_length = hop_length
+        self.window = librosa.filters.get_window('hann', n_fft, fftbins=True)
+        self.window_sq = self.window ** 2
+        self.tiny = np.finfo(np.float32).tiny
+        # 与下一块重叠、还没有完成的部分
+        self.carry = np.zeros(n_fft - hop_length)
+        self.carry_norm = np.zeros(n_fft - hop_length)
+        self.skip = n_fft // 2
+        self.remaining = length
+
+    def feed(self, frames):
+        count = len(frames)
+        hop = self.hop_length
+        signal = self.window * np.fft.irfft(frames, n=self.n_fft, axis=1)
+        size = (count - 1) * hop + self.n_fft
+        acc = np.zeros(size)
+        norm = np.zeros(size)
+        acc[:len(self.carry)] += self.carry
+        norm[:len(self.carry_norm)] += self.carry_norm
+        for i in range(count):
+            acc[i * hop:i * hop + self.n_fft] += signal[i]
+            norm[i * hop:i * hop + self.n_fft] += self.window_sq
+        # 下一帧起点之前的样本不会再变化
+        done = count * hop
+        self._emit(acc[:done], norm[:done])
+        self.carry = acc[done:]
+        self.carry_norm = norm[done:]
+
+    def finish(self):
+        self._emit(self.carry, self.carry_norm)
+        if self.remaining > 0:
+            self.write(np.zeros(self.remaining, dtype=np.float32))
+            self.remaining = 0
+
+    def _emit(self, acc, norm):
+        nonzero = norm > self.tiny
+        acc[nonzero] /= norm[nonzero]
+        if self.skip:
+            dropped = min(self.skip, len(acc))
+            acc = acc[dropped:]
+            self.skip -= dropped
+        acc = acc[:self.remaining]
+        self.remaining -= len(acc)
+        if len(acc):
+            self.write(acc.astype(np.float32))
+
+
+def render_variant(spec_path, rate, sr, length, dest, hop_length=HOP_LENGTH, block_frames=BLOCK_FRAMES):
+    """从保存的频谱生成一个速度的版本，边算边写入 dest"""
+    spec = np.load(spec_path, mmap_mode='r')
+    n_fft = 2 * (spec.shape[1] - 1)
+    with sf.SoundFile(dest, 'w', samplerate=sr, channels=1) as out:
+        istft = StreamingISTFT(out.write, int(round(length / rate)), n_fft, hop_length)
+        for frames in phase_vocoder_blocks(spec, rate, hop_length, block_frames):
+            istft.feed(frames)
+        istft.finish()
+    return dest
+
+
+def _mp_context():
+    """优先用 forkserver：服务进程预先导入本模块（含 librosa），之后的子进程直接从它 fork，不用各自导入"""
+    if 'forkserver' not in multiprocessing.get_all_start_methods():
+        return multiprocessing.get_context('spawn')
+    ctx = multiprocessing.get_context('forkserver')
+    ctx.set_forkserver_preload([__name__])
+    return ctx
+
+
+class SpeedVariantEngine:
+    """进程池中批量生成变速版本：每个文件先分析一次，再把各个速度分给不同进程"""
+
+    def __init__(self, workers=None, sr=22050, block_frames=BLOCK_FRAMES):
+        self.workers = workers or os.cpu_count() or 1
+        # None 表示保留原始采样率
+        self.sr = sr
+        self.block_frames = block_frames
+        self._pool = ProcessPoolExecutor(self.workers, mp_context=_mp_context())
+
+    def run(self, inputs, rates, output_dir=None, ext=None):
+        """返回 {输入文件: [输出文件, ...]}，顺序与 rates 一致；任何一个任务失败都会抛出异常"""
+        if output_dir:
+            os.makedirs(output_dir, exist_ok=True)
+        work_dir = tempfile.mkdtemp(prefix='speed_')
+        results = {src: [None] * len(rates) for src in inputs}
+        try:
+            # future -> (输入文件, 频谱路径, 速度序号)；序号为 None 的是分析任务
+            pending = {}
+            for n, src in enumerate(inputs):
+                spec_path = os.path.join(work_dir, f"{n}.npy")
+                pending[self._pool.submit(analyze, src, spec_path, self.sr)] = (src, spec_path, None)
+            while pending:
+                done, _ = wait(pending, return_when=FIRST_COMPLETED)
+                for future in done:
+                    src, spec_path, index = pending.pop(future)
+                    if index is not None:
+                        results[src][index] = future.result()
+                        continue
+                    sr, length = future.result()
+                    logger.info(f"已分析 {src}，采样率: {sr}，开始生成 {len(rates)} 个速度版本")
+                    for i, rate in enumerate(rates):
+                        task = self._pool.submit(
+                            render_variant, spec_path, rate, sr, length,
+                            variant_path(src, rate, output_dir, ext), HOP_LENGTH, self.block_frames,
+                        )
+                        pending[task] = (src, spec_path, i)
+            return results
+        except BaseException:
+            for future in pending:
+                future.cancel()
+            raise
+        finally:
+            shutil.rmtree(work_dir, ignore_errors=True)
+
+    def close(self):
+        self._pool.shutdown(wait=False)
+
+
+def create_speed_variants(inputs=('chipi.wav',), rates=DEFAULT_RATES, output_dir=None, workers=None, sr=22050):
+    logger.info("开始处理音频文件...")
+    engine = SpeedVariantEngine(workers=workers, sr=sr)
+    try:
+        for src, outputs in engine.run(list(inputs), list(rates), output_dir).items():
+            for path in outputs:
+                logger.info(f"已保存 {path}")
+        logger.info("所有音频文件处理完成！")
         return True
-        
     except Exception as e:
-        print(f"处理音频时出错: {e}")
+        logger.error(f"处理音频时出错: {e}")
         return False
+    finally:
+        engine.close()
+
+
+def parse_rates(value):
+    rates = [float(r) for r in value.split(',') if r.strip()]
+    if not rates or any(r <= 0 for r in rates):
+        raise argparse.ArgumentTypeError('速度必须是正数')
+    return rates
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='批量生成音频的变速版本')
+    parser.add_argument('inputs', nargs='*', default=['chipi.wav'], help='输入音频文件，默认 chipi.wav')
+    parser.add_argument('--rates', type=parse_rates, default=list(DEFAULT_RATES),
+                        help='逗号分隔的速度，默认 ' + ','.join(str(r) for r in DEFAULT_RATES))
+    parser.add_argument('--output-dir', help='输出目录，默认与输入文件相同')
+    parser.add_argument('--workers', type=int, default=None, help='进程数，默认 CPU 核数')
+    parser.add_argument('--sr', type=int, default=22050, help='重采样率，0 表示保留原始采样率')
+    args = parser.parse_args(argv)
+    logging.basicConfig(level=logging.INFO, format='%(message)s')
+    ok = create_speed_variants(args.inputs, args.rates, args.output_dir, args.workers, args.sr or None)
+    return 0 if ok else 1
+
 
 if __name__ == "__main__":
-    create_speed_variants() 
\ No newline at end of file
+    raise SystemExit(main())
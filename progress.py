@@ -0,0 +1,173 @@
+import asyncio
+import threading
+import time
+from collections import OrderedDict
+
+# 进度条目的终止状态，到达后才会参与 TTL 淘汰
+FINAL_STATES = ('finished', 'error', 'cancelled')
+
+
+def _initial_progress():
+    return {
+        "status": "queued",  # queued, downloading, processing, finished, error, cancelled
+        "percent": "0.0%",
+        "message": "",
+        "speed": "",
+        "eta": "",
+        "updated_at": time.time(),
+    }
+
+
+def _wake(future):
+    if not future.done():
+        future.set_result(None)
+
+
+class _Entry:
+    """单个任务的进度快照，更新时整体替换字典，读取方无需加锁"""
+
+    __slots__ = ('data', 'version', 'changed', 'waiters')
+
+    def __init__(self):
+        self.data = _initial_progress()
+        self.version = 0
+        self.changed = threading.Condition(threading.Lock())
+        # 异步等待方的 (事件循环, future)，不占用线程
+        self.waiters = []
+
+    def set(self, fields):
+        data = dict(self.data)
+        data.update(fields)
+        data['updated_at'] = time.time()
+        with self.changed:
+            self.data = data
+            self.version += 1
+            self.changed.notify_all()
+            waiters, self.waiters = self.waiters, []
+        for loop, future in waiters:
+            try:
+                loop.call_soon_threadsafe(_wake, future)
+            except RuntimeError:
+                # 事件循环已关闭
+                pass
+
+    def wait(self, version, timeout):
+        with self.changed:
+            if self.version == version:
+                self.changed.wait(timeout)
+            return self.data, self.version
+
+    async def wait_async(self, version, timeout):
+        loop = asyncio.get_running_loop()
+        with self.changed:
+            if self.version != version:
+                return self.data, self.version
+            future = loop.create_future()
+            self.waiters.append((loop, future))
+        try:
+            await asyncio.wait({future}, timeout=timeout)
+        finally:
+            with self.changed:
+                if (loop, future) in self.waiters:
+                    self.waiters.remove((loop, future))
+        return self.data, self.version
+
+
+class ProgressRegistry:
+    """按任务 ID 保存下载进度，数量有上限，已结束的条目按 TTL 淘汰"""
+
+    def __init__(self, max_entries=1000, ttl=600, min_interval=0.25, on_change=None):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.min_interval = min_interval
+        # 每次写入后以 (key, 快照) 调用，用于同步到共享存储
+        self.on_change = on_change
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def _get_or_create(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                entry = self._entries[key] = _Entry()
+                self._evict()
+            return entry
+
+    def _evict(self):
+        # 调用方已持有锁
+        now = time.time()
+        for key in list(self._entries):
+            data = self._entries[key].data
+            if data['status'] in FINAL_STATES and now - data['updated_at'] > self.ttl:
+                del self._entries[key]
+        if len(self._entries) <= self.max_entries:
+            return
+        # 超出上限时优先淘汰最早的已结束条目，其次才是最早的条目
+        for key in list(self._entries):
+            if len(self._entries) <= self.max_entries:
+                return
+            if self._entries[key].data['status'] in FINAL_STATES:
+                del self._entries[key]
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+
+    def _set(self, key, entry, fields):
+        entry.set(fields)
+        if self.on_change is not None:
+            self.on_change(key, entry.data)
+
+    def create(self, key, **fields):
+        entry = self._get_or_create(key)
+        if fields:
+            self._set(key, entry, fields)
+        elif self.on_change is not None:
+            self.on_change(key, entry.data)
+        return entry.data
+
+    def update(self, key, **fields):
+        self._set(key, self._get_or_create(key), fields)
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+        return entry.data if entry is not None else None
+
+    def wait(self, key, version, timeout=15):
+        """等待条目版本号超过 version，返回 (快照, 版本号)；条目不存在时返回 (None, version)"""
+        with self._lock:
+            entry = self._entries.get(key)
+        if entry is None:
+            return None, version
+        return entry.wait(version, timeout)
+
+    async def wait_async(self, key, version, timeout=15):
+        """wait 的协程版本，供 ASGI 处理器使用"""
+        with self._lock:
+            entry = self._entries.get(key)
+        if entry is None:
+            return None, version
+        return await entry.wait_async(version, timeout)
+
+    def latest(self):
+        """返回最近更新的条目（兼容旧的 /progress 接口）"""
+        with self._lock:
+            entries = list(self._entries.values())
+        if not entries:
+            return None
+        return max((e.data for e in entries), key=lambda d: d['updated_at'])
+
+    def make_hook(self, key, parse):
+        """生成 yt-dlp 进度回调；downloading 事件按 min_interval 节流，其余事件总是写入"""
+        entry = self._get_or_create(key)
+        last_update = [0.0]
+
+        def hook(d):
+            now = time.monotonic()
+            if d.get('status') == 'downloading' and now - last_update[0] < self.min_interval:
+                return
+            last_update[0] = now
+            fields = parse(d)
+            if fields:
+                self._set(key, entry, fields)
+
+        return hook
@@ -0,0 +1,190 @@
+import threading
+from collections import Counter, deque
+
+from storage import estimate_size
+
+# 车道：短任务优先调度，长任务只能占用一部分下载线程
+SHORT = 'short'
+LONG = 'long'
+LANES = (SHORT, LONG)
+
+# 各车道任务耗时的初始估计（秒），之后按实际耗时滑动平均
+DEFAULT_SECONDS = {SHORT: 30.0, LONG: 600.0}
+# 滑动平均中新样本的权重
+SMOOTHING = 0.2
+
+
+class QueueFullError(Exception):
+    """下载队列已满"""
+
+
+class AdmissionError(QueueFullError):
+    """调度器拒绝新任务；retry_after 为建议的重试等待秒数"""
+
+    def __init__(self, message, retry_after=None):
+        super().__init__(message)
+        self.retry_after = retry_after
+
+
+def classify(info, short_seconds=600, short_bytes=200 * 1024 * 1024):
+    """按探测到的元数据分车道：直播和超过阈值的长视频 / 大文件走 long，无法判断的也按 long 处理"""
+    if not info:
+        return LONG
+    if info.get('is_live') or info.get('live_status') in ('is_live', 'is_upcoming'):
+        return LONG
+    duration = info.get('duration')
+    if duration:
+        return SHORT if duration <= short_seconds else LONG
+    size = estimate_size(info)
+    if size:
+        return SHORT if size <= short_bytes else LONG
+    return LONG
+
+
+class LaneScheduler:
+    """JobManager 的任务队列：按车道排队，短任务优先；长任务最多同时运行 max_long 个，给短任务留出线程。
+
+    另外限制排队总数和每个客户端同时排队 / 运行的任务数，超出时抛出 AdmissionError，并给出预计等待时间。
+    任务的车道和客户端取自 job.options 中的 lane / client；没有指定车道的任务按 short 处理，即普通的先进先出。"""
+
+    def __init__(self, workers, max_long=None, max_queued=100, max_per_client=0, max_wait=0):
+        self.workers = max(1, workers)
+        # 默认至少给短任务留一个线程（只有一个线程时长任务也只能用它）
+        self.max_long = min(max_long or max(1, self.workers - 1), self.workers)
+        self.max_queued = max_queued
+        self.max_per_client = max_per_client
+        # 预计等待超过这个秒数时拒绝，0 不限
+        self.max_wait = max_wait
+        self._lanes = {lane: deque() for lane in LANES}
+        self._running = Counter()
+        self._clients = Counter()
+        self._seconds = dict(DEFAULT_SECONDS)
+        self._cond = threading.Condition()
+
+    @staticmethod
+    def lane_of(job):
+        lane = job.options.get('lane')
+        return lane if lane in LANES else SHORT
+
+    def _slots(self, lane):
+        return self.workers if lane == SHORT else self.max_long
+
+    def _estimate(self, lane, ahead):
+        # 调用方已持有锁。空闲线程够用时不用等；否则按轮次乘以该车道的平均耗时粗略估计
+        running = sum(self._running.values())
+        free = self.workers - running
+        if lane == LONG:
+            free = min(free, self.max_long - self._running[LONG])
+        if ahead < free:
+            return 0
+        return round((ahead - max(free, 0)) // self._slots(lane) * self._seconds[lane] + self._seconds[lane] / 2)
+
+    def _ahead(self, lane):
+        # 短任务优先，长任务前面还要算上所有排队的短任务
+        if lane == SHORT:
+            return len(self._lanes[SHORT])
+        return len(self._lanes[SHORT]) + len(self._lanes[LONG])
+
+    def estimate_wait(self, lane):
+        """新任务进入 lane 时的预计等待秒数"""
+        with self._cond:
+            return self._estimate(lane, self._ahead(lane))
+
+    def check(self, client=None, lane=None):
+        """提交前的快速检查，不满足时抛出 AdmissionError（不需要元数据，可以在探测之前调用）"""
+        with self._cond:
+            self._check(client, lane or SHORT)
+
+    def _check(self, client, lane):
+        queued = sum(len(q) for q in self._lanes.values())
+        if queued >= self.max_queued:
+            raise AdmissionError('下载队列已满，请稍后再试', self._estimate(lane, self._ahead(lane)))
+        if client and self.max_per_client and self._clients[client] >= self.max_per_client:
+            # 要等这个客户端自己的任务结束，按短任务的平均耗时估计
+            raise AdmissionError(f'同时进行的任务最多 {self.max_per_client} 个，请等待已有任务完成',
+                                 round(self._seconds[SHORT]))
+        if self.max_wait:
+            wait = self._estimate(lane, self._ahead(lane))
+            if wait > self.max_wait:
+                raise AdmissionError('服务器繁忙，请稍后再试', wait)
+
+    def put(self, job):
+        lane = self.lane_of(job)
+        client = job.options.get('client')
+        with self._cond:
+            self._check(client, lane)
+            job.estimated_wait = self._estimate(lane, self._ahead(lane))
+            self._lanes[lane].append(job)
+            if client:
+                self._clients[client] += 1
+            self._cond.notify()
+
+    def get(self):
+        """阻塞直到有可运行的任务：先取短任务，长任务只在未超过 max_long 时取出"""
+        with self._cond:
+            while True:
+                if self._lanes[SHORT]:
+                    lane = SHORT
+                elif self._lanes[LONG] and self._running[LONG] < self.max_long:
+                    lane = LONG
+                else:
+                    self._cond.wait()
+                    continue
+                job = self._lanes[lane].popleft()
+                self._running[lane] += 1
+                return job
+
+    def done(self, job, seconds=None):
+        """任务结束（或被跳过）时调用，seconds 为实际运行时间，用于更新平均耗时"""
+        lane = self.lane_of(job)
+        client = job.options.get('client')
+        with self._cond:
+            self._running[lane] -= 1
+            self._release_client(client)
+            if seconds is not None:
+                self._seconds[lane] += SMOOTHING * (seconds - self._seconds[lane])
+            self._cond.notify_all()
+
+    def requeue(self, job, lane):
+        """已取出的任务换到 lane 重新排队（入队时还不知道车道、取出后才探测出的任务）。
+
+        代替 done：释放运行名额但保留客户端名额，不再做接收检查，也不计入平均耗时"""
+        with self._cond:
+            self._running[self.lane_of(job)] -= 1
+            job.options['lane'] = lane
+            self._lanes[self.lane_of(job)].append(job)
+            self._cond.notify_all()
+
+    def discard(self, job):
+        """取消还在排队的任务，立即释放排队名额"""
+        lane = self.lane_of(job)
+        with self._cond:
+            try:
+                self._lanes[lane].remove(job)
+            except ValueError:
+                return False
+            self._release_client(job.options.get('client'))
+            return True
+
+    def _release_client(self, client):
+        if client:
+            self._clients[client] -= 1
+            if self._clients[client] <= 0:
+                del self._clients[client]
+
+    def qsize(self):
+        with self._cond:
+            return sum(len(q) for q in self._lanes.values())
+
+    def stats(self):
+        with self._cond:
+            return {
+                lane: {
+                    'queued': len(self._lanes[lane]),
+                    'running': self._running[lane],
+                    'slots': self._slots(lane),
+                    'avg_seconds': round(self._seconds[lane], 1),
+                    'estimated_wait': self._estimate(lane, self._ahead(lane)),
+                }
+                for lane in LANES
+            }
@@ -0,0 +1,246 @@
+import contextlib
+import logging
+import os
+import shutil
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+# 下载目录下的暂存目录，每个任务一个子目录，进程重启后可以继续使用
+STAGING_DIR_NAME = '.staging'
+
+
+class StorageFullError(Exception):
+    """磁盘空间或配额不足，无法开始新的下载"""
+
+
+def estimate_size(info):
+    """根据元数据估算下载大小（字节），无法估算时返回 None"""
+    if not info:
+        return None
+    size = info.get('filesize') or info.get('filesize_approx')
+    if size:
+        return int(size)
+    requested = info.get('requested_formats') or []
+    sizes = [f.get('filesize') or f.get('filesize_approx') for f in requested]
+    if requested and all(sizes):
+        return int(sum(sizes))
+    # 用时长和码率估算
+    duration = info.get('duration')
+    tbr = info.get('tbr') or max((f.get('tbr') or 0 for f in info.get('formats') or []), default=0)
+    if duration and tbr:
+        return int(duration * tbr * 1000 / 8)
+    return None
+
+
+def pid_alive(pid):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True
+    return True
+
+
+class StorageManager:
+    """下载目录的容量管理：配额、按最近访问时间淘汰、预留空间、清理遗留的临时文件"""
+
+    def __init__(self, folder, catalog, quota_bytes=0, min_free_bytes=0, default_reserve=100 * 1024 * 1024,
+                 orphan_age=6 * 3600, interval=300, on_evict=None, staging_root=None, staging_max_age=24 * 3600):
+        self.folder = folder
+        # 与下载目录在同一文件系统，完成后直接 rename
+        self.staging_root = staging_root or os.path.join(folder, STAGING_DIR_NAME)
+        self.staging_max_age = staging_max_age
+        self.catalog = catalog
+        self.quota_bytes = quota_bytes
+        self.min_free_bytes = min_free_bytes
+        self.default_reserve = default_reserve
+        self.orphan_age = orphan_age
+        self.interval = interval
+        self.on_evict = on_evict
+        self._reservations = {}
+        self._last_served = {}
+        self._active_temp_dirs = set()
+        self._lock = threading.Lock()
+        self._janitor = None
+
+    # ---- 使用情况 ----
+
+    def reserved_bytes(self):
+        with self._lock:
+            return sum(self._reservations.values())
+
+    def used_bytes(self):
+        return self.catalog.total_bytes() + self.reserved_bytes()
+
+    def free_bytes(self):
+        return shutil.disk_usage(self.folder).free
+
+    def stats(self):
+        return {
+            'used_bytes': self.catalog.total_bytes(),
+            'reserved_bytes': self.reserved_bytes(),
+            'quota_bytes': self.quota_bytes,
+            'free_bytes': self.free_bytes(),
+        }
+
+    def touch(self, name):
+        """记录文件最近一次被下载的时间，作为淘汰顺序"""
+        with self._lock:
+            self._last_served[name] = time.time()
+
+    # ---- 预留空间 ----
+
+    def reserve(self, key, nbytes):
+        """为即将开始的下载预留空间，必要时先淘汰旧文件；仍然不够时抛出 StorageFullError"""
+        nbytes = nbytes or self.default_reserve
+        if self.quota_bytes:
+            if self.reserved_bytes() + nbytes > self.quota_bytes:
+                # 删光现有文件也放不下，不做无谓的淘汰
+                raise StorageFullError(f'存储配额不足，需要 {nbytes/1024/1024:.0f} MB')
+            over = self.used_bytes() + nbytes - self.quota_bytes
+            if over > 0:
+                self.evict(over)
+            if self.used_bytes() + nbytes > self.quota_bytes:
+                raise StorageFullError(f'存储配额不足，需要 {nbytes/1024/1024:.0f} MB')
+        # 合并音视频时临时文件和成品同时存在，按两倍估算磁盘空间
+        needed = nbytes * 2 + self.min_free_bytes + self.reserved_bytes()
+        short = needed - self.free_bytes()
+        if short > 0:
+            self.evict(short)
+            if needed > self.free_bytes():
+                raise StorageFullError(f'磁盘空间不足，需要 {nbytes*2/1024/1024:.0f} MB')
+        with self._lock:
+            self._reservations[key] = nbytes
+        logger.info(f"已为 {key} 预留 {nbytes/1024/1024:.1f} MB")
+
+    def release(self, key):
+        with self._lock:
+            self._reservations.pop(key, None)
+
+    # ---- 淘汰 ----
+
+    def evict(self, nbytes):
+        """按最近访问时间从旧到新删除文件，直到释放 nbytes 字节，返回实际释放的字节数"""
+        entries, _ = self.catalog.list(page=1, per_page=10 ** 9, sort='date', order='asc')
+        with self._lock:
+            last_served = dict(self._last_served)
+        entries = sorted(entries, key=lambda e: max(e['mtime'], last_served.get(e['name'], 0)))
+        freed = 0
+        for entry in entries:
+            if freed >= nbytes:
+                break
+            try:
+                os.remove(os.path.join(self.folder, entry['name']))
+            except FileNotFoundError:
+                pass
+            except OSError as e:
+                logger.warning(f"淘汰文件失败 {entry['name']}: {str(e)}")
+                continue
+            freed += entry['size']
+            self.catalog.remove(entry['name'])
+            with self._lock:
+                self._last_served.pop(entry['name'], None)
+            if self.on_evict is not None:
+                self.on_evict(entry['name'])
+            logger.info(f"空间不足，淘汰文件: {entry['name']} ({entry['size']/1024/1024:.2f} MB)")
+        return freed
+
+    def enforce_quota(self):
+        if not self.quota_bytes:
+            return 0
+        over = self.used_bytes() - self.quota_bytes
+        return self.evict(over) if over > 0 else 0
+
+    # ---- 临时目录 ----
+
+    def staging_path(self, job_id):
+        return os.path.join(self.staging_root, job_id)
+
+    @contextlib.contextmanager
+    def staging_dir(self, job_id):
+        """任务的暂存目录：路径只由任务 ID 决定，进程中断后恢复的任务会拿到同一个目录和其中的 .part 文件。
+
+        正常结束（包括失败和取消）时删除；进程被杀死时保留，超过 staging_max_age 没有变化才会被清理"""
+        path = self.staging_path(job_id)
+        if os.path.isdir(path) and os.listdir(path):
+            logger.info(f"复用暂存目录: {path}")
+        os.makedirs(path, exist_ok=True)
+        with self._lock:
+            self._active_temp_dirs.add(path)
+        try:
+            yield path
+        finally:
+            shutil.rmtree(path, ignore_errors=True)
+            with self._lock:
+                self._active_temp_dirs.discard(path)
+
+    def remove_staging(self, job_id):
+        shutil.rmtree(self.staging_path(job_id), ignore_errors=True)
+
+    def clean_orphans(self):
+        """删除长时间没有变化的暂存目录，以及下载目录中过期的隐藏临时文件"""
+        now = time.time()
+        with self._lock:
+            active = set(self._active_temp_dirs)
+        removed = self.clean_staging(active)
+        try:
+            names = os.listdir(self.folder)
+        except OSError:
+            names = []
+        for name in names:
+            if not (name.startswith('.') and name.endswith('.part')):
+                continue
+            path = os.path.join(self.folder, name)
+            try:
+                if now - os.path.getmtime(path) > self.orphan_age:
+                    os.remove(path)
+                    removed += 1
+                    logger.info(f"已清理遗留的临时文件: {path}")
+            except OSError:
+                pass
+        return removed
+
+    def clean_staging(self, active=()):
+        """删除长时间没有变化的暂存目录：以其中最新文件的修改时间为准，正在下载的 .part 文件会不断更新"""
+        now = time.time()
+        removed = 0
+        try:
+            names = os.listdir(self.staging_root)
+        except OSError:
+            return 0
+        for name in names:
+            path = os.path.join(self.staging_root, name)
+            if path in active:
+                continue
+            try:
+                latest = os.path.getmtime(path)
+                for root, _, files in os.walk(path):
+                    for file in files:
+                        latest = max(latest, os.path.getmtime(os.path.join(root, file)))
+            except OSError:
+                continue
+            if now - latest > self.staging_max_age:
+                shutil.rmtree(path, ignore_errors=True)
+                removed += 1
+                logger.info(f"已清理过期的暂存目录: {path}")
+        return removed
+
+    # ---- 后台清理线程 ----
+
+    def start_janitor(self):
+        if self._janitor is not None:
+            return
+        self._janitor = threading.Thread(target=self._janitor_loop, name='storage-janitor', daemon=True)
+        self._janitor.start()
+
+    def _janitor_loop(self):
+        while True:
+            try:
+                self.enforce_quota()
+                self.clean_orphans()
+            except Exception as e:
+                logger.error(f"存储清理失败: {str(e)}")
+            time.sleep(self.interval)
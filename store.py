@@ -0,0 +1,384 @@
+import json
+import logging
+import os
+import socket
+import socketserver
+import sqlite3
+import threading
+import time
+from urllib.parse import urlsplit
+
+logger = logging.getLogger(__name__)
+
+# 共享状态的命名空间
+JOBS = 'jobs'
+PROGRESS = 'progress'
+CANCEL = 'cancel'
+FILES = 'files'
+
+
+class StoreError(Exception):
+    """共享存储访问失败"""
+
+
+class MemoryStore:
+    """进程内存储：单进程部署时使用，其他进程看不到"""
+
+    def __init__(self):
+        self._values = {}
+        self._hashes = {}
+        self._lock = threading.Lock()
+
+    def set(self, ns, key, value, ttl=None):
+        with self._lock:
+            self._values[(ns, key)] = (value, time.time() + ttl if ttl else None)
+
+    def get(self, ns, key):
+        with self._lock:
+            item = self._values.get((ns, key))
+            if item is None:
+                return None
+            value, expires_at = item
+            if expires_at is not None and expires_at < time.time():
+                del self._values[(ns, key)]
+                return None
+            return value
+
+    def delete(self, ns, key):
+        with self._lock:
+            self._values.pop((ns, key), None)
+
+    def hset(self, ns, field, value):
+        with self._lock:
+            self._hashes.setdefault(ns, {})[field] = value
+
+    def hset_many(self, ns, mapping):
+        with self._lock:
+            self._hashes.setdefault(ns, {}).update(mapping)
+
+    def hget(self, ns, field):
+        with self._lock:
+            return self._hashes.get(ns, {}).get(field)
+
+    def hdel(self, ns, field):
+        with self._lock:
+            self._hashes.get(ns, {}).pop(field, None)
+
+    def hgetall(self, ns):
+        with self._lock:
+            return dict(self._hashes.get(ns, {}))
+
+
+class SQLiteStore:
+    """单机多进程（gunicorn 多 worker）共享的存储，值以 JSON 保存"""
+
+    def __init__(self, path, purge_interval=60):
+        self.path = path
+        self.purge_interval = purge_interval
+        self._local = threading.local()
+        self._last_purge = 0.0
+        with self._conn() as conn:
+            conn.execute('CREATE TABLE IF NOT EXISTS kv (ns TEXT, key TEXT, value TEXT, expires_at REAL, '
+                         'PRIMARY KEY (ns, key))')
+            conn.execute('CREATE TABLE IF NOT EXISTS hashes (ns TEXT, field TEXT, value TEXT, '
+                         'PRIMARY KEY (ns, field))')
+
+    def _conn(self):
+        # 每个线程一个连接
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=10, isolation_level=None)
+            conn.execute('PRAGMA journal_mode=WAL')
+            conn.execute('PRAGMA synchronous=NORMAL')
+            self._local.conn = conn
+        return conn
+
+    def _purge(self, conn):
+        now = time.time()
+        if now - self._last_purge < self.purge_interval:
+            return
+        self._last_purge = now
+        conn.execute('DELETE FROM kv WHERE expires_at IS NOT NULL AND expires_at < ?', (now,))
+
+    def set(self, ns, key, value, ttl=None):
+        conn = self._conn()
+        conn.execute('INSERT OR REPLACE INTO kv VALUES (?, ?, ?, ?)',
+                     (ns, key, json.dumps(value), time.time() + ttl if ttl else None))
+        self._purge(conn)
+
+    def get(self, ns, key):
+        row = self._conn().execute('SELECT value, expires_at FROM kv WHERE ns = ? AND key = ?', (ns, key)).fetchone()
+        if row is None or (row[1] is not None and row[1] < time.time()):
+            return None
+        return json.loads(row[0])
+
+    def delete(self, ns, key):
+        self._conn().execute('DELETE FROM kv WHERE ns = ? AND key = ?', (ns, key))
+
+    def hset(self, ns, field, value):
+        self._conn().execute('INSERT OR REPLACE INTO hashes VALUES (?, ?, ?)', (ns, field, json.dumps(value)))
+
+    def hset_many(self, ns, mapping):
+        # 一个事务写入，避免逐条提交
+        conn = self._conn()
+        conn.execute('BEGIN')
+        try:
+            conn.executemany('INSERT OR REPLACE INTO hashes VALUES (?, ?, ?)',
+                             [(ns, field, json.dumps(value)) for field, value in mapping.items()])
+        except BaseException:
+            conn.execute('ROLLBACK')
+            raise
+        conn.execute('COMMIT')
+
+    def hget(self, ns, field):
+        row = self._conn().execute('SELECT value FROM hashes WHERE ns = ? AND field = ?', (ns, field)).fetchone()
+        return json.loads(row[0]) if row else None
+
+    def hdel(self, ns, field):
+        self._conn().execute('DELETE FROM hashes WHERE ns = ? AND field = ?', (ns, field))
+
+    def hgetall(self, ns):
+        rows = self._conn().execute('SELECT field, value FROM hashes WHERE ns = ?', (ns,)).fetchall()
+        return {field: json.loads(value) for field, value in rows}
+
+
+class _RespConnection:
+    """最小的 RESP 客户端连接，兼容 Redis 及本模块的 RespServer"""
+
+    def __init__(self, host, port, db=0, password=None, timeout=5):
+        self.sock = socket.create_connection((host, port), timeout=timeout)
+        self.sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        self.reader = self.sock.makefile('rb')
+        if password:
+            self.command('AUTH', password)
+        if db:
+            self.command('SELECT', db)
+
+    def close(self):
+        try:
+            self.reader.close()
+            self.sock.close()
+        except OSError:
+            pass
+
+    def command(self, *args):
+        parts = [f'*{len(args)}\r\n'.encode()]
+        for arg in args:
+            data = arg if isinstance(arg, bytes) else str(arg).encode('utf-8')
+            parts.append(f'${len(data)}\r\n'.encode() + data + b'\r\n')
+        self.sock.sendall(b''.join(parts))
+        return self._read_reply()
+
+    def _read_reply(self):
+        line = self.reader.readline()
+        if not line:
+            raise ConnectionError('连接已关闭')
+        kind, rest = line[:1], line[1:-2]
+        if kind == b'+':
+            return rest.decode()
+        if kind == b'-':
+            raise StoreError(rest.decode())
+        if kind == b':':
+            return int(rest)
+        if kind == b'$':
+            length = int(rest)
+            if length < 0:
+                return None
+            data = self.reader.read(length + 2)
+            return data[:-2]
+        if kind == b'*':
+            count = int(rest)
+            if count < 0:
+                return None
+            return [self._read_reply() for _ in range(count)]
+        raise StoreError(f'无法解析的响应: {line!r}')
+
+
+class RedisStore:
+    """通过 Redis 协议共享状态，适合多台机器；值以 JSON 保存在 prefix 开头的键中"""
+
+    def __init__(self, url, prefix='vdl'):
+        parts = urlsplit(url)
+        self.host = parts.hostname or '127.0.0.1'
+        self.port = parts.port or 6379
+        self.db = int(parts.path.strip('/') or 0)
+        self.password = parts.password
+        self.prefix = prefix
+        self._local = threading.local()
+
+    def _command(self, *args):
+        # 连接断开时重连一次
+        for attempt in range(2):
+            conn = getattr(self._local, 'conn', None)
+            try:
+                if conn is None:
+                    conn = self._local.conn = _RespConnection(self.host, self.port, self.db, self.password)
+                return conn.command(*args)
+            except (OSError, ConnectionError) as e:
+                if conn is not None:
+                    conn.close()
+                self._local.conn = None
+                if attempt:
+                    raise StoreError(f'无法连接共享存储: {str(e)}')
+
+    def _key(self, ns, key=None):
+        return f'{self.prefix}:{ns}' if key is None else f'{self.prefix}:{ns}:{key}'
+
+    def set(self, ns, key, value, ttl=None):
+        args = ['SET', self._key(ns, key), json.dumps(value)]
+        if ttl:
+            args += ['EX', int(ttl)]
+        self._command(*args)
+
+    def get(self, ns, key):
+        data = self._command('GET', self._key(ns, key))
+        return json.loads(data) if data is not None else None
+
+    def delete(self, ns, key):
+        self._command('DEL', self._key(ns, key))
+
+    def hset(self, ns, field, value):
+        self._command('HSET', self._key(ns), field, json.dumps(value))
+
+    def hset_many(self, ns, mapping):
+        # 一条 HSET 写入多个字段
+        if not mapping:
+            return
+        args = ['HSET', self._key(ns)]
+        for field, value in mapping.items():
+            args += [field, json.dumps(value)]
+        self._command(*args)
+
+    def hget(self, ns, field):
+        data = self._command('HGET', self._key(ns), field)
+        return json.loads(data) if data is not None else None
+
+    def hdel(self, ns, field):
+        self._command('HDEL', self._key(ns), field)
+
+    def hgetall(self, ns):
+        items = self._command('HGETALL', self._key(ns)) or []
+        return {items[i].decode('utf-8'): json.loads(items[i + 1]) for i in range(0, len(items), 2)}
+
+
+def open_store(backend, sqlite_path=None, redis_url=None):
+    """按配置创建共享存储：memory / sqlite / redis"""
+    if backend == 'sqlite':
+        os.makedirs(os.path.dirname(os.path.abspath(sqlite_path)), exist_ok=True)
+        return SQLiteStore(sqlite_path)
+    if backend == 'redis':
+        return RedisStore(redis_url or 'redis://127.0.0.1:6379/0')
+    return MemoryStore()
+
+
+class RespServer(socketserver.ThreadingTCPServer):
+    """没有 Redis 时的本地替身：只实现本项目用到的命令，数据只在内存中"""
+
+    daemon_threads = True
+    allow_reuse_address = True
+
+    def __init__(self, address):
+        super().__init__(address, _RespHandler)
+        self.values = {}
+        self.hashes = {}
+        self.lock = threading.Lock()
+
+
+class _RespHandler(socketserver.StreamRequestHandler):
+
+    def _read_command(self):
+        line = self.rfile.readline()
+        if not line:
+            return None
+        if not line.startswith(b'*'):
+            # 内联命令（例如 redis-cli 的 PING）
+            return line.split()
+        args = []
+        for _ in range(int(line[1:-2])):
+            length = int(self.rfile.readline()[1:-2])
+            args.append(self.rfile.read(length + 2)[:-2])
+        return args
+
+    def _write(self, value):
+        if value is None:
+            self.wfile.write(b'$-1\r\n')
+        elif isinstance(value, int):
+            self.wfile.write(f':{value}\r\n'.encode())
+        elif isinstance(value, str):
+            self.wfile.write(f'+{value}\r\n'.encode())
+        elif isinstance(value, Exception):
+            self.wfile.write(f'-ERR {value}\r\n'.encode())
+        elif isinstance(value, list):
+            self.wfile.write(f'*{len(value)}\r\n'.encode())
+            for item in value:
+                self._write(item)
+            return
+        else:
+            self.wfile.write(f'${len(value)}\r\n'.encode() + value + b'\r\n')
+
+    def handle(self):
+        while True:
+            args = self._read_command()
+            if args is None:
+                return
+            if not args:
+                continue
+            try:
+                reply = self._execute(args[0].decode().upper(), args[1:])
+            except Exception as e:
+                reply = e
+            self._write(reply)
+            self.wfile.flush()
+
+    def _execute(self, cmd, args):
+        server = self.server
+        with server.lock:
+            if cmd in ('PING', 'AUTH', 'SELECT'):
+                return 'PONG' if cmd == 'PING' else 'OK'
+            if cmd == 'SET':
+                expires_at = None
+                if len(args) >= 4 and args[2].upper() == b'EX':
+                    expires_at = time.time() + int(args[3])
+                server.values[args[0]] = (args[1], expires_at)
+                return 'OK'
+            if cmd == 'GET':
+                item = server.values.get(args[0])
+                if item is None or (item[1] is not None and item[1] < time.time()):
+                    server.values.pop(args[0], None)
+                    return None
+                return item[0]
+            if cmd == 'DEL':
+                removed = sum(1 for k in args if server.values.pop(k, None) is not None
+                              or server.hashes.pop(k, None) is not None)
+                return removed
+            if cmd == 'HSET':
+                h = server.hashes.setdefault(args[0], {})
+                added = 0
+                for i in range(1, len(args) - 1, 2):
+                    added += args[i] not in h
+                    h[args[i]] = args[i + 1]
+                return added
+            if cmd == 'HGET':
+                return server.hashes.get(args[0], {}).get(args[1])
+            if cmd == 'HDEL':
+                h = server.hashes.get(args[0], {})
+                return sum(1 for f in args[1:] if h.pop(f, None) is not None)
+            if cmd == 'HGETALL':
+                result = []
+                for field, value in server.hashes.get(args[0], {}).items():
+                    result += [field, value]
+                return result
+        raise StoreError(f"unknown command '{cmd}'")
+
+
+if __name__ == '__main__':
+    import argparse
+
+    parser = argparse.ArgumentParser(description='本地共享存储替身（Redis 协议）')
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=6379)
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO)
+    server = RespServer((args.host, args.port))
+    logger.info(f"共享存储替身已启动: {args.host}:{args.port}")
+    server.serve_forever()
@@ -0,0 +1,148 @@
+import json
+import logging
+import os
+import subprocess
+import sys
+import tempfile
+import uuid
+
+from storage import StorageFullError, estimate_size
+
+logger = logging.getLogger(__name__)
+
+READ_CHUNK_SIZE = 64 * 1024
+
+# 可以边下边发的格式：(yt-dlp 格式选择, Content-Type, 需要时的 ffmpeg 转码参数)
+STREAM_FORMATS = {
+    # best 只会选已经合并好音视频的单一文件，不需要 ffmpeg 合并
+    'mp4': ('best[ext=mp4]/best', 'video/mp4', None),
+    # 仅音频流，经 ffmpeg 管道实时转成 mp3
+    'mp3': ('bestaudio/best', 'audio/mpeg', ['-vn', '-f', 'mp3', '-b:a', '192k']),
+}
+
+
+class StreamError(Exception):
+    """流式下载在开始发送数据之前失败"""
+
+
+class MediaStream:
+    """用 yt-dlp 子进程把媒体写到 stdout，边下载边发送给客户端，可选同时写入下载目录"""
+
+    def __init__(self, info, format_type, ffmpeg_path, tee_dir=None, on_complete=None, storage=None):
+        if format_type not in STREAM_FORMATS:
+            raise StreamError(f'不支持流式下载的格式: {format_type}')
+        self.info = info
+        self.format_type = format_type
+        self.format_spec, self.mimetype, self.transcode_args = STREAM_FORMATS[format_type]
+        self.ffmpeg_path = ffmpeg_path
+        self.tee_dir = tee_dir
+        self.on_complete = on_complete
+        # 写副本前向 StorageManager 预留空间，空间不足时只发送不保存
+        self.storage = storage
+        self._reserve_key = None
+        self._procs = []
+        self._info_path = None
+        self._stderr = None
+        self._tee_path = None
+        self._tee_file = None
+
+    def _start(self):
+        # 复用已提取的元数据，子进程不必再请求网页
+        fd, self._info_path = tempfile.mkstemp(prefix='stream_', suffix='.info.json')
+        with os.fdopen(fd, 'w', encoding='utf-8') as f:
+            json.dump(self.info, f)
+        self._stderr = tempfile.TemporaryFile()
+        ytdlp = subprocess.Popen(
+            [sys.executable, '-m', 'yt_dlp', '--quiet', '--no-warnings', '--no-part',
+             '--ffmpeg-location', self.ffmpeg_path,
+             '--load-info-json', self._info_path, '-f', self.format_spec, '-o', '-'],
+            stdout=subprocess.PIPE, stderr=self._stderr, stdin=subprocess.DEVNULL,
+        )
+        self._procs.append(ytdlp)
+        output = ytdlp.stdout
+        if self.transcode_args:
+            ffmpeg = subprocess.Popen(
+                [os.path.join(self.ffmpeg_path, 'ffmpeg'), '-loglevel', 'error', '-i', 'pipe:0',
+                 *self.transcode_args, 'pipe:1'],
+                stdin=ytdlp.stdout, stdout=subprocess.PIPE, stderr=self._stderr,
+            )
+            # 让 ffmpeg 独占管道，yt-dlp 退出时 ffmpeg 能收到 EOF
+            ytdlp.stdout.close()
+            self._procs.append(ffmpeg)
+            output = ffmpeg.stdout
+        if self.tee_dir:
+            name = f".stream_{uuid.uuid4().hex}"
+            if self.storage is not None:
+                try:
+                    self.storage.reserve(name, estimate_size(self.info))
+                    self._reserve_key = name
+                except StorageFullError as e:
+                    logger.warning(f"空间不足，流式下载不保存副本: {str(e)}")
+                    return output
+            self._tee_path = os.path.join(self.tee_dir, f"{name}.{self.format_type}.part")
+            self._tee_file = open(self._tee_path, 'wb')
+        return output
+
+    def _error_output(self):
+        if self._stderr is None:
+            return ''
+        self._stderr.seek(0)
+        return self._stderr.read().decode('utf-8', 'replace').strip()[-500:]
+
+    def chunks(self):
+        """生成响应数据块；客户端断开时生成器被关闭，子进程随之终止"""
+        completed = False
+        try:
+            output = self._start()
+            sent = 0
+            while True:
+                chunk = output.read1(READ_CHUNK_SIZE) if hasattr(output, 'read1') else output.read(READ_CHUNK_SIZE)
+                if not chunk:
+                    break
+                if self._tee_file is not None:
+                    self._tee_file.write(chunk)
+                sent += len(chunk)
+                yield chunk
+            failed = [p.wait() for p in self._procs]
+            if any(failed):
+                message = self._error_output() or '子进程异常退出'
+                if sent == 0:
+                    raise StreamError(message)
+                # 已经开始发送，只能截断响应
+                logger.error(f"流式下载中途失败: {message}")
+                return
+            completed = True
+            logger.info(f"流式下载完成，共发送 {sent/1024/1024:.2f} MB")
+        finally:
+            self._cleanup(completed)
+
+    def _cleanup(self, completed):
+        for p in self._procs:
+            if p.poll() is None:
+                p.kill()
+                p.wait()
+            if p.stdout is not None:
+                p.stdout.close()
+        if self._stderr is not None:
+            self._stderr.close()
+        if self._info_path:
+            try:
+                os.remove(self._info_path)
+            except OSError:
+                pass
+        if self._tee_file is not None:
+            self._tee_file.close()
+            if completed and self.on_complete is not None:
+                try:
+                    self.on_complete(self._tee_path)
+                except Exception as e:
+                    logger.error(f"保存流式下载文件失败: {str(e)}")
+            # 未完成（客户端断开、子进程失败）时删除不完整的副本
+            try:
+                os.remove(self._tee_path)
+            except FileNotFoundError:
+                pass
+            except OSError as e:
+                logger.warning(f"删除流式下载副本失败 {self._tee_path}: {str(e)}")
+        if self._reserve_key is not None:
+            self.storage.release(self._reserve_key)
@@ -0,0 +1,70 @@
+import os
+import sys
+
+import pytest
+from flask import Flask
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from fileserve import MAX_RANGES, parse_byte_ranges, serve_file  # noqa: E402
+
+DATA = bytes(range(256)) * 40
+
+
+@pytest.fixture
+def client(tmp_path):
+    path = tmp_path / 'clip.mp4'
+    path.write_bytes(DATA)
+    st = os.stat(path)
+    entry = {'name': 'clip.mp4', 'size': st.st_size, 'mtime': st.st_mtime, 'mtime_ns': st.st_mtime_ns}
+    app = Flask(__name__)
+
+    @app.route('/file')
+    def get_file():
+        return serve_file(str(path), entry)
+
+    return app.test_client()
+
+
+def test_parse_byte_ranges_keeps_overlapping_and_unsorted():
+    assert parse_byte_ranges('bytes=0-10,5-20') == [(0, 11), (5, 21)]
+    assert parse_byte_ranges('bytes=100-,-50,3-4') == [(100, None), (-50, None), (3, 5)]
+    assert parse_byte_ranges('bytes=10-5,0-1') is None
+    assert parse_byte_ranges('items=0-1,2-3') is None
+
+
+def test_overlapping_ranges_are_merged(client):
+    rv = client.get('/file', headers={'Range': 'bytes=0-10,5-20'})
+    assert rv.status_code == 206
+    assert rv.headers['Content-Range'] == f'bytes 0-20/{len(DATA)}'
+    assert rv.data == DATA[0:21]
+
+
+def test_unsorted_ranges_are_sorted_into_multipart(client):
+    rv = client.get('/file', headers={'Range': 'bytes=100-109,0-9'})
+    assert rv.status_code == 206
+    assert rv.mimetype == 'multipart/byteranges'
+    body = rv.data
+    assert body.index(DATA[0:10]) < body.index(DATA[100:110])
+    assert len(body) == rv.content_length
+
+
+def test_too_many_ranges_send_whole_file(client):
+    spec = ','.join(f'{i * 100}-{i * 100 + 9}' for i in range(MAX_RANGES + 4))
+    rv = client.get('/file', headers={'Range': f'bytes={spec}'})
+    assert rv.status_code == 200
+    assert rv.data == DATA
+    assert rv.headers['Accept-Ranges'] == 'bytes'
+
+
+def test_too_many_ranges_still_honour_if_none_match(client):
+    etag = client.get('/file').headers['ETag']
+    spec = ','.join(f'{i * 100}-{i * 100 + 9}' for i in range(MAX_RANGES + 4))
+    rv = client.get('/file', headers={'Range': f'bytes={spec}', 'If-None-Match': etag})
+    assert rv.status_code == 304
+
+
+def test_unsatisfiable_ranges_return_416(client):
+    rv = client.get('/file', headers={'Range': f'bytes={len(DATA) + 10}-{len(DATA) + 20},{len(DATA) + 30}-'})
+    assert rv.status_code == 416
+    assert rv.headers['Content-Range'] == f'bytes */{len(DATA)}'
@@ -0,0 +1,100 @@
+import contextlib
+import logging
+import threading
+from urllib.parse import urlsplit
+
+logger = logging.getLogger(__name__)
+
+
+class HostLimiter:
+    """按域名限制同时打开的下载连接数（分片并发数之和）"""
+
+    def __init__(self, max_per_host=16):
+        self.max_per_host = max_per_host
+        self._in_use = {}
+        self._cond = threading.Condition()
+
+    @contextlib.contextmanager
+    def connections(self, url, wanted):
+        """申请 wanted 个连接，至少分到 1 个；返回实际分到的数量"""
+        host = urlsplit(url or '').hostname or ''
+        if not self.max_per_host or not host:
+            yield wanted
+            return
+        with self._cond:
+            while self._in_use.get(host, 0) >= self.max_per_host:
+                self._cond.wait()
+            granted = min(wanted, self.max_per_host - self._in_use.get(host, 0))
+            self._in_use[host] = self._in_use.get(host, 0) + granted
+        if granted < wanted:
+            logger.info(f"{host} 连接数已接近上限，分片并发降为 {granted}")
+        try:
+            yield granted
+        finally:
+            with self._cond:
+                self._in_use[host] -= granted
+                if self._in_use[host] <= 0:
+                    del self._in_use[host]
+                self._cond.notify_all()
+
+
+class BandwidthBudget:
+    """全局带宽预算：每个下载开始时按当前活跃下载数平分总带宽（字节/秒）。
+
+    yt-dlp 的限速在下载开始时确定，所以这是近似值：已经在下载的流不会因为新流加入而降速。"""
+
+    def __init__(self, total_bytes_per_sec=0):
+        self.total = total_bytes_per_sec
+        self._active = 0
+        self._lock = threading.Lock()
+
+    def active(self):
+        with self._lock:
+            return self._active
+
+    @contextlib.contextmanager
+    def share(self):
+        """登记一个活跃下载，返回它可用的限速值（不限速时为 None）"""
+        with self._lock:
+            self._active += 1
+            active = self._active
+        try:
+            yield max(self.total // active, 1) if self.total else None
+        finally:
+            with self._lock:
+                self._active -= 1
+
+
+class CombinedProgress:
+    """把并行下载的多个流的进度合并成一个 yt-dlp 风格的进度回调"""
+
+    def __init__(self, hook, count):
+        self._hook = hook
+        self._streams = [{} for _ in range(count)]
+        self._lock = threading.Lock()
+
+    def stream_hook(self, index):
+        def hook(d):
+            with self._lock:
+                self._streams[index] = d
+                streams = list(self._streams)
+            if d.get('status') == 'finished' and not all(s.get('status') == 'finished' for s in streams):
+                # 还有流没下完，继续按下载中汇报
+                d = dict(d, status='downloading')
+            if d.get('status') != 'downloading':
+                self._hook(d)
+                return
+            downloaded = sum(s.get('downloaded_bytes') or 0 for s in streams)
+            total = sum(s.get('total_bytes') or s.get('total_bytes_estimate') or 0 for s in streams)
+            speed = sum(s.get('speed') or 0 for s in streams if s.get('status') == 'downloading')
+            etas = [s.get('eta') for s in streams if s.get('status') == 'downloading' and s.get('eta')]
+            self._hook({
+                'status': 'downloading',
+                'downloaded_bytes': downloaded,
+                'total_bytes': total,
+                'speed': speed,
+                '_speed_str': f"{speed / 1024 / 1024:.2f}MiB/s" if speed else '',
+                '_eta_str': f"{int(max(etas))}s" if etas else '',
+                'filename': d.get('filename', ''),
+            })
+        return hook
@@ -0,0 +1,199 @@
+import json
+import logging
+import os
+import re
+import shutil
+import subprocess
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+# 只需要音频的输出格式
+AUDIO_FORMATS = ('mp3', 'm4a', 'opus')
+
+# 各输出格式：容器（ffmpeg muxer 及其 format_name 中的标识）、可直接复制的编码、需要转码时的编码器
+TARGETS = {
+    'mp3': {'muxer': 'mp3', 'container': 'mp3', 'audio': ('mp3',), 'audio_encoder': 'libmp3lame', 'video': None},
+    'm4a': {'muxer': 'ipod', 'container': 'mp4', 'audio': ('aac', 'alac'), 'audio_encoder': 'aac', 'video': None},
+    'opus': {'muxer': 'opus', 'container': 'ogg', 'audio': ('opus',), 'audio_encoder': 'libopus', 'video': None},
+    'mp4': {
+        'muxer': 'mp4', 'container': 'mp4',
+        'audio': ('aac', 'mp3', 'opus', 'alac'), 'audio_encoder': 'aac',
+        # vp9 也能封装进 mp4（和 yt-dlp 合并时一样），只有 mp4 放不下的编码才转码
+        'video': ('h264', 'hevc', 'av1', 'mpeg4', 'vp9'), 'video_encoder': 'libx264',
+        'extra': ['-movflags', '+faststart'],
+    },
+}
+
+# 各格式的质量档位，只在需要转码时使用
+PRESETS = {
+    'mp3': {'high': ['-b:a', '320k'], 'standard': ['-b:a', '192k'], 'small': ['-b:a', '128k']},
+    'm4a': {'high': ['-b:a', '256k'], 'standard': ['-b:a', '192k'], 'small': ['-b:a', '128k']},
+    'opus': {'high': ['-b:a', '160k'], 'standard': ['-b:a', '128k'], 'small': ['-b:a', '96k']},
+    'mp4': {
+        'high': ['-preset', 'slow', '-crf', '18', '-b:a', '192k'],
+        'standard': ['-preset', 'veryfast', '-crf', '23', '-b:a', '160k'],
+        'small': ['-preset', 'veryfast', '-crf', '28', '-b:a', '128k'],
+    },
+}
+DEFAULT_PRESET = 'standard'
+
+_INPUT_RE = re.compile(r'^Input #0, (.+?), from ')
+_STREAM_RE = re.compile(r'Stream #0:\d+.*?: (Audio|Video): (\w+)')
+
+
+class TranscodeError(Exception):
+    """ffmpeg 处理失败"""
+
+
+class TranscodeEngine:
+    """下载后的转换：先探测源编码，能复制就只重新封装，需要转码时放进有限的 ffmpeg 进程池"""
+
+    def __init__(self, ffmpeg_path, workers=1, threads=1, nice=10, presets=None, on_finish=None):
+        self.ffmpeg = os.path.join(ffmpeg_path, 'ffmpeg')
+        self.ffprobe = os.path.join(ffmpeg_path, 'ffprobe')
+        self.workers = max(1, workers)
+        self.threads = threads
+        self.nice = nice
+        # 每种格式使用的档位，如 {'mp3': 'high'}
+        self.presets = presets or {}
+        self._slots = threading.BoundedSemaphore(self.workers)
+        self._nice_cmd = shutil.which('nice') if nice else None
+        # 每次处理完成后以 (方式, 耗时秒数) 调用，方式为 copy 或 encode
+        self.on_finish = on_finish
+
+    def probe(self, path):
+        """返回 {'container': format_name, 'streams': [{'type', 'codec'}]}"""
+        if os.path.exists(self.ffprobe):
+            out = subprocess.run(
+                [self.ffprobe, '-v', 'error', '-print_format', 'json', '-show_format', '-show_streams', path],
+                capture_output=True, stdin=subprocess.DEVNULL,
+            )
+            if out.returncode == 0:
+                data = json.loads(out.stdout or b'{}')
+                return {
+                    'container': data.get('format', {}).get('format_name', ''),
+                    'streams': [
+                        {'type': s.get('codec_type'), 'codec': s.get('codec_name')}
+                        for s in data.get('streams', []) if s.get('codec_type') in ('audio', 'video')
+                    ],
+                }
+        # 没有 ffprobe 时解析 ffmpeg -i 的输出
+        out = subprocess.run([self.ffmpeg, '-hide_banner', '-i', path], capture_output=True, stdin=subprocess.DEVNULL)
+        container = ''
+        streams = []
+        for line in out.stderr.decode('utf-8', 'replace').splitlines():
+            line = line.strip()
+            m = _INPUT_RE.match(line)
+            if m:
+                container = m.group(1)
+                continue
+            m = _STREAM_RE.search(line)
+            # 封面图片（attached pic）不算视频流
+            if m and 'attached pic' not in line:
+                streams.append({'type': m.group(1).lower(), 'codec': m.group(2)})
+        return {'container': container, 'streams': streams}
+
+    def plan(self, probe, format_type, preset=None):
+        """生成 ffmpeg 输出参数；已经是目标格式时返回 None。第二个返回值表示是否需要转码"""
+        target = TARGETS[format_type]
+        streams = probe['streams']
+        audio = [s for s in streams if s['type'] == 'audio']
+        video = [s for s in streams if s['type'] == 'video']
+        if not audio and not video:
+            raise TranscodeError('文件中没有音视频流')
+        if target['video'] is None and not audio:
+            raise TranscodeError('文件中没有音频流')
+
+        args = ['-map_metadata', '0']
+        encode = False
+        if target['video'] is None:
+            args += ['-map', '0:a:0', '-vn']
+            audio, video = audio[:1], []
+        else:
+            args += ['-map', '0:v:0?', '-map', '0:a:0?']
+            audio, video = audio[:1], video[:1]
+
+        copy_all = True
+        if video:
+            if video[0]['codec'] in target['video']:
+                args += ['-c:v', 'copy']
+            else:
+                args += ['-c:v', target['video_encoder'], '-pix_fmt', 'yuv420p']
+                encode = True
+                copy_all = False
+        if audio:
+            if audio[0]['codec'] in target['audio']:
+                args += ['-c:a', 'copy']
+            else:
+                args += ['-c:a', target['audio_encoder']]
+                encode = True
+                copy_all = False
+
+        # 编码和容器都符合，且没有多余的流，无需处理
+        extra_streams = len(probe['streams']) > len(audio) + len(video)
+        if copy_all and not extra_streams and target['container'] in probe['container'].split(','):
+            return None, False
+
+        if encode:
+            preset = preset or self.presets.get(format_type) or DEFAULT_PRESET
+            args += PRESETS[format_type].get(preset, PRESETS[format_type][DEFAULT_PRESET])
+            args += ['-threads', str(self.threads)]
+        args += target.get('extra', [])
+        args += ['-f', target['muxer']]
+        return args, encode
+
+    def convert(self, src, dest, format_type, preset=None, check=None):
+        """把 src 转成 format_type 写到 dest，返回最终文件路径（无需处理时直接返回 src）。
+
+        check 在等待期间定期调用，抛出异常即终止 ffmpeg（用于取消任务）。"""
+        if format_type not in TARGETS:
+            return src
+        probe = self.probe(src)
+        if not probe['streams']:
+            # 探测不到流时保留原文件，和引入转换之前的行为一致
+            logger.warning(f"无法识别文件中的音视频流，跳过转换: {src}")
+            return src
+        args, encode = self.plan(probe, format_type, preset)
+        codecs = ', '.join(f"{s['type']}:{s['codec']}" for s in probe['streams'])
+        if args is None:
+            logger.info(f"源文件已是 {format_type} ({codecs})，无需转换")
+            return src
+        cmd = [self.ffmpeg, '-y', '-loglevel', 'error', '-i', src] + args + [dest]
+        if not encode:
+            logger.info(f"流复制封装为 {format_type} ({codecs})")
+            self._run(cmd, check, 'copy')
+            return dest
+        if self._nice_cmd:
+            cmd = [self._nice_cmd, '-n', str(self.nice)] + cmd
+        logger.info(f"转码为 {format_type} ({codecs})，等待转码进程")
+        while not self._slots.acquire(timeout=1):
+            if check is not None:
+                check()
+        try:
+            self._run(cmd, check, 'encode')
+        finally:
+            self._slots.release()
+        return dest
+
+    def _run(self, cmd, check, mode):
+        started = time.monotonic()
+        proc = subprocess.Popen(cmd, stdin=subprocess.DEVNULL, stdout=subprocess.DEVNULL, stderr=subprocess.PIPE)
+        stderr = b''
+        try:
+            while True:
+                try:
+                    stderr = proc.communicate(timeout=1)[1]
+                    break
+                except subprocess.TimeoutExpired:
+                    if check is not None:
+                        check()
+        finally:
+            if proc.poll() is None:
+                proc.kill()
+                proc.wait()
+        if proc.returncode != 0:
+            raise TranscodeError(f"ffmpeg 处理失败: {stderr.decode('utf-8', 'replace')[-300:]}")
+        if self.on_finish is not None:
+            self.on_finish(mode, time.monotonic() - started)
@@ -119,7 +119,8 @@ def download_video():
             video_title = info.get('title', None)
             
             logger.info(f"Starting download: {video_title}")
-            ydl.download([url])
+            # 复用上面提取的元数据，避免 ydl.download 再次提取
+            ydl.process_ie_result(ydl.sanitize_info(info, remove_private_keys=True), download=True)
             
             files = [f for f in os.listdir(DOWNLOAD_FOLDER) 
                     if os.path.isfile(os.path.join(DOWNLOAD_FOLDER, f))]